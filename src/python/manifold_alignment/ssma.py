@@ -16,7 +16,7 @@ from scipy.sparse import coo_matrix, csr_matrix, block_diag, vstack
 
 
 from manifold_learning.se import sim_potential
-from utils.graph_construction import create_feature_mat, compute_adjacency, \
+from utils.graph import create_feature_mat, compute_adjacency, \
                                create_laplacian
 from utils.eigenvalue_decomposition import EigSolver
 
@@ -65,6 +65,8 @@ class ManifoldAlignment(object):
                  weight = 'heat',
                  gamma = 1.0,
                  trees = 10,
+                 knn_cache = False,
+                 graph_store = None,
 
                  # potential matrix initials
                  normalization = 'dis',
@@ -102,6 +104,8 @@ class ManifoldAlignment(object):
          self.affinity = affinity
          self.gamma = gamma
          self.trees = trees
+         self.knn_cache = knn_cache
+         self.graph_store = graph_store
 
          # potential matrix initials
          self.sp_neighbors = sp_neighbors
@@ -321,7 +325,9 @@ class ManifoldAlignment(object):
                                         neighbors_algorithm=self.nn_algo,
                                         metric=self.metric,
                                         trees=self.trees,
-                                        gamma=self.gamma) \
+                                        gamma=self.gamma,
+                                        cache=self.knn_cache,
+                                        store=self.graph_store) \
                                             for dataset in X]
 
         ''' TODO: list comprehensions of list comprehensions for different
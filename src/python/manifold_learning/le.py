@@ -13,6 +13,8 @@ from utils.graph import create_laplacian, create_adjacency, \
                                      compute_adjacency
 
 from utils.eigenvalue_decomposition import EigSolver
+from utils.operators import laplacian_operator
+from manifold_learning.se import get_alpha
 
 
 class LaplacianEigenmaps(BaseEstimator):
@@ -24,8 +26,8 @@ class LaplacianEigenmaps(BaseEstimator):
     n_components : integer, optional, default=2
         number of features for the manifold (=< features of data)
 
-    eig_solver : string ['dense', 'multi', 'sparse'], optional, default='dense'
-        eigenvalue solver method
+    eig_solver : string ['auto'|'dense'|'arpack'|'multi'|'randomized']
+        eigenvalue solver method, default='dense'
 
     norm_lap : bool, optional, default=False
         normalized laplacian or not
@@ -39,8 +41,47 @@ class LaplacianEigenmaps(BaseEstimator):
 
     n_neighbors :
 
+    weight : string ['heat'|'local'|'angle'], optional, default='heat'
+        'local' is the self-tuning heat kernel, scaled by the distance of
+        every point to its n_neighbors-th neighbor instead of by gamma
+
+    knn_cache : bool or KnnCache, optional, default=False
+        cache of the k-nearest neighbor results (True shares
+        utils.knn_solvers.knn_cache with the other estimators)
+
+    graph_store : str or GraphStore, optional, default=None
+        on-disk store the adjacency graph is loaded from (or saved to)
+
+    radius : float, optional, default=None
+        neighborhood radius of the 'radius' (epsilon-neighborhood)
+        affinity
+
+    max_degree : int, optional, default=None
+        maximum number of neighbors per point (a hard cap: an edge is
+        kept when both of its points keep it)
+
+    symmetrize : string ['or'|'and'], optional, default='or'
+        'and' builds the mutual k-nearest neighbor graph
+
+    sparsify : float, optional, default=None
+        expected fraction of the edges kept by the spectral sparsifier
+
+    dtype : numpy dtype, optional, default=np.float64
+        dtype of the data, adjacency and Laplacian matrices (np.float32
+        halves their memory)
+
+    warm_start : bool, default=False
+        keep the eigensolver between fits: with eig_solver='multi' every
+        fit starts LOBPCG from the eigenvectors of the previous one (e.g.
+        along a sweep over alpha), see EigSolver
+
     Attributes
     ----------
+    eig_solver_ : str
+        the eigensolver that ran (the choice of eig_solver='auto')
+
+    eig_time_ : float
+        the time of the eigenvalue decomposition, in seconds
 
     _spectral_embedding :
 
@@ -60,7 +101,15 @@ class LaplacianEigenmaps(BaseEstimator):
                  eigen_tol = 1E-12, regularizer = None,
                  normalization = None, n_neighbors = 2,neighbors_algorithm = 'brute',
                  metric = 'euclidean',n_jobs = 1,weight = 'heat',affinity = None,
-                 gamma = 1.0,trees = 10,sparse = True,random_state = 0):
+                 gamma = 1.0,trees = 10,sparse = True,random_state = 0,
+                 knn_cache = False,
+                 graph_store = None,
+                 radius = None,
+                 max_degree = None,
+                 symmetrize = 'or',
+                 sparsify = None,
+                 dtype = np.float64,
+                 warm_start = False):
         self.n_components = n_components
         self.eig_solver = eig_solver
         self.regularizer = regularizer
@@ -75,14 +124,22 @@ class LaplacianEigenmaps(BaseEstimator):
         self.affinity = affinity
         self.gamma = gamma
         self.trees = trees
-        self.sparse = False,
+        self.sparse = sparse
         self.random_state = random_state
+        self.knn_cache = knn_cache
+        self.graph_store = graph_store
+        self.radius = radius
+        self.max_degree = max_degree
+        self.symmetrize = symmetrize
+        self.sparsify = sparsify
+        self.dtype = dtype
+        self.warm_start = warm_start
 
     def fit(self, X, y=None):
 
         # TODO: handle sparse case of data entry
         # check the array
-        X = check_array(X)
+        X = check_array(X, dtype=self.dtype)
 
         # compute the adjacency matrix for X
         W = compute_adjacency(X,
@@ -93,17 +150,38 @@ class LaplacianEigenmaps(BaseEstimator):
                               neighbors_algorithm=self.neighbors_algorithm,
                               gamma=self.gamma,
                               trees=self.trees,
-                              n_jobs=self.n_jobs)
+                              n_jobs=self.n_jobs,
+                              cache=self.knn_cache,
+                              store=self.graph_store,
+                              radius=self.radius,
+                              max_degree=self.max_degree,
+                              symmetrize=self.symmetrize,
+                              sparsify=self.sparsify,
+                              dtype=self.dtype)
 
         # compute the projections into the new space
-        self.eigVals, self.embedding_ = self._spectral_embedding(X, W)
+        self.eigVals, self.embedding_, eig_model = \
+            self._spectral_embedding(X, W)
+        self._keep_eig_model(eig_model)
+        self.eig_solver_ = eig_model.eig_solver_
+        self.eig_time_ = eig_model.eig_time_
 
         return self
 
+    # eigensolver of the previous fit, when warm starting
+    def _warm_eig_model(self):
+        if self.warm_start:
+            return getattr(self, 'eig_model_', None)
+        return None
+
+    def _keep_eig_model(self, eig_model):
+        if self.warm_start:
+            self.eig_model_ = eig_model
+
     # Compute the projection of X into the new space
     def fit_transform(self, X):
         # check the array and see if it satisfies the requirements
-        X = check_array(X)
+        X = check_array(X, dtype=self.dtype)
         self.fit(X)
 
         return self.embedding_
@@ -115,7 +193,12 @@ class LaplacianEigenmaps(BaseEstimator):
         return graph_embedding(adjacency=W, norm_laplace=self.norm_laplace,
                                normalization=self.normalization,
                                eig_solver=self.eig_solver,
-                               eig_tol=self.eigen_tol)
+                               eig_tol=self.eigen_tol,
+                               sparse=self.sparse,
+                               dtype=self.dtype,
+                               warm_start=self.warm_start,
+                               eig_model=self._warm_eig_model(),
+                               return_solver=True)
 
 
 def graph_embedding(adjacency,
@@ -123,16 +206,22 @@ def graph_embedding(adjacency,
                     norm_method = 'degree', normalization= None, mu=1.0,
                     ss_potential=None, alpha=17.78,
                     pl_potential=None, beta=1.0,
-                    n_components=2,eig_solver=None,eig_tol=1E-12,):
+                    n_components=2,eig_solver=None,eig_tol=1E-12,
+                    sparse=False,
+                    dtype=None, warm_start=False, eig_model=None,
+                    return_solver=False):
     """
     Returns
     -------
     eigenvalues
     eigenvectors
-    TODO - time elapse
+    eig_model : the EigSolver, with the solver used (eig_solver_) and
+        its time (eig_time_), if return_solver. With warm_start, the
+        EigSolver of a previous solve can be passed in (eig_model) to
+        start from its eigenvectors.
     """
     # create laplacian and diagonal degree matrix
-    L, D = create_laplacian(adjacency, norm_lap=norm_laplace)
+    L, D = create_laplacian(adjacency, norm_lap=norm_laplace, dtype=dtype)
 
     #-------------------------------
     # Tune the Eigenvalue Problem
@@ -152,11 +241,11 @@ def graph_embedding(adjacency,
         if not alpha:
             alpha = 17.78
         alpha = get_alpha(alpha, L, ss_potential)
-        A = L + alpha * ss_potential
+        A = laplacian_operator(L, ss_potential, alpha)
 
     elif not pl_potential == None:          # partial-labels potential
         beta = get_alpha(beta, L, pl_potential)
-        A = L + beta * pl_potential
+        A = laplacian_operator(L, pl_potential, beta)
 
     else:                       # no potential (standard Laplacian)
         A = L
@@ -166,14 +255,23 @@ def graph_embedding(adjacency,
     #-------------------------------
 
     # initialize the EigSolver class
+    previous = eig_model
     eig_model = EigSolver(n_components=n_components,
                           eig_solver=eig_solver,
                           sparse=sparse,
                           tol=eig_tol,
-                          norm_laplace=norm_laplace)
+                          norm_laplace=norm_laplace,
+                          dtype=dtype,
+                          warm_start=warm_start)
+    if warm_start and hasattr(previous, 'info_'):
+        # start from the last block of the previous solve
+        eig_model.info_ = previous.info_
 
     # return the eigenvalues and eigenvectors
-    return eig_model.find_eig(A=A, B=B)
+    eigVals, eigVecs = eig_model.find_eig(A=A, B=B)
+    if return_solver:
+        return eigVals, eigVecs, eig_model
+    return eigVals, eigVecs
 
 def swiss_roll_test():
 
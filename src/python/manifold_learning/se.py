@@ -8,19 +8,21 @@ from __future__ import division
 from __future__ import absolute_import
 
 from sklearn.base import BaseEstimator, TransformerMixin
-from sklearn.utils import check_array
+from sklearn.utils import check_array, check_random_state
 
 import numpy as np
 from scipy import sparse
-from scipy.sparse import csr_matrix, csc_matrix, spdiags, identity
+from scipy.sparse import csr_matrix, csc_matrix, coo_matrix, spdiags, identity
 
 from utils.nearestneighbor_solver import knn_scikit, knn_annoy
 from utils.graph import create_laplacian, create_adjacency, \
                                create_feature_mat, maximum, \
-                               compute_adjacency
+                               compute_adjacency, symmetric_csr
+from utils.laplacian import laplacian
 from utils.eigenvalue_decomposition import EigSolver
+from utils.operators import laplacian_operator
+from utils.knn_solvers import KnnSolver
 
-import pandas as pd
 
 
 
@@ -41,8 +43,67 @@ class SchroedingerEigenmaps(BaseEstimator):
     affinity : string ['connectivity' | 'heat' | 'cosine']
         weight function to use for the weighted adjacency matrix
 
+    weight : string ['heat' | 'local' | 'angle'], default='heat'
+        'local' is the self-tuning heat kernel, scaled by the distance of
+        every point to its n_neighbors-th neighbor instead of by gamma
+
     gamma : integer
 
+    sp_neighbors : integer, default=4
+        number of neighbors for the spatial-spectral potential. With the
+        'raster' algorithm this is the pixel connectivity (4 or 8).
+
+    sp_algorithm : string ['raster'|'brute'], default='raster'
+        'raster' takes the potential neighbors from the pixel grid of
+        X_img, 'brute' searches the spectral k-nearest neighbors
+
+    sp_radius : integer, default=1
+        window radius of the 'raster' neighbors
+
+    alpha_scaling : string ['trace'|'spectral'|'frobenius'|None], default='trace'
+        ratio of the Laplacian and potential statistics that scales
+        alpha (see get_alpha)
+
+    knn_cache : bool or KnnCache, default=False
+        cache of the k-nearest neighbor results shared by the adjacency
+        and potential searches (True shares utils.knn_solvers.knn_cache
+        with the other estimators)
+
+    graph_store : str or GraphStore, default=None
+        on-disk store the adjacency graph is loaded from (or saved to)
+
+    radius : float, default=None
+        neighborhood radius of the 'radius' (epsilon-neighborhood)
+        affinity
+
+    max_degree : int, default=None
+        maximum number of neighbors per point (a hard cap: an edge is
+        kept when both of its points keep it)
+
+    symmetrize : string ['or'|'and'], default='or'
+        'and' builds the mutual k-nearest neighbor graph
+
+    sparsify : float, default=None
+        expected fraction of the edges kept by the spectral sparsifier
+
+    dtype : numpy dtype, default=np.float64
+        dtype of the data, adjacency, Laplacian and potential matrices.
+        np.float32 halves their memory; the sparse eigensolvers then
+        work in single precision.
+
+    warm_start : bool, default=False
+        keep the eigensolver between fits: with eig_solver='multi' every
+        fit starts LOBPCG from the eigenvectors of the previous one (e.g.
+        along a sweep over alpha), see EigSolver
+
+    Attributes
+    ----------
+    eig_solver_ : str
+        the eigensolver that ran (the choice of eig_solver='auto')
+
+    eig_time_ : float
+        the time of the eigenvalue decomposition, in seconds
+
     References
     ----------
 
@@ -71,15 +132,26 @@ class SchroedingerEigenmaps(BaseEstimator):
                  potential = None,           # potential matrices parameters
                  X_img = None,
                  sp_neighbors = 4,
+                 sp_algorithm = 'raster',
+                 sp_radius = 1,
                  sp_affinity = 'heat',
                  alpha = 17.78,
+                 alpha_scaling = 'trace',
                  eta = 1.0,
                  beta = 1.0,
                  n_components=2,
                  eig_solver = 'dense',
                  eig_tol = 1E-12,
                  sparse = False,
-                 random_state=0):
+                 random_state=0,
+                 knn_cache = False,
+                 graph_store = None,
+                 radius = None,
+                 max_degree = None,
+                 symmetrize = 'or',
+                 sparsify = None,
+                 dtype = np.float64,
+                 warm_start = False):
         self.n_neighbors = n_neighbors
         self.neighbors_algorithm = neighbors_algorithm
         self.metric = metric
@@ -95,8 +167,11 @@ class SchroedingerEigenmaps(BaseEstimator):
         self.potential = potential
         self.X_img = X_img
         self.sp_neighbors = sp_neighbors
+        self.sp_algorithm = sp_algorithm
+        self.sp_radius = sp_radius
         self.sp_affinity = sp_affinity
         self.alpha = alpha
+        self.alpha_scaling = alpha_scaling
         self.eta = eta
         self.beta = beta
         self.n_components = n_components
@@ -104,12 +179,20 @@ class SchroedingerEigenmaps(BaseEstimator):
         self.eig_tol = eig_tol
         self.sparse = sparse
         self.random_state = random_state
+        self.knn_cache = knn_cache
+        self.graph_store = graph_store
+        self.radius = radius
+        self.max_degree = max_degree
+        self.symmetrize = symmetrize
+        self.sparsify = sparsify
+        self.dtype = dtype
+        self.warm_start = warm_start
 
     def fit(self, X, y=None):
         ''' TODO: contain the potential matrix choices within the
            internal potential matrix function'''
         # check the array and see if it satisfies the requirements
-        X = check_array(X)
+        X = check_array(X, dtype=self.dtype)
         # compute the weighted adjacency matrix for X
         W = compute_adjacency(X,
                                n_neighbors=self.n_neighbors,
@@ -119,7 +202,14 @@ class SchroedingerEigenmaps(BaseEstimator):
                                neighbors_algorithm=self.neighbors_algorithm,
                                gamma=self.gamma,
                                trees=self.trees,
-                               n_jobs=self.n_jobs)
+                               n_jobs=self.n_jobs,
+                               cache=self.knn_cache,
+                               store=self.graph_store,
+                               radius=self.radius,
+                               max_degree=self.max_degree,
+                               symmetrize=self.symmetrize,
+                               sparsify=self.sparsify,
+                               dtype=self.dtype)
 
         if self.potential:
             self._potential(X, y=y)
@@ -127,7 +217,7 @@ class SchroedingerEigenmaps(BaseEstimator):
             self.ss_potential=None
             self.pl_potential=None
         # compute the projection into the new space
-        self.eigVals, self.embedding_ = graph_embedding(
+        self.eigVals, self.embedding_, eig_model = graph_embedding(
              adjacency=W, data=X,
              norm_laplace=self.norm_laplace,
              lap_method=self.lap_method,
@@ -135,19 +225,38 @@ class SchroedingerEigenmaps(BaseEstimator):
              mu=self.mu,
              ss_potential=self.ss_potential,
              alpha=self.alpha,
+             alpha_scaling=self.alpha_scaling,
              pl_potential=self.pl_potential,
              beta=self.beta,
              n_components=self.n_components,
              eig_solver=self.eig_solver,
              eig_tol=self.eig_tol,
-             random_state=self.random_state)
+             sparse=self.sparse,
+             random_state=self.random_state,
+             dtype=self.dtype,
+             warm_start=self.warm_start,
+             eig_model=self._warm_eig_model(),
+             return_solver=True)
+        self._keep_eig_model(eig_model)
+        self.eig_solver_ = eig_model.eig_solver_
+        self.eig_time_ = eig_model.eig_time_
         return self
 
 
+    # eigensolver of the previous fit, when warm starting
+    def _warm_eig_model(self):
+        if self.warm_start:
+            return getattr(self, 'eig_model_', None)
+        return None
+
+    def _keep_eig_model(self, eig_model):
+        if self.warm_start:
+            self.eig_model_ = eig_model
+
     # Compute the projection of X into the new space
     def fit_transform(self, X):
         # check the array and see if it satisfies the requirements
-        X = check_array(X)
+        X = check_array(X, dtype=self.dtype)
         self.fit(X)
 
         return self.embedding_
@@ -163,12 +272,24 @@ class SchroedingerEigenmaps(BaseEstimator):
         if self.potential in ['SS', 'SpatialSpectral', 'ss']:
             # get spatial coordinates for dataset (specifically images)
             X_spatial = get_spatial_coordinates(self.X_img)
-            # find the k_nearest neighbors indices
-            _, V_ind = knn_scikit(X, n_neighbors=self.sp_neighbors,
-                               method='brute')
+            # find the neighbor indices
+            if self.sp_algorithm in ['raster']:
+                V_ind = spatial_neighbors(self.X_img.shape[0],
+                                          self.X_img.shape[1],
+                                          connectivity=self.sp_neighbors,
+                                          radius=self.sp_radius)
+            elif self.sp_algorithm in ['brute']:
+                _, V_ind = KnnSolver(n_neighbors=self.sp_neighbors,
+                                     nn_algorithm='brute',
+                                     n_jobs=self.n_jobs,
+                                     cache=self.knn_cache).find_knn(X)
+            else:
+                raise ValueError('Sorry. Unrecognized spatial neighbors '
+                                 'algorithm.')
             # save the spatial-spectral potential
             self.ss_potential = ssse_potential(X, X_spatial,
-                                               V_ind, weight=self.sp_affinity)
+                                               V_ind, weight=self.sp_affinity,
+                                               dtype=self.dtype)
         # create the similarity potential matrix
         elif self.potential in ['similarity', 'sim', 'plnaive']:
             raise ValueError('Sorry. This method is unavailable at'\
@@ -185,19 +306,25 @@ class SchroedingerEigenmaps(BaseEstimator):
 def graph_embedding(adjacency, data,
                     norm_laplace = None,lap_method = 'sklearn',
                     norm_method = 'degree', normalization= None, mu=1.0,
-                    ss_potential=None, alpha=17.78,
+                    ss_potential=None, alpha=17.78, alpha_scaling='trace',
                     pl_potential=None, beta=1.0,
                     n_components=2,eig_solver=None,eig_tol=1E-12,
-                    random_state=None):
+                    sparse=False,
+                    random_state=None, dtype=None,
+                    warm_start=False, eig_model=None,
+                    return_solver=False):
     """
     Returns
     -------
     eigenvalues
     eigenvectors
-    TODO - time elapse
+    eig_model : the EigSolver, with the solver used (eig_solver_) and
+        its time (eig_time_), if return_solver. With warm_start, the
+        EigSolver of a previous solve can be passed in (eig_model) to
+        start from its eigenvectors.
     """
     # create laplacian and diagonal degree matrix
-    L, D = create_laplacian(adjacency, norm_lap=norm_laplace)
+    L, D = create_laplacian(adjacency, norm_lap=norm_laplace, dtype=dtype)
 
     #-------------------------------
     # Tune the Eigenvalue Problem
@@ -216,12 +343,13 @@ def graph_embedding(adjacency, data,
     if not ss_potential == None:            # spatial-spectral potential
         if not alpha:
             alpha = 17.78
-        alpha = get_alpha(alpha, L, ss_potential)
-        A = L + alpha * ss_potential
+        # (a python float keeps the dtype of L and V)
+        alpha = float(get_alpha(alpha, L, ss_potential, alpha_scaling))
+        A = laplacian_operator(L, ss_potential, alpha)
 
     elif not pl_potential == None:          # partial-labels potential
-        beta = get_alpha(beta, L, pl_potential)
-        A = L + beta * pl_potential
+        beta = float(get_alpha(beta, L, pl_potential, alpha_scaling))
+        A = laplacian_operator(L, pl_potential, beta)
 
     else:                       # no potential (standard Laplacian)
         A = L
@@ -231,14 +359,23 @@ def graph_embedding(adjacency, data,
     #-------------------------------
 
     # initialize the EigSolver class
+    previous = eig_model
     eig_model = EigSolver(n_components=n_components,
                           eig_solver=eig_solver,
                           sparse=sparse,
                           tol=eig_tol,
-                          norm_laplace=norm_laplace)
+                          norm_laplace=norm_laplace,
+                          dtype=dtype,
+                          warm_start=warm_start)
+    if warm_start and hasattr(previous, 'info_'):
+        # start from the last block of the previous solve
+        eig_model.info_ = previous.info_
 
     # return the eigenvalues and eigenvectors
-    return eig_model.find_eig(A=A, B=B)
+    eigVals, eigVecs = eig_model.find_eig(A=A, B=B)
+    if return_solver:
+        return eigVals, eigVecs, eig_model
+    return eigVals, eigVecs
 #-------------------------------------------------------
 # Schroedinger Eigenmaps Utilities
 #-------------------------------------------------------
@@ -283,6 +420,110 @@ def get_spatial_coordinates(data):
     return np.vstack((xv,yv)).T
 
 
+# Find the spatial neighbors of every pixel from the raster layout
+def spatial_neighbors(nrows, ncols, connectivity=4, radius=1, order='F'):
+    """Neighbor indices of every pixel of an (nrows x ncols) image taken
+    straight from the pixel grid, without any distance search.
+
+    Parameters
+    ----------
+    nrows : int
+        number of rows of the image
+
+    ncols : int
+        number of columns of the image
+
+    connectivity : int [4|8], default=4
+        4 keeps the offsets with |dr| + |dc| <= radius (the 4-connected
+        pixels for radius=1) and 8 the whole (2*radius+1) square window
+        (the 8-connected pixels for radius=1)
+
+    radius : int, default=1
+        radius of the neighborhood window
+
+    order : str ['F'|'C'], default='F'
+        ravel order of the pixels. 'F' matches get_spatial_coordinates.
+
+    Returns
+    -------
+    indices : array, [(nrows*ncols) x (K+1)]
+        the pixel itself in the first column followed by its K neighbors.
+        Neighbors that fall outside of the image are marked with -1.
+    """
+    if connectivity not in [4, 8]:
+        raise ValueError('Unrecognized pixel connectivity: '
+                         '{c}'.format(c=connectivity))
+
+    offsets = [(dr, dc) for dc in range(-radius, radius+1)
+                        for dr in range(-radius, radius+1)
+               if (dr, dc) != (0, 0) and
+               (connectivity == 8 or abs(dr) + abs(dc) <= radius)]
+
+    # row and column of every pixel
+    n_pixels = nrows * ncols
+    pixels = np.arange(n_pixels)
+    if order == 'F':
+        col, row = np.divmod(pixels, nrows)
+    elif order == 'C':
+        row, col = np.divmod(pixels, ncols)
+    else:
+        raise ValueError('Unrecognized ravel order: {o}'.format(o=order))
+
+    indices = np.empty((n_pixels, len(offsets)+1), dtype=np.intp)
+    indices[:, 0] = pixels
+
+    for k, (dr, dc) in enumerate(offsets):
+        nrow, ncol = row + dr, col + dc
+        inside = (nrow >= 0) & (nrow < nrows) & (ncol >= 0) & (ncol < ncols)
+        if order == 'F':
+            neighbor = nrow + ncol * nrows
+        else:
+            neighbor = nrow * ncols + ncol
+        indices[:, k+1] = np.where(inside, neighbor, -1)
+
+    return indices
+
+# Kernel weights between every point and its neighbors
+def neighbor_weights(data, indices, weight='heat', sigma=1.0,
+                     batch_size=1024):
+    """Kernel weights [N x K] between every point of data and its
+    neighbors indices[:, 1:].
+
+    The squared distances come from ||x_i||^2 + ||x_j||^2 - 2 x_i.x_j
+    (the cosines from x_i.x_j / (||x_i|| ||x_j||) for the 'angle'
+    kernel), one block of batch_size rows at a time, so only
+    batch_size x K neighbor vectors are gathered at once.
+    """
+    if weight not in ['heat', 'angle']:
+        raise ValueError('Unrecognized SSSE Potential weight.')
+
+    N, K = indices.shape[0], indices.shape[1]-1
+    sq_norms = np.einsum('ij,ij->i', data, data)
+    W = np.empty((N, K), dtype=data.dtype)
+
+    for start in range(0, N, batch_size):
+        stop = min(start + batch_size, N)
+        ind = indices[start:stop, 1:]
+        dots = np.einsum('bd,bkd->bk', data[start:stop], data[ind])
+
+        if weight == 'heat':
+            dots *= -2
+            dots += sq_norms[start:stop, None]
+            dots += sq_norms[ind]
+            np.maximum(dots, 0, out=dots)
+            W[start:stop] = np.exp(-dots / sigma**2)
+
+        else:
+            # the cosines are clipped so arccos never returns NaN
+            norms = np.sqrt(sq_norms[start:stop, None] * sq_norms[ind])
+            norms[norms == 0] = 1
+            dots /= norms
+            np.clip(dots, -1, 1, out=dots)
+            W[start:stop] = np.exp(-np.arccos(dots))
+
+    return W
+
+
 # Construct the Schroedinger Spatial-Spectral Potential Matrix
 def ssse_potential(data,
                    clusterdata,
@@ -290,7 +531,9 @@ def ssse_potential(data,
                    weight='heat',
                    sp_weight='heat',
                    sigma=1.0,
-                   eta=1.0):
+                   eta=1.0,
+                   dtype=None,
+                   batch_size=1024):
     """Constructs the: Schroedinger Spatial-Spectral Cluster Potential
 
     Parameters
@@ -305,13 +548,14 @@ def ssse_potential(data,
     indices: (M, N) array_like
         an MxN array where M are the number of data points and N
         are the N-1 nearest neighbors connected to that data point M.
+        Negative entries (missing neighbors) are skipped.
 
     weight: str ['heat'|'angle'] (optional)
-        The weight parameter as the kernel for the spatial-spectral
+        The weight parameter as the kernel for the spectral
         difference.
 
-    weight: str ['heat'|'angle'] (optional)
-        The weight parameter as the kernel for the spatial-spectral
+    sp_weight: str ['heat'|'angle'] (optional)
+        The weight parameter as the kernel for the spatial
         difference.
 
     sigma: float, optional
@@ -322,6 +566,14 @@ def ssse_potential(data,
         The parameter for the heat kernel.
         Default: 1.0
 
+    dtype: numpy dtype, optional
+        dtype of the potential matrix (default: dtype of data). The
+        diagonal is accumulated in float64.
+
+    batch_size: int, optional
+        number of points whose neighbor weights are computed at a time.
+        Default: 1024
+
 
     Returns
     -------
@@ -353,56 +605,36 @@ def ssse_potential(data,
     """
     # Number of data points and number of cluster potentials
     N = data.shape[0]; K = indices.shape[1]-1
-
-    # Compute the weights for the Data Vector EData
-    x1 = np.repeat(
-            np.transpose(
-            data[:, :, np.newaxis], axes=[0, 2, 1]), K, axis=1)
-
-    x2 = data[indices[:,1:]].reshape((N, K, data.shape[1]))
-
-    if weight == 'heat':
-        WE = np.exp( - np.sum ( ( x1-x2 )**2, axis=2 ) / sigma**2)
-
-    elif weight == 'angle':
-        WE = np.exp( - np.arccos(1-np.sum( (x1-x2), axis=2 ) ) )
-
-    else:
-        raise ValueError('Unrecognized SSSE Potential weight.')
-
-    # Compute the weights for the Clustering Data Vector CData
-    x1 = np.repeat(
-            np.transpose(
-            clusterdata[:, :, np.newaxis], axes=[0, 2, 1]), K, axis=1)
-
-    x2 = clusterdata[indices[:,1:]].reshape(( N, K, clusterdata.shape[1] ))
-
-    if weight == 'heat':
-        WC = np.exp( - np.sum ( ( x1 - x2 )**2, axis=2 ) / eta**2)
-
-    elif weight == 'angle':
-        WC = np.exp( - np.arccos(1-np.sum( (x1-x2), axis=2 ) ) )
-
-    else:
-        raise ValueError('Unrecognized SSSE Potential weight.')
-
-    # Create NonDiagonal Elements of Potential matrix, V
-    Vrow = np.tile( indices[:, 0], K)
-    Vcol = np.ravel( indices[:, 1:], order='F' )
-    V_vals = -WE*WC
-    Vdata = np.ravel( V_vals, order='F')
-
-    # Create the symmetric Sparse Potential Matrix, V
-    V_sparse = csr_matrix( (Vdata, (Vrow, Vcol) ),
-                           shape=( N,N ))
-    # Make Potential Matrix sparse
-    V_sparse = maximum(V_sparse, V_sparse.T)
-
-    # Compute the Diagonal Elements of Potential Matrix, V
-    V_diags = spdiags( -V_sparse.sum(axis=1).T, 0, N, N)
-
-    # Return the sparse Potential Matrix V
-    return V_diags+V_sparse
+    if dtype is None:
+        dtype = data.dtype if np.issubdtype(data.dtype, np.floating) \
+            else np.float64
+    data = data.astype(dtype, copy=False)
+    clusterdata = clusterdata.astype(dtype, copy=False)
+
+    # Compute the weights for the Data Vector EData and for the
+    # Clustering Data Vector CData
+    WE = neighbor_weights(data, indices, weight, sigma, batch_size)
+    WE *= neighbor_weights(clusterdata, indices, sp_weight, eta, batch_size)
+
+    # NonDiagonal Elements of Potential matrix, -WE*WC
+    Vrow = np.repeat(indices[:, 0], K).astype(np.int64)
+    Vcol = np.ravel(indices[:, 1:]).astype(np.int64)
+    Vdata = np.ravel(WE)
+    del WE
+
+    # Skip the missing neighbors (e.g. outside of the image)
+    valid = Vcol >= 0
+    if not valid.all():
+        Vrow, Vcol, Vdata = Vrow[valid], Vcol[valid], Vdata[valid]
+
+    # Symmetric weights in a single assembly. The element-wise maximum of
+    # the negative entries of V and V.T keeps the edges that are found
+    # in both directions, with the smaller weight.
+    W = symmetric_csr(Vrow, Vcol, Vdata, N, reduce='min', symmetrize='and')
+
+    # The Diagonal Elements of V are minus its row sums, so V is the
+    # Laplacian of the weights (the sums are accumulated in float64)
+    return laplacian(W, dtype=dtype)
 
 # create similarity and dissimilarity potential matrices
 def sim_potential(X, potential='sim',
@@ -428,6 +660,11 @@ def sim_potential(X, potential='sim',
                       showing the connectivity between the corresponding
                       dissimilar labels between the k entries in the list.
 
+    The graphs are built from the class indicator matrix E of the
+    labeled samples, Ws = E E^T and Wd = E (J - I) E^T, so the cost is
+    proportional to the number of labeled pairs. The Laplacian (and
+    degree matrix) of Ws ('sim') or of Wd is returned.
+
     TODO: References
     ----------------
 
@@ -438,88 +675,40 @@ def sim_potential(X, potential='sim',
         https://goo.gl/QaLTA4
 
     """
-    # create sparse matrix from array X
-    new = {}
-    new['csr'] = sparse.csr_matrix((X.shape[0],X.shape[0]), dtype='int')
-    row = []; col = []; datapoint = []
-
-    i = 0
-    for (Xrow, Xcol, Xdata) in zip(X.row, X.col, X.data):
-
-        # find all the datapoints in the Y matrix
-        # greater than 0
-        if Xdata > 0:
-
-            # copy that data point with its row and column entry
-            new['csr'][Xrow,:] = Xdata
-
-        i += 1
-    # Copy the original matrix transposed
-    new['csrt'] = new['csr'].T.copy()
-
-    # convert the matrix to a coordinate matrix
-    new['coo'] = new['csr'].tocoo()
-    new['coot'] = new['csrt'].tocoo()
-
-
-    col_labels = ['rows', 'cols', 'data']
-
-
-    # join the dataframes
-    united_data = pd.concat([pd.DataFrame(data=np.array((new['coo'].row,
-                                                         new['coo'].col,
-                                                         new['coo'].data)).T,
-                                          columns=col_labels),
-                             pd.DataFrame(data=np.array((new['coot'].row,
-                                                         new['coot'].col,
-                                                         new['coot'].data)).T,
-                                          columns=col_labels)])
-
-    # group the data by the whole row to find the duplicates
-    united_data_grouped = united_data.groupby(list(united_data.columns))
-
-    # detect the row indices with similar values
-    same_data_idx = [x[0] \
-        for x in united_data_grouped.indices.values() if len(x)!=1]
-
-    # extract the unique values
-    same_data = united_data.iloc[same_data_idx]
-
-    # create empty sparse matrix
-    Ws = sparse.csr_matrix((X.shape[0],X.shape[0]), dtype='int')
-
-    # set the unique value indcies to 1
-    Ws[same_data['rows'], same_data['cols']] = 1
+    # labels of the samples (a later entry of a row wins, zero is
+    # unlabeled)
+    X = coo_matrix(X)
+    labels = np.zeros(X.shape[0], dtype=X.dtype)
+    positive = X.data > 0
+    labels[X.row[positive]] = X.data[positive]
+
+    # indicator matrix E of the classes of the labeled samples
+    labeled = np.flatnonzero(labels > 0)
+    classes, codes = np.unique(labels[labeled], return_inverse=True)
+    E = csr_matrix((np.ones(labeled.shape[0]), (labeled, codes)),
+                   shape=(X.shape[0], classes.shape[0]))
 
     if potential in ['sim']:
+        # same class pairs: E E^T
+        Ws = E.dot(E.T)
         return create_laplacian(Ws, norm_lap=norm_lap, sparse=sparse_mat)
 
-    # group the data by the two columns (row, col)
-    united_cols_grouped = united_data.groupby(['rows','cols'])
-
-    # detect the row indices with similar values for the two columns compared with data
-    diff_cols_idx = [x[0] for x, z in zip(united_cols_grouped.indices.values(),
-                                          united_cols_grouped['data'].indices.values())
-                                          if (len(x)!=1 & len(z)!=1)]
-
-    # extract those same values
-    diff_data = united_data.iloc[diff_cols_idx]
-
-
-    # convert back to csr format
-    Wd = sparse.csr_matrix((X.shape[0],X.shape[0]), dtype='int')
-    Wd[diff_data['rows'], diff_data['cols']] = 1
-
-    return create_laplacian(Wd-Ws, norm_lap=norm_lap, sparse=sparse_mat)
+    # different class pairs: E (J - I) E^T
+    J_I = csr_matrix(1 - np.eye(classes.shape[0]))
+    Wd = E.dot(J_I).dot(E.T)
+    return create_laplacian(Wd, norm_lap=norm_lap, sparse=sparse_mat)
 
 
 # Determine appropriate trade off parameter between L and D
-def get_alpha(alpha, L, V):
+def get_alpha(alpha, L, V, scaling='trace', n_iter=20, random_state=0):
     """Gives the suggested value of alpha:
 
-    Trace of Potential
-    ------------------ = Suggested Alpha
     Trace of Laplacian
+    ------------------ * alpha = Suggested Alpha
+    Trace of Potential
+
+    The traces are read from the diagonals of the sparse matrices, so
+    nothing is densified.
 
     Parameters
     ----------
@@ -528,6 +717,12 @@ def get_alpha(alpha, L, V):
                    Schroedinger Potential matrix
     * Laplacian  - Sparse Matrix Laplacian
     * Potential  - Sparse Potential Matrix
+    * scaling    - statistic of L and V whose ratio scales alpha
+                   'trace'     : trace(L) / trace(V) (default)
+                   'spectral'  : ||L||_2 / ||V||_2, estimated with
+                                 n_iter power iterations
+                   'frobenius' : ||L||_F / ||V||_F
+                   None        : alpha is used as is
 
     Returns
     -------
@@ -536,4 +731,42 @@ def get_alpha(alpha, L, V):
     and the Potential Matrix
 
     """
-    return alpha * ( np.trace(L.todense()) / np.trace(V.todense()))
+    if scaling is None:
+        return alpha
+
+    elif scaling == 'trace':
+        return alpha * (L.diagonal().sum(dtype=np.float64) /
+                        V.diagonal().sum(dtype=np.float64))
+
+    elif scaling == 'spectral':
+        return alpha * (spectral_norm(L, n_iter, random_state) /
+                        spectral_norm(V, n_iter, random_state))
+
+    elif scaling == 'frobenius':
+        return alpha * (frobenius_norm(L) / frobenius_norm(V))
+
+    else:
+        raise ValueError('Unrecognized alpha scaling: {s}'.format(s=scaling))
+
+
+# Estimate the spectral norm of a symmetric matrix
+def spectral_norm(M, n_iter=20, random_state=0):
+    """Largest absolute eigenvalue of the symmetric matrix M, as the
+    Rayleigh quotient of the vector of n_iter power iterations"""
+    x = check_random_state(random_state).rand(M.shape[0])
+    x /= np.linalg.norm(x)
+    for _ in range(n_iter):
+        y = M.dot(x).astype(np.float64, copy=False)
+        norm = np.linalg.norm(y)
+        if norm == 0:
+            return 0.
+        x = y / norm
+    return abs(np.dot(x, M.dot(x)))
+
+
+# Frobenius norm of a sparse matrix
+def frobenius_norm(M):
+    M = csr_matrix(M)
+    M.sum_duplicates()
+    return np.sqrt(np.dot(M.data.astype(np.float64, copy=False),
+                          M.data.astype(np.float64, copy=False)))
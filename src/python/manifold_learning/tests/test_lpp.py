@@ -10,3 +10,12 @@ def test_estimator_checks():
     """Run scikit-learn's suite of basic estimator checks"""
     from sklearn.utils.estimator_checks import check_estimator
     check_estimator(LocalityPreservingProjection)
+
+
+def test_dense_eig_solver():
+    """The small D x D problem stays on the dense solver"""
+    X = np.random.RandomState(0).rand(200, 5)
+    model = LocalityPreservingProjections(n_neighbors=8, eig_solver='dense')
+    model.fit(X)
+    assert_equal(model.eig_solver_, 'dense')
+    assert_equal(model.projection_.shape, (5, 2))
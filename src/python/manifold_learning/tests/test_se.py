@@ -0,0 +1,165 @@
+import numpy as np
+from numpy.testing import assert_equal, assert_allclose
+
+from manifold_learning.se import spatial_neighbors, get_spatial_coordinates, \
+                                 ssse_potential, get_alpha, sim_potential, \
+                                 SchroedingerEigenmaps
+
+
+def test_spatial_neighbors_raster():
+    """Raster neighbors are the pixels at grid distance one"""
+    nrows, ncols = 5, 7
+    coords = get_spatial_coordinates(np.zeros((nrows, ncols, 3)))
+
+    for connectivity, n_corner in [(4, 2), (8, 3)]:
+        indices = spatial_neighbors(nrows, ncols, connectivity=connectivity)
+        assert_equal(indices[:, 0], np.arange(nrows * ncols))
+
+        valid = indices[:, 1:] >= 0
+        offsets = np.abs(coords[indices[:, 1:]] - coords[:, None, :])
+        assert (offsets[valid].max(axis=-1) == 1).all()
+        assert_equal(valid.sum(axis=1).max(), connectivity)
+        assert_equal(valid[0].sum(), n_corner)
+
+    # the potential skips the neighbors outside of the image
+    X = np.random.RandomState(0).rand(nrows * ncols, 3)
+    V = ssse_potential(X, coords, spatial_neighbors(nrows, ncols))
+    assert_allclose(V.sum(axis=1), 0, atol=1E-12)
+    assert_allclose(V.toarray(), V.T.toarray())
+
+
+def test_ssse_potential_angle():
+    """The angle kernel never produces NaN, even for parallel spectra"""
+    data = np.random.RandomState(0).rand(5, 6, 4)
+    data[0, 1] = 3 * data[0, 0]
+    X_spatial = get_spatial_coordinates(data)
+    X = data.reshape((30, 4), order='F')
+    V = ssse_potential(X, X_spatial, spatial_neighbors(5, 6), weight='angle')
+    assert not np.isnan(V.data).any()
+    assert_allclose(V.toarray(), V.T.toarray())
+
+
+def baseline_ssse_potential(data, clusterdata, indices, sigma=1.0, eta=1.0):
+    # the original N x K x D tensor implementation (heat kernels), with
+    # the missing neighbors skipped
+    from scipy.sparse import csr_matrix, spdiags
+    from utils.graph import maximum
+    N = data.shape[0]; K = indices.shape[1]-1
+
+    x1 = np.repeat(np.transpose(data[:, :, np.newaxis], axes=[0, 2, 1]), K,
+                   axis=1)
+    x2 = data[indices[:, 1:]].reshape((N, K, data.shape[1]))
+    WE = np.exp(- np.sum((x1 - x2)**2, axis=2) / sigma**2)
+
+    x1 = np.repeat(np.transpose(clusterdata[:, :, np.newaxis],
+                                axes=[0, 2, 1]), K, axis=1)
+    x2 = clusterdata[indices[:, 1:]].reshape((N, K, clusterdata.shape[1]))
+    WC = np.exp(- np.sum((x1 - x2)**2, axis=2) / eta**2)
+
+    Vrow = np.tile(indices[:, 0], K)
+    Vcol = np.ravel(indices[:, 1:], order='F')
+    Vdata = np.ravel(-WE*WC, order='F')
+    valid = Vcol >= 0
+    V_sparse = csr_matrix((Vdata[valid], (Vrow[valid], Vcol[valid])),
+                          shape=(N, N))
+    V_sparse = maximum(V_sparse, V_sparse.T)
+    V_diags = spdiags(-V_sparse.sum(axis=1).T, 0, N, N)
+    return V_diags + V_sparse
+
+
+def test_ssse_potential_matches_baseline():
+    """The blocked potential equals the original tensor implementation,
+    for the raster neighbors and for (asymmetric) spectral kNN"""
+    from utils.knn_solvers import KnnSolver
+    nrows, ncols = 9, 11
+    rng = np.random.RandomState(0)
+    X = rng.rand(nrows * ncols, 5)
+    coords = get_spatial_coordinates(np.zeros((nrows, ncols, 5)))
+    _, knn = KnnSolver(n_neighbors=6, cache=False).find_knn(X)
+
+    for indices in [spatial_neighbors(nrows, ncols, connectivity=8), knn]:
+        V = ssse_potential(X, coords, indices, sigma=0.7, eta=2.0,
+                           batch_size=16)
+        V_ref = baseline_ssse_potential(X, coords, indices, sigma=0.7,
+                                        eta=2.0)
+        assert_allclose(V.toarray(), V_ref.toarray(), atol=1E-12)
+
+
+def test_get_alpha_scalings():
+    """The sparse statistics match their dense definitions"""
+    from utils.graph import compute_adjacency, create_laplacian
+    data = np.random.RandomState(0).rand(10, 12, 4)
+    X = data.reshape((120, 4), order='F')
+    L, _ = create_laplacian(compute_adjacency(X, n_neighbors=5, cache=False))
+    V = ssse_potential(X, get_spatial_coordinates(data),
+                       spatial_neighbors(10, 12))
+    L_dense, V_dense = L.toarray(), V.toarray()
+
+    assert_allclose(get_alpha(2., L, V),
+                    2. * np.trace(L_dense) / np.trace(V_dense))
+    assert_allclose(get_alpha(2., L, V, 'frobenius'),
+                    2. * np.linalg.norm(L_dense) / np.linalg.norm(V_dense))
+    assert_allclose(get_alpha(2., L, V, 'spectral'),
+                    2. * np.linalg.norm(L_dense, 2) /
+                    np.linalg.norm(V_dense, 2), rtol=0.1)
+    assert_equal(get_alpha(2., L, V, None), 2.)
+
+
+def test_sim_potential():
+    """Same and different class pairs of the labeled samples"""
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import laplacian
+    labels = np.random.RandomState(0).randint(0, 4, size=60)
+    labeled = labels > 0
+    same = (labels[:, None] == labels[None, :]) & labeled & labeled[:, None]
+    different = (labels[:, None] != labels[None, :]) & \
+        labeled & labeled[:, None]
+
+    Y = coo_matrix(labels[:, None])
+    Vs, Ds = sim_potential(Y, potential='sim')
+    Vd, Dd = sim_potential(Y, potential='dis')
+    assert_allclose(Vs.toarray(), laplacian(same.astype(float)))
+    assert_allclose(Vd.toarray(), laplacian(different.astype(float)))
+    assert_allclose(Dd.diagonal(), different.sum(axis=1))
+
+
+def test_auto_eig_solver():
+    """The estimator records the solver picked by eig_solver='auto' and
+    its time"""
+    X = np.random.RandomState(0).rand(300, 3)
+    model = SchroedingerEigenmaps(n_neighbors=8, n_jobs=1, eig_solver='auto',
+                                  random_state=0).fit(X)
+    assert model.eig_solver_ in ['dense', 'arpack', 'multi']
+    assert model.eig_time_ >= 0
+    assert_equal(model.embedding_.shape, (300, 2))
+
+
+def test_warm_start():
+    """With warm_start the next fit starts from the previous eigenvectors"""
+    X = np.random.RandomState(0).rand(500, 3)
+    model = SchroedingerEigenmaps(n_neighbors=8, n_jobs=1, eig_solver='multi',
+                                  eig_tol=1e-6, sparse=True, random_state=0,
+                                  warm_start=True).fit(X)
+    first = model.eig_model_.info_
+    model.fit(X)
+    assert model.eig_model_.info_['cached']
+    assert model.eig_model_.info_['n_iter'] < first['n_iter']
+    assert_equal(model.embedding_.shape, (500, 2))
+
+    model = SchroedingerEigenmaps(n_neighbors=8, n_jobs=1, eig_solver='multi',
+                                  eig_tol=1e-6, sparse=True,
+                                  random_state=0).fit(X)
+    assert not hasattr(model, 'eig_model_')
+
+
+def test_dense_eig_solver(capsys):
+    """eig_solver='dense' is honoured for a small graph, silently"""
+    X = np.random.RandomState(0).rand(300, 3)
+    model = SchroedingerEigenmaps(n_neighbors=8, n_jobs=1, eig_solver='dense',
+                                  random_state=0).fit(X)
+    assert_equal(model.eig_solver_, 'dense')
+    assert_equal(model.embedding_.shape, (300, 2))
+
+    model.set_params(eig_solver='multi', eig_tol=1e-6).fit(X)
+    assert_equal(model.eig_solver_, 'multi')
+    assert_equal(capsys.readouterr().out, '')
@@ -6,15 +6,28 @@ from Python packages and codes
 # License: BSD 3 clause
 
 from __future__ import division
+import os
+import time
 import warnings
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
 #import numpy.linalg as linalg
 from pyamg import smoothed_aggregation_solver
-from scipy.sparse.linalg import lobpcg, eigs, eigsh
+from scipy.sparse import issparse, csc_matrix, csr_matrix, identity
+from scipy.sparse.linalg import lobpcg, eigs, eigsh, LinearOperator, splu, \
+    ArpackNoConvergence
 from scipy.linalg import eigh
 from scipy import linalg
 from sklearn.utils import check_array
 from sklearn.utils.validation import check_random_state
+from utils.operators import SumOperator, diagonal_of, diagonal_operator, \
+    to_matrix
+
+# defaults of the randomized solver, which its cost model is calibrated with
+N_OVERSAMPLES = 10
+N_ITER = 16
 
 
 class EigSolver(object):
@@ -25,11 +38,71 @@ class EigSolver(object):
     n_components : integer
         number of coordinates for the manifold
 
-    eig_method : str ['dense'|'robust'|'arpack'|'multi']
+    eig_method : str ['auto'|'dense'|'robust'|'arpack'|'multi'|'randomized']
         some methods to choose from when solving the eigenvalue
-        decomposition problem
+        decomposition problem. 'randomized' is a fast randomized block
+        Krylov solver (see eig_randomized) for dense or sparse problems
+        with a diagonal B, whose eigenpairs are approximate unless its
+        Krylov space is deep enough for tol; 'rsvd' is an alias of it.
+        'auto' picks the solver of every problem from its size, sparsity,
+        B and the available memory with a calibrated cost model (see
+        select_solver). An explicit choice is kept, except that the
+        dense solvers hand large sparse problems to 'arpack' (see
+        max_dense_size).
+
+    sparse : bool, default=False
+        whether the matrices are sparse. Kept for compatibility: the
+        solver no longer depends on it.
+
+    dtype : numpy dtype, optional
+        precision of the sparse solvers ('arpack', 'multi'); None keeps
+        the dtype of the matrices, so float32 Laplacians are solved in
+        float32. The dense solvers always work in float64.
+
+    max_dense_size : int, default=2000
+        sparse matrices and operators larger than this (the N x N graph
+        problems) are never densified: the dense solvers hand them to
+        'arpack' instead. Dense arrays (e.g. the D x D feature space
+        problems of LPP) always stay on the dense path.
+
+    max_memory : int, optional
+        memory budget of the 'auto' mode in bytes (default: half of the
+        available memory)
+
+    max_iter : int, optional
+        maximum number of iterations of the 'arpack' and 'multi' solvers
+        (default: the scipy defaults), and of Krylov iterations of the
+        'randomized' solver (default: n_iter)
+
+    n_oversamples : int, default=N_OVERSAMPLES
+        extra random vectors of the 'randomized' solver
+
+    n_iter : int, default=N_ITER
+        maximum power (Krylov) iterations of the 'randomized' solver; it
+        stops earlier once its residuals are below tol. More iterations
+        give more accurate eigenpairs.
+
+    warm_start : bool, default=False
+        start the 'multi' (LOBPCG) solver from the eigenvectors of the
+        previous find_eig call when the problem size is unchanged, so a
+        sweep over a parameter (e.g. the potential weight) costs a few
+        iterations per step. The AMG hierarchies are cached either way.
+
+    Attributes
+    ----------
+    eig_solver_ : str
+        the solver used by the last find_eig call
+
+    eig_time_ : float
+        the time the last solve took, in seconds
+
+    solver_costs_ : dict
+        the predicted (seconds, bytes) of every solver, in 'auto' mode
+
+    info_ : dict
+        convergence report of the last 'arpack' or 'multi' solve (see
+        eig_scipy and eig_multi)
 
-    TODO: 'rsvd'
     TODO: better functions to capture variables
     """
     def __init__(self,
@@ -38,134 +111,541 @@ class EigSolver(object):
                  sparse = False,
                  tol = 1.E-12,
                  norm_laplace=False,
-                 random_state=None):
+                 random_state=None,
+                 dtype=None,
+                 max_dense_size=2000,
+                 max_memory=None,
+                 max_iter=None,
+                 n_oversamples=N_OVERSAMPLES,
+                 n_iter=N_ITER,
+                 warm_start=False):
          self.n_components = n_components
          self.eig_solver = eig_solver
          self.sparse = sparse
          self.tol = tol
          self.norm_laplace = norm_laplace
          self.random_state = random_state
+         self.dtype = dtype
+         self.max_dense_size = max_dense_size
+         self.max_memory = max_memory
+         self.max_iter = max_iter
+         self.n_oversamples = n_oversamples
+         self.n_iter = n_iter
+         self.warm_start = warm_start
 
 
     def find_eig(self, A, B=None):
 
-         if self.sparse and self.eig_solver not in ['arpack', 'multi']:
-             self.eig_solver = 'arpack'
-             print('Matrices are sparse. Using ARPACK instead.')
-         elif not self.sparse and self.eig_solver not in ['robust', 'dense']:
-             self.eig_solver = 'dense'
-             print('Matrices are not sparse. Using dense methods instead.')
+         # an explicit solver is honoured; only 'auto' chooses one. Large
+         # graph problems never reach the O(N^3) dense solvers though.
+         eig_solver = self.eig_solver
+         if eig_solver is None:
+             eig_solver = 'dense'
+         elif eig_solver == 'rsvd':
+             eig_solver = 'randomized'
+         if eig_solver == 'auto':
+             eig_solver, self.solver_costs_ = select_solver(
+                 A, B, n_components=self.n_components,
+                 max_memory=self.max_memory,
+                 n_oversamples=self.n_oversamples, n_iter=self.n_iter)
+         elif eig_solver in ['robust', 'dense'] and \
+                 A.shape[0] > self.max_dense_size and not \
+                 isinstance(A, np.ndarray):
+             eig_solver = 'arpack'
+             warnings.warn('The {n} x {n} matrices are too large for the '
+                           'dense solvers. Using ARPACK instead.'.format(
+                               n=A.shape[0]), RuntimeWarning)
+         self.eig_solver_ = eig_solver
+
+         # working precision of the solver (the dense solvers need the
+         # explicit matrices of matrix-free operators)
+         if eig_solver in ['robust', 'dense']:
+             A, B = as_dense(A), as_dense(B)
+             A, B = as_dtype(A, np.float64), as_dtype(B, np.float64)
+         elif self.dtype is not None:
+             A, B = as_dtype(A, self.dtype), as_dtype(B, self.dtype)
 
-         if self.eig_solver == 'robust' and not self.sparse:
+         t0 = time.time()
+         if eig_solver == 'robust':
 
              eigVals, eigVecs = eigh_robust(a=A, b=B,
                                         eigvals=(0, self.n_components-1))
 
 
 
-         elif self.eig_solver == 'dense':
+         elif eig_solver == 'dense':
 
              eigVals, eigVecs = eig_dense(A=A, B=B,
                                           k_dims=self.n_components)
-         elif self.eig_solver == 'arpack':
+         elif eig_solver == 'arpack':
+
+            # the trivial first eigenpair is dropped, like eig_dense does
+            eigVals, eigVecs, self.info_ = eig_scipy(
+                A=A, B=B, n_components=self.n_components+1,
+                tol=self.tol, maxiter=self.max_iter,
+                random_state=self.random_state, return_info=True)
+            eigVals, eigVecs = eigVals[1:], eigVecs[:, 1:]
 
-            eigVals, eigVecs =  eig_scipy(A=A,
-                                          B=B,
-                                          n_components=self.n_components)
+         elif eig_solver == 'multi':
 
-         elif self.eig_solver == 'multi':
+            X0 = None
+            if self.warm_start and hasattr(self, 'info_') and \
+                    'vectors' in self.info_ and \
+                    self.info_['vectors'].shape[0] == A.shape[0]:
+                X0 = self.info_['vectors']
 
-            eigVals, eigVecs = eig_multi(A=A,
-                                         B=B,
-                                          n_components=self.n_components,
-                                          tol=self.tol,
-                                          random_state=self.random_state)
+            # the trivial first eigenpair is dropped, like eig_dense does
+            eigVals, eigVecs, self.info_ = eig_multi(
+                A=A, B=B, n_components=self.n_components+1, tol=self.tol,
+                maxiter=self.max_iter, random_state=self.random_state,
+                X0=X0, return_info=True)
+            eigVals, eigVecs = eigVals[1:], eigVecs[:, 1:]
 
-         elif self.eig_solver == 'rsvd':
-             _, eigVals, eigVecs = r_svd(M=A,
-                                            n_components=self.n_components)
+         elif eig_solver == 'randomized':
+
+            # the trivial first eigenpair is dropped, like eig_dense does;
+            # max_iter bounds the Krylov depth and tol stops it early
+            n_iter = self.n_iter if self.max_iter is None else self.max_iter
+            eigVals, eigVecs, self.info_ = eig_randomized(
+                A=A, B=B, n_components=self.n_components+1,
+                n_oversamples=self.n_oversamples, n_iter=n_iter,
+                tol=self.tol, random_state=self.random_state,
+                return_info=True)
+            eigVals, eigVecs = eigVals[1:], eigVecs[:, 1:]
          else:
              raise ValueError('Unrecognizable Eigenvalue Method.')
+         self.eig_time_ = time.time() - t0
 
          return eigVals, eigVecs
 
 
 
 
+# cast a dense or sparse matrix, or an operator (or None) to dtype
+def as_dtype(A, dtype):
+    if A is None or A.dtype == dtype or not hasattr(A, 'astype'):
+        return A
+    return A.astype(dtype)
+
+
+# dense array of a dense or sparse matrix, or an operator (or None)
+def as_dense(A):
+    if A is None:
+        return A
+    A = to_matrix(A)
+    if issparse(A):
+        return A.toarray()
+    return A
+
+
 #--------------------------------------
 # Scipy - ARPACK Dense (small)
 #--------------------------------------
 def eig_dense(A, B=None, k_dims=2):
+    """Eigenpairs 1 to k_dims (the first, trivial one is skipped) of the
+    dense problem A x = lambda B x.
+
+    Only the requested eigenpairs are computed, with the MRRR driver of
+    LAPACK (?syevr) after the reduction to a standard problem by the
+    Cholesky factor of B. A semi-definite B (e.g. X^T D X with
+    collinear features) falls back to eigh_robust.
+
+    Parameters
+    ----------
+    A : array, [M x M]
+
+    B : array, [M x M], optional
+
+    k_dims : int
+        number of eigenpairs
+
+    Returns
+    -------
+    eigenvalues : array, [k_dims], ascending
+
+    eigenvectors : array, [M x k_dims]
+    """
+    subset = (1, min(k_dims, A.shape[0] - 1))
+    if B is None:
+        return eigh(A, subset_by_index=subset, driver='evr')
+
+    try:
+        # B = C C^T, so that C^-1 A C^-T y = lambda y with x = C^-T y
+        C = linalg.cholesky(B, lower=True)
+    except linalg.LinAlgError:
+        return eigh_robust(A, B, eigvals=subset)
+
+    W = linalg.solve_triangular(C, A, lower=True)
+    W = linalg.solve_triangular(C, W.T, lower=True)
+    eigVals, eigVecs = eigh(W, subset_by_index=subset, driver='evr',
+                            overwrite_a=True)
+    return eigVals, linalg.solve_triangular(C, eigVecs, lower=True,
+                                            trans='T')
 
-    return eigh(a=A,
-                b=B,
-                eigvals=(1, k_dims),
-                type=1)
 
 #--------------------------------------
 # Scipy - ARPACK Sparse
 #--------------------------------------
-def eig_scipy(A, B=None, n_components=2+1, method='arpack'):
-    """
+def eig_scipy(A, B=None, n_components=2+1, method='arpack',
+              shift_invert=True, sigma=None, tol=0, maxiter=None,
+              random_state=None, return_info=False):
+    """Smallest eigenpairs of A x = lambda B x with ARPACK.
+
+    With shift_invert (the default) ARPACK iterates on
+    (A - sigma B)^-1 B with sigma slightly below zero, where the smallest
+    eigenvalues of a Laplacian become the best separated ones, and
+    converges in a few dozen iterations. The sparse LU factorization of
+    A - sigma B is cached (see factorize), so repeated solves of the same
+    problem skip it. Without shift_invert the 'SM' mode is used, which
+    only needs matrix-vector products but converges slowly.
+
+    Parameters
+    ----------
+    A : sparse matrix or LinearOperator, [N x N]
+        a matrix-free operator (e.g. utils.operators.SumOperator for
+        L + alpha V). Shift-invert needs the explicit A - sigma B for
+        its factorization: it is assembled once from the terms (one
+        sparse matrix with the union of their patterns, freed after the
+        factorization), and the LU factors, typically several times
+        larger, are kept in the cache. Use shift_invert=False (or the
+        'multi' solver) to stay matrix-free.
+
+    B : sparse matrix, [N x N], optional
+        a diagonal B (the degree matrix) is inverted directly in the
+        'SM' mode
+
+    n_components : int
+        number of eigenpairs (the smallest ones)
+
+    sigma : float, optional
+        the shift (default: -1E-3 times the mean of diag(A) / diag(B))
+
+    tol, maxiter : ARPACK stopping criteria
+
+    random_state : int or RandomState, optional
+        seed of the ARPACK starting vector
+
+    return_info : bool, default=False
+        also return a dict with the number of converged eigenpairs,
+        linear solves, the relative residuals, the shift and whether the
+        factorization came from the cache
+
+    Returns
+    -------
+    eigenvalues : array, [n_components], ascending
+
+    eigenvectors : array, [N x n_components]
 
+    info : dict, if return_info
     """
-    # # There is a bug for a low number of nodes for this solver
-    # # calculate more eigenvalues than necessary
-    if n_components <= 10 and np.shape(A)[0] >= int(20):
-        n_components = n_components+15
+    n_samples = A.shape[0]
+    n_components = min(n_components, n_samples - 1)
+    v0 = check_random_state(random_state).rand(n_samples)
+    info = {'shift_invert': shift_invert, 'n_solves': 0, 'cached': False}
+
+    if shift_invert:
+        if sigma is None:
+            sigma = -1E-3 * _diagonal_scale(A, B)
+        lu, info['cached'] = factorize(A, B, sigma)
+
+        def solve(x):
+            info['n_solves'] += 1
+            return lu.solve(np.asarray(x, dtype=A.dtype).ravel())
+
+        OPinv = LinearOperator(shape=A.shape, dtype=A.dtype,
+                               matvec=solve)
+        kwargs = dict(sigma=sigma, which='LM', OPinv=OPinv)
+        info['sigma'] = sigma
+
     else:
-        n_components = n_components
+        # the inverse of a diagonal B needs no factorization
+        Minv = None
+        d = diagonal_of(B) if B is not None else None
+        if d is not None:
+            Minv = diagonal_operator(1. / d)
+        kwargs = dict(which='SM', Minv=Minv)
 
     # Solve using the eigenvale method
-    eigenvalues, eigenvectors = eigsh(A=A,
+    try:
+        eigenvalues, eigenvectors = eigsh(A=A,
                                           k=n_components,
                                           M=B,
-                                          which='SM')
+                                          tol=tol,
+                                          maxiter=maxiter,
+                                          v0=v0.astype(A.dtype),
+                                          **kwargs)
+    except ArpackNoConvergence as e:
+        warnings.warn('ARPACK converged {c} of the {k} eigenpairs.'.format(
+                      c=e.eigenvalues.shape[0], k=n_components))
+        eigenvalues, eigenvectors = e.eigenvalues, e.eigenvectors
+
+    order = np.argsort(eigenvalues)
+    eigenvalues, eigenvectors = eigenvalues[order], eigenvectors[:, order]
+
+    if not return_info:
+        return eigenvalues, eigenvectors
+
+    info['converged'] = eigenvalues.shape[0]
+    info['residuals'] = eig_residuals(A, B, eigenvalues, eigenvectors)
+    return eigenvalues, eigenvectors, info
+
+
+# cache of the shift-invert factorizations
+_factorizations = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+# Sparse LU factorization of A - sigma B
+def factorize(A, B, sigma, max_cached=2):
+    """Sparse LU factorization of A - sigma B, from a small cache keyed
+    by the content of the matrix. A can be a matrix or an operator (see
+    shifted_matrix).
+
+    Returns
+    -------
+    lu : scipy.sparse.linalg.SuperLU
+
+    cached : bool
+        whether the factorization was found in the cache
+    """
+    C = shifted_matrix(A, B, sigma)
+    key = _fingerprint(C)
+
+    with _cache_lock:
+        lu = _factorizations.get(key)
+        if lu is not None:
+            _factorizations.move_to_end(key)
+            return lu, True
+
+    # A - sigma B is symmetric: a minimum degree ordering of A + A^T with
+    # diagonal pivots keeps the fill-in (and the factorization time) low
+    lu = splu(C, permc_spec='MMD_AT_PLUS_A', diag_pivot_thresh=0.,
+              options=dict(SymmetricMode=True))
+    with _cache_lock:
+        _factorizations[key] = lu
+        while len(_factorizations) > max_cached:
+            _factorizations.popitem(last=False)
+    return lu, False
+
+
+# explicit A - sigma B in CSC format
+def shifted_matrix(A, B, sigma):
+    """A - sigma B (A symmetric) as one csc_matrix.
+
+    The terms of a SumOperator are summed straight into the result and
+    a diagonal B is subtracted in place on its diagonal, so besides the
+    result only a scaled copy of the second term (alpha V) is made. The
+    symmetric CSR result is returned as its transpose, a CSC matrix
+    sharing the same arrays, instead of being converted."""
+    terms = A.terms if isinstance(A, SumOperator) else [(1., A)]
+    C = None
+    for coef, M in terms:
+        term = M if coef == 1. else coef * M
+        C = term if C is None else C + term
+    if not issparse(C):
+        return csc_matrix(C - sigma * (B if B is not None else identity(
+            C.shape[0], dtype=C.dtype)))
+
+    d = np.ones(C.shape[0]) if B is None else diagonal_of(B)
+    if d is None:
+        C = C - sigma * B
+    else:
+        # (never modify the caller's matrix)
+        C = C.tocsr(copy=C is terms[0][1])
+        C.setdiag(C.diagonal() - sigma * d)
+    C = csr_matrix(C, dtype=A.dtype)
+    C.sum_duplicates()
+    return C.T
+
+
+# relative residuals of generalized eigenpairs
+def eig_residuals(A, B, eigenvalues, eigenvectors):
+    """||A v - lambda B v|| / ((||A|| + |lambda| ||B||) ||v||) for every
+    eigenpair, with the norms of A and B estimated by their largest
+    diagonal entry (exact up to a factor 2 for Laplacians and degree
+    matrices)"""
+    AV = A.dot(eigenvectors)
+    BV = B.dot(eigenvectors) if B is not None else eigenvectors
+    norms = (_max_diagonal(A) + np.abs(eigenvalues) * _max_diagonal(B)) * \
+        np.linalg.norm(eigenvectors, axis=0)
+    norms[norms == 0] = 1
+    return np.linalg.norm(AV - BV * eigenvalues, axis=0) / norms
+
+
+def _max_diagonal(A):
+    if A is None:
+        return 1.
+    if not hasattr(A, 'diagonal'):
+        A = to_matrix(A)
+    return np.abs(A.diagonal()).max()
+
+
+def _fingerprint(C):
+    # cache key of a sparse matrix: its shape, dtype and a hash of the
+    # compressed arrays
+    digest = hashlib.sha1()
+    for array in (C.data, C.indices, C.indptr):
+        digest.update(np.ascontiguousarray(array).view(np.uint8))
+    return (C.format, C.shape, C.dtype.str, digest.hexdigest())
+
+
+def _diagonal_scale(A, B):
+    # mean of diag(A) / diag(B): the scale of the Laplacian spectrum
+    a = A.diagonal().mean(dtype=np.float64)
+    b = B.diagonal().mean(dtype=np.float64) if B is not None else 1.
+    return a / b if a > 0 and b > 0 else 1.
 
-    return eigenvalues[:n_components+1], eigenvectors[:,:n_components+1]
 
 #--------------------------------------
 # Pyamg - Multigrid
 #--------------------------------------
-def eig_multi(A, B=None, n_components=2, tol=1E-12, random_state=None):
+def eig_multi(A, B=None, n_components=2, tol=1E-12, random_state=None,
+              X0=None, maxiter=None, cache=True, preconditioner='laplacian',
+              return_info=False):
     """Solves the generalized Eigenvalue problem:
     A x = lambda B x using the multigrid method.
     Works well with very large matrices but there are some
     instabilities sometimes.
+
+    A can be a matrix-free operator with a sparse_approximation method
+    (utils.operators.SumOperator); the multigrid preconditioner is then
+    built from its Laplacian term or from that approximation (see
+    preconditioner).
+
+    Parameters
+    ----------
+    X0 : array, [N x m], optional
+        initial block for LOBPCG, e.g. the eigenvectors of a previous
+        solve of a nearby problem (info['vectors']). Missing columns are
+        filled with random vectors.
+
+    maxiter : int, optional
+        maximum number of LOBPCG iterations (default: scipy's)
+
+    cache : bool, default=True
+        reuse the AMG hierarchy of a previous solve of the same matrix
+        (see multigrid_solver)
+
+    preconditioner : str ['laplacian'|'approximation'], default='laplacian'
+        matrix of the AMG hierarchy when A is a SumOperator (L + alpha
+        V): 'laplacian' uses its first term, L, which is the same for
+        every alpha so the cached hierarchy is reused across a sweep;
+        'approximation' uses A.sparse_approximation(), rebuilt for every
+        alpha but a closer preconditioner for large alpha (fewer
+        iterations). Either is shifted by a multiple of B to be
+        nonsingular: 1E-2 of the spectrum scale for L, as the constant
+        vector is no longer in the null space of L + alpha V and a
+        smaller shift over-amplifies it (LOBPCG stalls), 1E-6 otherwise.
+
+    return_info : bool, default=False
+        also return a dict with the number of iterations, the final
+        residual norms, whether the hierarchy came from the cache, and
+        the whole LOBPCG block ('vectors') for warm starts
     """
     random_state = check_random_state(random_state)
-    # convert matrix A and B to float
-    A = A.astype(np.float64);
+    n_nodes = A.shape[0]
+    # shift of the preconditioner, relative to the spectrum scale
+    shift = 1E-6
+    if isinstance(A, SumOperator) and preconditioner == 'laplacian':
+        # the first term (the graph Laplacian) doesn't depend on the
+        # potential weight, so a sweep over alpha reuses its hierarchy
+        A_amg = csr_matrix(A.terms[0][1], dtype=A.dtype)
+        shift = 1E-2
+    elif isinstance(A, LinearOperator):
+        if not hasattr(A, 'sparse_approximation'):
+            raise ValueError('The multigrid solver needs a matrix or an '
+                             'operator with a sparse approximation.')
+        A_amg = A.sparse_approximation()
+    else:
+        # convert matrix A and B to float (float32 matrices stay float32)
+        A = check_array(A, accept_sparse=['csr'],
+                        dtype=[np.float64, np.float32])
+        A_amg = A
 
     if B is not None:
-        B = B.astype(np.float64)
+        B = as_dtype(B, A.dtype)
 
-    # import the solver
-    ml = smoothed_aggregation_solver(check_array(A, accept_sparse = ['csr']))
+    # the hierarchy of a singular Laplacian breaks LOBPCG down after a
+    # couple of iterations: precondition with a slightly shifted A instead
+    shift *= _diagonal_scale(A_amg, B)
+    A_amg = csr_matrix(A_amg + shift * (B if B is not None else identity(
+        n_nodes, dtype=A.dtype)), dtype=A.dtype)
 
     # preconditioner
+    if cache:
+        ml, cached = multigrid_solver(A_amg)
+    else:
+        ml, cached = smoothed_aggregation_solver(A_amg), False
     M = ml.aspreconditioner()
 
-    n_nodes = A.shape[0]
     n_find = min(n_nodes, 5 + 2*n_components)
     # initial guess for X
-    np.random.RandomState(seed=1234)
-    X = random_state.rand(n_nodes, n_find)
+    X = random_state.rand(n_nodes, n_find).astype(A.dtype)
+    if X0 is not None:
+        X0 = np.asarray(X0)
+        if X0.ndim != 2 or X0.shape[0] != n_nodes:
+            raise ValueError('The initial block must have {n} rows.'.format(
+                n=n_nodes))
+        n_warm = min(n_find, X0.shape[1])
+        X[:, :n_warm] = X0[:, :n_warm]
 
     # solve using the lobpcg algorithm
-    eigVals, eigVecs = lobpcg(A, X, M=M, B=B,
+    eigVals, eigVecs, history = lobpcg(A, X, M=M, B=B,
                                        tol=tol,
-                                       largest='False')
+                                       maxiter=maxiter,
+                                       largest=False,
+                                       retResidualNormsHistory=True)
 
     sort_order = np.argsort(eigVals)
     eigVals = eigVals[sort_order]
     eigVecs = eigVecs[:, sort_order]
 
+    if return_info:
+        info = {'n_iter': len(history),
+                'residuals': np.asarray(history[-1])[sort_order]
+                if len(history) else None,
+                'cached': cached,
+                'vectors': eigVecs}
+
     eigVals = eigVals[:n_components]
     eigVecs = eigVecs[:, :n_components]
+    if return_info:
+        return eigVals, eigVecs, info
     return eigVals, eigVecs
 
 
+# cache of the AMG hierarchies
+_multigrid_solvers = OrderedDict()
+
+
+# Smoothed aggregation AMG hierarchy of A
+def multigrid_solver(A, max_cached=2):
+    """Smoothed aggregation AMG hierarchy of A, from a small cache keyed
+    by the content of the matrix (like the factorizations of eig_scipy).
+
+    Returns
+    -------
+    ml : pyamg.multilevel.MultilevelSolver
+
+    cached : bool
+        whether the hierarchy was found in the cache
+    """
+    A = csr_matrix(A)
+    key = _fingerprint(A)
+
+    with _cache_lock:
+        ml = _multigrid_solvers.get(key)
+        if ml is not None:
+            _multigrid_solvers.move_to_end(key)
+            return ml, True
+
+    ml = smoothed_aggregation_solver(A)
+    with _cache_lock:
+        _multigrid_solvers[key] = ml
+        while len(_multigrid_solvers) > max_cached:
+            _multigrid_solvers.popitem(last=False)
+    return ml, False
+
 
 #-------------------------
 # Github - Randomized SVD
@@ -191,6 +671,325 @@ def r_svd(M, n_components=2+1):
    U = np.dot(Q, Uhat)
    return U.T[:n_components+1].T, s[:n_components+1], v[:n_components+1]
 
+#--------------------------------------
+# Randomized block Krylov
+#--------------------------------------
+def eig_randomized(A, B=None, n_components=2+1, n_oversamples=N_OVERSAMPLES,
+                   n_iter=N_ITER, tol=None, random_state=None,
+                   return_info=False):
+    """Approximate smallest eigenpairs of A x = lambda B x with a
+    randomized block Krylov method.
+
+    The problem is reduced to the standard one of
+    S = B^-1/2 A B^-1/2 and the spectrum is flipped, M = c I - S with c
+    a Gershgorin bound of the largest eigenvalue of S, so the wanted
+    eigenpairs become the dominant ones of M. The Krylov block
+    [M G, M^2 G, ..., M^(n_iter+1) G] of a random Gaussian block G with
+    n_components + n_oversamples columns is orthonormalized step by step
+    and the eigenpairs are extracted by Rayleigh-Ritz on its span. Only
+    products with A are needed, so it suits very large graphs where an
+    approximate embedding is enough.
+
+    The result is approximate: the eigenvalues are only as accurate as
+    the Krylov space is deep. With tol the space grows until the Ritz
+    residuals are below it (or n_iter is reached); without it, exactly
+    n_iter iterations are run.
+
+    Parameters
+    ----------
+    A : sparse or dense matrix, or LinearOperator, [N x N]
+        symmetric, e.g. a graph Laplacian or L + alpha V
+        (utils.operators.SumOperator)
+
+    B : diagonal matrix (dia_matrix or 1-D array), [N x N], optional
+        e.g. the degree matrix
+
+    n_components : int
+        number of eigenpairs (the smallest ones)
+
+    n_oversamples : int, default=N_OVERSAMPLES
+        extra random vectors in the block
+
+    n_iter : int, default=N_ITER
+        maximum number of power (Krylov) iterations; the Krylov space has
+        up to (n_iter + 1) * (n_components + n_oversamples) vectors. The
+        accuracy depends on the relative gap of the smallest eigenvalues
+        to the largest: graphs with tightly clustered low frequencies
+        need more iterations.
+
+    tol : float, optional
+        stop once the residuals ||S x - lambda x|| of the Ritz pairs,
+        relative to the bound c of the spectrum, are all below tol; a
+        RuntimeWarning reports the pairs that are not after n_iter
+
+    random_state : int or RandomState, optional
+
+    return_info : bool, default=False
+        also return a dict with the shift c, the size of the Krylov space,
+        the number of iterations, the number of Ritz pairs within tol
+        ('converged') and the relative residuals of the eigenpairs
+
+    Returns
+    -------
+    eigenvalues : array, [n_components], ascending
+
+    eigenvectors : array, [N x n_components]
+
+    info : dict, if return_info
+    """
+    random_state = check_random_state(random_state)
+    n_samples = A.shape[0]
+    dtype = np.result_type(A.dtype, np.float32)
+
+    if B is None:
+        scale = np.ones(n_samples, dtype=dtype)
+    else:
+        d = diagonal_of(B)
+        if d is None:
+            raise ValueError('The randomized solver needs a diagonal B.')
+        if np.any(d <= 0):
+            raise ValueError('The diagonal of B must be positive.')
+        scale = (1. / np.sqrt(d)).astype(dtype)
+
+    # flipped operator c I - B^-1/2 A B^-1/2
+    shift = _gershgorin_bound(A, scale)
+
+    def flipped(X):
+        return shift * X - scale[:, None] * A.dot(scale[:, None] * X)
+
+    n_block = min(n_components + n_oversamples, n_samples)
+    n_krylov = min((n_iter + 1) * n_block, n_samples)
+
+    # the Krylov basis Q, its products M Q and the projection Q^T M Q,
+    # all filled block by block
+    Q = np.empty((n_samples, n_krylov), dtype=dtype)
+    MQ = np.empty((n_samples, n_krylov), dtype=dtype)
+    T = np.empty((n_krylov, n_krylov), dtype=dtype)
+    block = flipped(random_state.standard_normal(
+        (n_samples, n_block)).astype(dtype))
+    filled, n_steps, n_converged = 0, 0, 0
+    while True:
+        # orthogonalize against the previous blocks (twice, for stability)
+        for _ in range(2):
+            block -= np.dot(Q[:, :filled], np.dot(Q[:, :filled].T, block))
+        block, _ = linalg.qr(block, mode='economic', overwrite_a=True)
+        width = min(block.shape[1], n_krylov - filled)
+        new = slice(filled, filled + width)
+        Q[:, new] = block[:, :width]
+        MQ[:, new] = flipped(Q[:, new])
+        T[:filled + width, new] = np.dot(Q[:, :filled + width].T, MQ[:, new])
+        T[new, :filled] = T[:filled, new].T
+        filled += width
+        n_steps += 1
+
+        # Rayleigh-Ritz on the Krylov space
+        theta, Y = linalg.eigh((T[:filled, :filled] + T[:filled, :filled].T)
+                               / 2., subset_by_index=(filled - n_components,
+                                                      filled - 1))
+        done = filled == n_krylov
+        if tol is not None:
+            residuals = np.linalg.norm(np.dot(MQ[:, :filled], Y) -
+                                       np.dot(Q[:, :filled], Y) * theta,
+                                       axis=0) / shift
+            n_converged = int(np.sum(residuals <= tol))
+            done = done or n_converged == n_components
+        if done:
+            break
+        block = MQ[:, new].copy()
+
+    if tol is not None and n_converged < n_components:
+        warnings.warn('The randomized solver converged {c} of the {k} '
+                      'eigenpairs in {n} iterations; raise n_iter for more '
+                      'accurate ones.'.format(c=n_converged, k=n_components,
+                                              n=n_steps - 1), RuntimeWarning)
+
+    eigenvalues = (shift - theta)[::-1]
+    eigenvectors = scale[:, None] * np.dot(Q[:, :filled], Y[:, ::-1])
+    # B-orthonormal eigenvectors
+    eigenvectors /= np.sqrt(np.sum(eigenvectors ** 2 / scale[:, None] ** 2,
+                                   axis=0))
+
+    if not return_info:
+        return eigenvalues, eigenvectors
+
+    info = {'shift': shift, 'n_krylov': filled, 'n_iter': n_steps - 1,
+            'converged': n_converged,
+            'residuals': eig_residuals(A, B, eigenvalues, eigenvectors)}
+    return eigenvalues, eigenvectors, info
+
+
+# upper bound of the spectrum of diag(s) A diag(s)
+def _gershgorin_bound(A, s):
+    # largest absolute row sum; the terms of an operator are bounded one
+    # by one, so L + alpha V is never summed
+    if isinstance(A, SumOperator):
+        return sum(abs(coef) * _gershgorin_bound(M, s)
+                   for coef, M in A.terms)
+    A = to_matrix(A)
+    if issparse(A):
+        row_sums = abs(A).dot(s)
+    else:
+        row_sums = np.abs(A).dot(s)
+    return float(np.max(s * row_sums))
+
+
+#--------------------------------------
+# Solver selection
+#--------------------------------------
+# Cost model of the solvers: seconds = coef * size ** exponent, with size
+# N for 'dense' and nnz(A) for the sparse solvers, for CALIBRATION_PAIRS
+# eigenpairs (n_components=3 and the trivial pair; the sparse solvers
+# scale linearly with the number of eigenpairs, 'randomized' with the
+# size of its Krylov space). The 'arpack' entry 'fill' models the
+# nonzeros of the LU factors the same way. Calibrated with
+# solver_benchmark() on 10-NN graphs, with the N_OVERSAMPLES and N_ITER
+# defaults; rerun it to calibrate for another machine.
+CALIBRATION_PAIRS = 4
+SOLVER_COSTS = {
+    'dense': (1.838E-09, 2.69),
+    'arpack': (7.541E-11, 1.89),
+    'multi': (7.117E-06, 1.00),
+    'randomized': (8.354E-06, 0.95),
+    'fill': (2.996E-02, 1.56),
+}
+
+
+# predicted time and memory of every applicable solver
+def solver_costs(A, B=None, n_components=2, n_oversamples=N_OVERSAMPLES,
+                 n_iter=N_ITER, costs=None):
+    """Predicted run time (seconds) and peak memory (bytes) of the
+    solvers that can handle A x = lambda B x.
+
+    Parameters
+    ----------
+    A : dense or sparse matrix, or LinearOperator, [N x N]
+
+    B : matrix, [N x N], optional
+
+    n_components : int
+        number of eigenpairs, besides the trivial one
+
+    costs : dict, optional
+        the cost model (default: SOLVER_COSTS)
+
+    Returns
+    -------
+    costs : dict
+        solver -> (seconds, bytes). 'multi' needs a matrix or an operator
+        with a sparse approximation, 'randomized' a diagonal B; the dense
+        path is only considered when N fits in memory at all.
+    """
+    costs = SOLVER_COSTS if costs is None else costs
+    n_samples = A.shape[0]
+    n_pairs = n_components + 1
+    itemsize = 8
+
+    if isinstance(A, np.ndarray):
+        nnz = A.size
+    elif issparse(A):
+        nnz = A.nnz
+    elif isinstance(A, SumOperator):
+        nnz = sum(M.nnz if issparse(M) else np.prod(M.shape)
+                  for _, M in A.terms)
+    else:
+        nnz = n_samples ** 2
+
+    def predict(solver, size, scale=1.):
+        coef, exponent = costs[solver]
+        return scale * coef * float(size) ** exponent
+
+    estimates = dict()
+    # A, B and the LAPACK workspace
+    estimates['dense'] = (predict('dense', n_samples),
+                          3 * itemsize * float(n_samples) ** 2)
+
+    # the LU factors (values and indices) and the Lanczos basis
+    fill = predict('fill', nnz)
+    estimates['arpack'] = (predict('arpack', nnz,
+                                   n_pairs / float(CALIBRATION_PAIRS)),
+                           12 * fill + itemsize * n_samples *
+                           (2 * n_pairs + 1))
+
+    if not isinstance(A, LinearOperator) or \
+            hasattr(A, 'sparse_approximation'):
+        # the AMG hierarchy and the LOBPCG blocks
+        n_find = 5 + 2 * n_components
+        estimates['multi'] = (predict('multi', nnz,
+                                      n_pairs / float(CALIBRATION_PAIRS)),
+                              3 * 12 * nnz + 9 * itemsize * n_samples *
+                              n_find)
+
+    if B is None or diagonal_of(B) is not None:
+        # the Krylov space
+        n_krylov = min((n_iter + 1) * (n_pairs + n_oversamples), n_samples)
+        # relative to the Krylov space of the calibration runs
+        n_calibration = (N_ITER + 1) * (CALIBRATION_PAIRS + N_OVERSAMPLES)
+        estimates['randomized'] = (
+            predict('randomized', nnz, n_krylov / float(n_calibration)),
+            2 * itemsize * n_samples * n_krylov)
+
+    return estimates
+
+
+# pick the fastest solver that fits in memory
+def select_solver(A, B=None, n_components=2, max_memory=None,
+                  n_oversamples=N_OVERSAMPLES, n_iter=N_ITER, costs=None):
+    """The solver for A x = lambda B x with the smallest predicted time
+    among the exact ones ('dense', 'arpack', 'multi') that fit in
+    max_memory; the approximate 'randomized' solver is only chosen when
+    none of them fits. Dense arrays are always solved densely.
+
+    Parameters
+    ----------
+    max_memory : int, optional
+        memory budget in bytes (default: half of the available memory)
+
+    Returns
+    -------
+    solver : str
+
+    estimates : dict
+        solver -> (seconds, bytes), see solver_costs
+    """
+    estimates = solver_costs(A, B, n_components=n_components,
+                             n_oversamples=n_oversamples, n_iter=n_iter,
+                             costs=costs)
+    if isinstance(A, np.ndarray):
+        return 'dense', estimates
+
+    if max_memory is None:
+        max_memory = available_memory()
+        max_memory = np.inf if max_memory is None else max_memory / 2.
+
+    fits = [solver for solver in ['dense', 'arpack', 'multi']
+            if solver in estimates and estimates[solver][1] <= max_memory]
+    if fits:
+        return min(fits, key=lambda solver: estimates[solver][0]), estimates
+    if 'randomized' in estimates and \
+            estimates['randomized'][1] <= max_memory:
+        return 'randomized', estimates
+    # nothing fits: the smallest footprint
+    solver = min(estimates, key=lambda solver: estimates[solver][1])
+    return solver, estimates
+
+
+# available physical memory in bytes (None if it cannot be read)
+def available_memory():
+    # MemAvailable counts the reclaimable page cache, which the free
+    # pages of SC_AVPHYS_PAGES leave out
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
 #---------------------------
 # robust eigenvalue problem
 #---------------------------
@@ -237,8 +1036,9 @@ def eigh_robust(a, b=None, eigvals=None, eigvals_only=False,
     v : (M, N) complex ndarray
         (if eigvals_only == False)
     """
-    kwargs = dict(eigvals=eigvals, eigvals_only=eigvals_only,
-                  turbo=turbo, check_finite=check_finite,
+    # (turbo is kept for compatibility: scipy chooses the driver now)
+    kwargs = dict(subset_by_index=eigvals, eigvals_only=eigvals_only,
+                  check_finite=check_finite,
                   overwrite_a=overwrite_a, overwrite_b=overwrite_b)
 
     # Check for easy case first:
@@ -246,7 +1046,7 @@ def eigh_robust(a, b=None, eigvals=None, eigvals_only=False,
         return linalg.eigh(a, **kwargs)
 
     # Compute eigendecomposition of b
-    kwargs_b = dict(turbo=turbo, check_finite=check_finite,
+    kwargs_b = dict(check_finite=check_finite,
                     overwrite_a=overwrite_b)  # b is a for this operation
     S, U = linalg.eigh(b, **kwargs_b)
 
@@ -261,3 +1061,76 @@ def eigh_robust(a, b=None, eigvals=None, eigvals_only=False,
     else:
         evals, evecs = output
         return evals, np.dot(U, Sinv[:, None] * evecs)
+
+
+
+# Micro-benchmark that calibrates the solver cost model
+def solver_benchmark(dense_sizes=(500, 1500), sparse_sizes=(5000, 20000),
+                     n_neighbors=10, n_components=CALIBRATION_PAIRS - 1,
+                     random_state=0):
+    """Times every solver on kNN graph Laplacians of random 3-D points at
+    two sizes and fits the power laws of SOLVER_COSTS.
+
+    Returns
+    -------
+    costs : dict
+        solver -> (coef, exponent), to assign to SOLVER_COSTS or pass to
+        select_solver
+    """
+    from utils.graph import compute_adjacency, create_laplacian
+
+    rng = check_random_state(random_state)
+
+    def problem(n_samples):
+        X = rng.rand(n_samples, 3)
+        return create_laplacian(compute_adjacency(X, n_neighbors=n_neighbors,
+                                                  cache=False))
+
+    def power_law(sizes, values):
+        exponent = np.log(values[1] / values[0]) / np.log(sizes[1] /
+                                                          sizes[0])
+        return float(values[1] / sizes[1] ** exponent), float(exponent)
+
+    samples = dict((solver, ([], [])) for solver in SOLVER_COSTS)
+
+    for n_samples in dense_sizes:
+        L, D = problem(n_samples)
+        L, D = L.toarray(), D.toarray()
+        t0 = time.time()
+        eig_dense(L, D, k_dims=n_components)
+        samples['dense'][0].append(n_samples)
+        samples['dense'][1].append(time.time() - t0)
+
+    for n_samples in sparse_sizes:
+        L, D = problem(n_samples)
+        nnz = L.nnz
+        _factorizations.clear()
+        _multigrid_solvers.clear()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for solver in ['arpack', 'multi', 'randomized']:
+                # the randomized solver runs its N_ITER default, which
+                # the cost model is calibrated with
+                model = EigSolver(n_components=n_components,
+                                  eig_solver=solver, sparse=True, tol=1E-8,
+                                  max_iter=None if solver == 'randomized'
+                                  else 500, random_state=random_state)
+                model.find_eig(L, D)
+                samples[solver][0].append(nnz)
+                samples[solver][1].append(model.eig_time_)
+
+        lu, _ = factorize(L, D, -1E-3 * _diagonal_scale(L, D))
+        samples['fill'][0].append(nnz)
+        samples['fill'][1].append(lu.L.nnz + lu.U.nnz)
+
+    costs = dict((solver, power_law(*samples[solver]))
+                 for solver in samples)
+    for solver in sorted(costs):
+        print('{s}: {c:.3e} * size ** {e:.2f}'.format(s=solver,
+                                                       c=costs[solver][0],
+                                                       e=costs[solver][1]))
+    return costs
+
+
+if __name__ == "__main__":
+    solver_benchmark()
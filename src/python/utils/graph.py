@@ -6,21 +6,86 @@ Created on Sat Apr 23 11:57:14 2016
 """
 import numpy as np
 from scipy.sparse import csr_matrix, csc_matrix, spdiags, diags
-from sklearn.utils.graph import graph_laplacian
 from utils.nearestneighbor_solver import knn_scikit, knn_annoy
-from utils.knn_solvers import KnnSolver
+from utils.knn_solvers import KnnSolver, KnnCache
+from sklearn.neighbors import NearestNeighbors
+from utils.graph_store import GraphStore
+from utils.laplacian import laplacian
 
 # compute the weighted adjacency matrix
 def compute_adjacency(X, n_neighbors=5, affinity=None,weight='heat',
                       sparse=False, neighbors_algorithm='brute',
                       metric='euclidean', trees=10, gamma=1.0,
-                      n_jobs=None):
-
+                      n_jobs=None, cache=False, store=None,
+                      radius=None, max_degree=None, symmetrize='or',
+                      sparsify=None, dtype=None):
+     """Weighted sparse k-nearest neighbor adjacency matrix of X.
+
+     affinity : str, optional
+         'radius' (or 'epsilon') connects every point to all the points
+         within radius of it instead of to its n_neighbors nearest ones.
+
+     radius : float, optional
+         neighborhood radius of the 'radius' affinity
+
+     max_degree : int, optional
+         maximum number of closest neighbors each point keeps (dense
+         regions and hub points otherwise get very large rows)
+
+     symmetrize : str ['or'|'and'], default='or'
+         'and' only keeps the mutual k-nearest neighbors
+
+     sparsify : float, optional
+         expected fraction of the edges kept by the spectral sparsifier
+         (see spectral_sparsify)
+
+     weight : str ['heat'|'local'|'angle'], default='heat'
+         'heat' is exp(-d_ij^2 / gamma^2) with a global gamma, 'local' the
+         self-tuning kernel exp(-d_ij^2 / (sigma_i sigma_j)) where sigma_i
+         is the distance to the n_neighbors-th neighbor of i (Zelnik-Manor
+         and Perona), which needs no gamma. 'angle' is the spectral angle
+         kernel exp(-theta_ij); its neighbors are the euclidean ones of
+         the L2-normalized rows of X (any metric is ignored, and a radius
+         is a chord length between unit vectors).
+
+     cache : bool or KnnCache, default=False
+         in-memory cache of the kNN results (True shares
+         utils.knn_solvers.knn_cache); see KnnSolver.find_knn
+
+     store : str or GraphStore, optional
+         on-disk graph store. The kNN results and the symmetric distance
+         graph are loaded from it (memory-mapped) when they were stored
+         by an earlier run with the same data and kNN parameters, and
+         saved to it otherwise.
+
+     dtype : numpy dtype, optional
+         dtype of the adjacency matrix (default: dtype of the kNN
+         distances). np.float32 halves the memory of the graph.
+     """
 
      #-----------------------------------
      # K or Approximate Nearest Neighbors
      #-----------------------------------
 
+     # the spectral angle: euclidean neighbors of the unit vectors, which
+     # rank like the cosine distances with every backend
+     if weight == 'angle':
+         X = unit_rows(X)
+         metric = 'euclidean'
+
+     if affinity in ['radius', 'epsilon']:
+         if radius is None:
+             raise ValueError('The radius affinity needs a radius.')
+         if weight == 'local':
+             raise ValueError('The local weight needs the k-nearest '
+                              'neighbor distances.')
+         W = radius_adjacency(X, radius, max_degree, neighbors_algorithm,
+                              metric, n_jobs, store)
+         if dtype is not None:
+             W = W.astype(dtype, copy=False)
+         return sparsify_adjacency(weight_adjacency(W, weight, gamma),
+                                   sparsify)
+
      # initialize knn model with available parameters
      knn_model = KnnSolver(n_neighbors=n_neighbors,
                            nn_algorithm=neighbors_algorithm,
@@ -29,17 +94,76 @@ def compute_adjacency(X, n_neighbors=5, affinity=None,weight='heat',
                            weight=weight,
                            gamma=gamma,
                            trees=trees,
-                           metric=metric)
+                           metric=metric,
+                           cache=cache)
+
+     if store is None:
+         # find the nearest neighbor indices and distances
+         A_data, A_ind = knn_model.find_knn(X)
+
+         #---------------------------------
+         # Adjacency matrix and Data Kernel
+         #---------------------------------
+
+         # start constructing the adjacency matrix
+         W = create_adjacency(A_data, A_ind, symmetrize=symmetrize,
+                              dtype=dtype)
+
+     else:
+         W = stored_adjacency(X, knn_model, store, symmetrize)
+         if dtype is not None:
+             W = W.astype(dtype, copy=False)
+         if weight == 'local':
+             A_data, _ = stored_knn(X, knn_model, store)
+
+     if max_degree is not None:
+         W = cap_degree(W, max_degree)
+
+     if weight == 'local':
+         W = local_scaling(W, A_data)
+     else:
+         W = weight_adjacency(W, weight, gamma)
+
+     return sparsify_adjacency(W, sparsify)
+
+
+# self-tuning heat kernel with local scales
+def local_scaling(W, distance_vals):
+     """Weights the distance adjacency matrix W with the local-scaling
+     heat kernel exp(-d_ij^2 / (sigma_i sigma_j)).
+
+     sigma_i is the distance from point i to its last (k-th) neighbor
+     in distance_vals, the output of KnnSolver.find_knn. Missing
+     neighbors (inf distances) are ignored.
+     """
+     finite = np.where(np.isfinite(distance_vals), distance_vals, 0)
+     sigma = finite.max(axis=1).astype(W.dtype)
+     sigma[sigma <= 0] = np.finfo(sigma.dtype).eps
+
+     # sigma_i sigma_j of every stored edge
+     W = csr_matrix(W)
+     row = np.repeat(np.arange(W.shape[0]), np.diff(W.indptr))
+     scale = sigma[row]
+     scale *= sigma[W.indices]
+
+     data = np.square(W.data)
+     data /= scale
+     np.negative(data, out=data)
+     W.data = np.exp(data, out=data)
+     return W
 
-     # find the nearest neighbor indices and distances
-     A_data, A_ind = knn_model.find_knn(X)
 
-     #---------------------------------
-     # Adjacency matrix and Data Kernel
-     #---------------------------------
+# spectrally sparsify the weighted adjacency matrix
+def sparsify_adjacency(W, sparsify=None):
 
-     # start constructing the adjacency matrix
-     W = create_adjacency(A_data, A_ind)
+     if sparsify is None:
+         return W
+
+     return spectral_sparsify(W, sparsify, random_state=0)
+
+
+# apply the affinity weight to the distance adjacency matrix
+def weight_adjacency(W, weight='heat', gamma=1.0):
 
      if weight == 'connectivity':
          raise ValueError('Sorry. Connectivity currently fails.')
@@ -51,7 +175,13 @@ def compute_adjacency(X, n_neighbors=5, affinity=None,weight='heat',
 
 
      elif weight == 'angle':
-         W.Data = np.exp(-np.arccos(1-W.data))
+         # W holds the chord lengths ||x_i - x_j|| of unit vectors, so
+         # theta_ij = 2 arcsin(||x_i - x_j|| / 2)
+         data = np.multiply(W.data, 0.5)
+         np.clip(data, 0, 1, out=data)
+         np.arcsin(data, out=data)
+         data *= -2
+         W.data = np.exp(data, out=data)
 
      else:
          raise ValueError('Sorry. Unrecognized affinity weight')
@@ -59,11 +189,87 @@ def compute_adjacency(X, n_neighbors=5, affinity=None,weight='heat',
      return W
 
 
+# rows of X scaled to unit L2 norm (zero rows stay zero)
+def unit_rows(X):
+     X = np.asarray(X)
+     if not np.issubdtype(X.dtype, np.floating):
+         X = X.astype(np.float64)
+     norms = np.sqrt(np.einsum('ij,ij->i', X, X))
+     norms[norms == 0] = 1
+     return X / norms[:, None]
+
+
+# Load (or build and save) the radius adjacency matrix from a graph store
+def radius_adjacency(X, radius, max_degree=None, neighbors_algorithm='brute',
+                     metric='euclidean', n_jobs=None, store=None):
+    """Symmetric epsilon-neighborhood distance adjacency matrix of X,
+    through the on-disk graph store when one is given."""
+    if store is None:
+        return create_radius_adjacency(X, radius, max_degree=max_degree,
+                                       neighbors_algorithm=neighbors_algorithm,
+                                       metric=metric, n_jobs=n_jobs)
+
+    if not isinstance(store, GraphStore):
+        store = GraphStore(store)
+
+    graph_key = store.key('radius', KnnCache.fingerprint(X), radius,
+                          max_degree, metric)
+    W = store.load_adjacency(graph_key)
+    if W is None:
+        W = create_radius_adjacency(X, radius, max_degree=max_degree,
+                                    neighbors_algorithm=neighbors_algorithm,
+                                    metric=metric, n_jobs=n_jobs)
+        store.save_adjacency(graph_key, W)
+    return W
+
+
+# Load (or build and save) the distance adjacency matrix from a graph store
+def stored_adjacency(X, knn_model, store, symmetrize='or'):
+    """Symmetric distance adjacency matrix of X from an on-disk graph
+    store, keyed by the data hash and the KnnSolver parameters."""
+    if not isinstance(store, GraphStore):
+        store = GraphStore(store)
+
+    knn_key = store.key(knn_model.search_key(X))
+    graph_key = store.key(knn_key, knn_model.n_neighbors)
+    if symmetrize != 'or':
+        graph_key = store.key(graph_key, symmetrize)
+
+    W = store.load_adjacency(graph_key)
+    if W is not None:
+        return W
+
+    W = create_adjacency(*stored_knn(X, knn_model, store),
+                         symmetrize=symmetrize)
+    store.save_adjacency(graph_key, W)
+    return W
+
+
+# Load (or search and save) the k-nearest neighbors from a graph store
+def stored_knn(X, knn_model, store):
+    """(distances, indices) of the k-nearest neighbors of X from an
+    on-disk graph store"""
+    if not isinstance(store, GraphStore):
+        store = GraphStore(store)
+
+    knn_key = store.key(knn_model.search_key(X))
+    knn = store.load_knn(knn_key, knn_model.n_neighbors)
+    if knn is None:
+        knn = knn_model.find_knn(X)
+        store.save_knn(knn_key, *knn)
+    return knn
+
+
 # Create Sparse Weighted Adjacency Matrix
-def create_adjacency(distance_vals, indices):
+def create_adjacency(distance_vals, indices, reduce='max', dtype=None,
+                     symmetrize='or'):
     """This function will create a sparse symmetric weighted adjacency matrix
     from nearest neighbors and their corresponding distances.
 
+    The i->j and j->i edges are merged in a single sort/unique pass over
+    the edge keys and the CSR arrays are filled directly, so no
+    intermediate sparse matrices are built for the symmetrization.
+
     Parameters
     -----------
     distance_vals : numpy [MxN]
@@ -72,28 +278,300 @@ def create_adjacency(distance_vals, indices):
 
     indices : array [MxN]
         an MxN array where M are the number of data points and N are the N-1
-        nearest neighbors connected to that data point M.
+        nearest neighbors connected to that data point M. Negative entries
+        (missing neighbors) are skipped.
+
+    reduce : str ['max'|'mean'|'min'], default='max'
+        how an edge found in both directions is merged
+
+    dtype : numpy dtype, optional
+        dtype of the adjacency values (default: dtype of distance_vals)
+
+    symmetrize : str ['or'|'and'], default='or'
+        'or' connects i and j when either is a neighbor of the other,
+        'and' only when they are mutual nearest neighbors
 
     Returns
     --------
     Adjacency Matrix : array, sparse [MxM]
         a sparse MxM sparse weighted adjacency  matrix.
     """
-    # Separate, tile and ravel the neighbours from their
-    # corresponding points
-    row = np.tile( indices[:, 0].T, indices.shape[1]-1).T
-    col = np.ravel( indices[:, 1:], order='F')
-    data = np.ravel( distance_vals[:, 1:], order='F')
+    n_samples = indices.shape[0]
+    n_neighbors = indices.shape[1] - 1
+    if dtype is None:
+        dtype = distance_vals.dtype
+
+    # Separate and ravel the neighbours from their corresponding points
+    row = np.repeat(indices[:, 0], n_neighbors).astype(np.int64)
+    col = np.ravel(indices[:, 1:]).astype(np.int64)
+    data = np.ravel(distance_vals[:, 1:]).astype(dtype)
+
+    valid = col >= 0
+    if not valid.all():
+        row, col, data = row[valid], col[valid], data[valid]
+
+    return symmetric_csr(row, col, data, n_samples, reduce=reduce,
+                         symmetrize=symmetrize)
+
+
+# Create Sparse Epsilon-Neighborhood Adjacency Matrix
+def create_radius_adjacency(X, radius, max_degree=None,
+                            neighbors_algorithm='kd_tree',
+                            metric='euclidean', leaf_size=30,
+                            batch_size=4096, n_jobs=None, dtype=None):
+    """Sparse symmetric distance adjacency matrix connecting every point
+    to the points within radius of it.
+
+    The tree is queried with query_radius one block of rows at a time
+    and every block is appended straight to the edge arrays, so only the
+    edges themselves are ever held in memory.
+
+    Parameters
+    ----------
+    X : array, [N x D]
+        the data points
+
+    radius : float
+        radius of the neighborhoods
+
+    max_degree : int, optional
+        maximum number of (closest) neighbors each point keeps. An edge
+        is kept when both of its points keep it, so the cap is hard.
+
+    neighbors_algorithm : str ['kd_tree'|'ball_tree'|'brute']
+
+    metric : str, default='euclidean'
+
+    leaf_size : int, default=30
+
+    batch_size : int, default=4096
+        number of rows queried at a time
+
+    n_jobs : int, optional
+        number of jobs of each radius query
+
+    dtype : numpy dtype, optional
+        dtype of the adjacency values (default: float64)
+
+    Returns
+    -------
+    Adjacency Matrix : sparse [NxN]
+    """
+    if neighbors_algorithm not in ['kd_tree', 'ball_tree', 'brute']:
+        raise ValueError('Radius graphs need a kd_tree, ball_tree or brute '
+                         'search.')
+    if dtype is None:
+        dtype = np.float64
+
+    nbrs = NearestNeighbors(radius=radius,
+                            algorithm=neighbors_algorithm,
+                            leaf_size=leaf_size,
+                            metric=metric,
+                            n_jobs=n_jobs).fit(X)
+
+    n_samples = X.shape[0]
+    rows, cols, data = [], [], []
+    for start in range(0, n_samples, batch_size):
+        stop = min(start + batch_size, n_samples)
+        dist, ind = nbrs.radius_neighbors(X[start:stop],
+                                          sort_results=True)
+        counts = np.array([i.shape[0] for i in ind], dtype=np.int64)
+        if counts.sum() == 0:
+            continue
+        row = np.repeat(np.arange(start, stop), counts)
+        col = np.concatenate(ind).astype(np.int64)
+        val = np.concatenate(dist).astype(dtype)
+
+        # drop the points themselves and cap the degree
+        keep = col != row
+        row, col, val = row[keep], col[keep], val[keep]
+        if max_degree is not None:
+            counts = np.bincount(row - start, minlength=stop - start)
+            rank = np.arange(row.shape[0]) - \
+                np.repeat(np.cumsum(counts) - counts, counts)
+            keep = rank < max_degree
+            row, col, val = row[keep], col[keep], val[keep]
+        rows.append(row)
+        cols.append(col)
+        data.append(val)
+
+    if not rows:
+        return csr_matrix((n_samples, n_samples), dtype=dtype)
+
+    return symmetric_csr(np.concatenate(rows), np.concatenate(cols),
+                         np.concatenate(data), n_samples,
+                         symmetrize='or' if max_degree is None else 'and')
+
+
+# Symmetric sparse matrix from a directed edge list
+def symmetric_csr(row, col, data, n_samples, reduce='max', symmetrize='or'):
+    """Symmetric (n_samples x n_samples) CSR matrix of the edges
+    row -> col and col -> row.
+
+    The edges are sorted once by their (row, col) key, duplicates are
+    merged with the reduce operation and the CSR arrays are filled
+    directly.
+
+    Parameters
+    ----------
+    row, col : int64 arrays, [n_edges]
+        the directed edges
+
+    data : array, [n_edges]
+        the edge values
+
+    n_samples : int
+        number of nodes
+
+    reduce : str ['max'|'mean'|'min'], default='max'
+        how an edge found in both directions is merged
+
+    symmetrize : str ['or'|'and'], default='or'
+        'or' keeps every edge found in either direction, 'and' only the
+        edges found in both directions (mutual neighbors)
+
+    Returns
+    -------
+    W : sparse matrix, [n_samples x n_samples]
+    """
+    dtype = data.dtype
+    n_edges = data.shape[0]
+
+    # Stack both edge directions as (row, col) keys and sort them
+    keys = np.empty(2 * n_edges, dtype=np.int64)
+    np.multiply(row, n_samples, out=keys[:n_edges])
+    keys[:n_edges] += col
+    np.multiply(col, n_samples, out=keys[n_edges:])
+    keys[n_edges:] += row
+    del row, col
+
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    data = np.concatenate((data, data))[order]
+    del order
+
+    # Merge the duplicate edges
+    first = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = np.diff(np.append(first, 2 * n_edges))
+    keys = keys[first]
+
+    if reduce == 'max':
+        data = np.maximum.reduceat(data, first)
+
+    elif reduce == 'min':
+        data = np.minimum.reduceat(data, first)
+
+    elif reduce == 'mean':
+        data = np.add.reduceat(data, first) / counts.astype(dtype)
+
+    else:
+        raise ValueError('Unrecognized edge reduction: {r}'.format(r=reduce))
+    del first
+
+    # an edge found in both directions appears more than once
+    if symmetrize == 'and':
+        mutual = counts > 1
+        keys, data = keys[mutual], data[mutual]
+        del mutual
+
+    elif symmetrize != 'or':
+        raise ValueError('Unrecognized symmetrization: {s}'.format(
+            s=symmetrize))
+    del counts
+
+    # Create the sparse matrix from its CSR arrays
+    indptr = np.zeros(n_samples + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // n_samples, minlength=n_samples),
+              out=indptr[1:])
+    col = keys % n_samples
+    del keys
+
+    # use 32 bit indices whenever they fit
+    if max(n_samples, col.shape[0]) < np.iinfo(np.int32).max:
+        col, indptr = col.astype(np.int32), indptr.astype(np.int32)
+
+    return csr_matrix((data.astype(dtype, copy=False), col, indptr),
+                      shape=(n_samples, n_samples))
+
+
+# Cap the degree of a distance adjacency matrix
+def cap_degree(W, max_degree):
+    """Keeps the max_degree shortest edges of every node of the symmetric
+    distance adjacency matrix W.
+
+    An edge survives when both of its nodes keep it, so no node ends up
+    with more than max_degree neighbors (hub points of the 'or' kNN graph
+    otherwise collect hundreds of them).
+    """
+    W = csr_matrix(W)
+    n_samples = W.shape[0]
+    counts = np.diff(W.indptr)
+    row = np.repeat(np.arange(n_samples), counts)
+
+    # rank of every edge within its row, by distance
+    order = np.lexsort((W.data, row))
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.shape[0]) - np.repeat(W.indptr[:-1],
+                                                        counts)
+    keep = rank < max_degree
+
+    return symmetric_csr(row[keep], W.indices[keep].astype(np.int64),
+                         W.data[keep], n_samples, symmetrize='and')
 
-    # Create the sparse matrix
-    W_sparse = csr_matrix( ( data, (row, col) ),
-                          shape=(indices.shape[0],
-                          indices.shape[0] ) )
 
-    # Make sure the matrix is symmetric
-    W_sparse_symmetric = maximum(W_sparse, W_sparse.T)
+# Spectral sparsification of a weighted adjacency matrix
+def spectral_sparsify(W, keep_ratio=0.5, random_state=None):
+    """Sparsifies the weighted (affinity) adjacency matrix W by sampling
+    its edges with probability proportional to weight times effective
+    resistance and reweighting the kept ones (Spielman-Srivastava), so
+    the Laplacian quadratic form is preserved in expectation.
 
-    return W_sparse_symmetric
+    Parameters
+    ----------
+    W : sparse matrix, [N x N]
+        symmetric affinity matrix
+
+    keep_ratio : float, default=0.5
+        expected fraction of the edges that is kept
+
+    random_state : int or RandomState, optional
+
+    Returns
+    -------
+    W : sparse matrix, [N x N]
+
+    Notes
+    -----
+    The effective resistance of an edge (u, v) is estimated locally by
+    1/d_u + 1/d_v. This is cheap (no Laplacian solves) and exact enough
+    to keep the bridges and the edges of sparse regions, which are the
+    ones the embedding depends on.
+    """
+    from scipy.sparse import triu
+    from sklearn.utils import check_random_state
+
+    rng = check_random_state(random_state)
+    W = csr_matrix(W)
+    n_samples = W.shape[0]
+    degree = np.asarray(W.sum(axis=1)).ravel()
+
+    upper = triu(W, k=1).tocoo()
+    row, col = upper.row.astype(np.int64), upper.col.astype(np.int64)
+    score = upper.data * (1. / degree[row] + 1. / degree[col])
+
+    # scale the probabilities to keep keep_ratio of the edges
+    n_keep = keep_ratio * score.shape[0]
+    scale = n_keep / score.sum()
+    for _ in range(20):
+        prob = np.minimum(1., scale * score)
+        if prob.sum() >= 0.999 * n_keep or prob.min() >= 1.:
+            break
+        scale *= n_keep / prob.sum()
+
+    keep = rng.rand(score.shape[0]) < prob
+    data = (upper.data[keep] / prob[keep]).astype(W.dtype)
+
+    return symmetric_csr(row[keep], col[keep], data, n_samples)
 
 
 # Find the maximum elements between two sparse matrices
@@ -112,25 +590,25 @@ def maximum(A,B):
 # Find the Laplacian Matrix from an Adjacency Matrix
 def create_laplacian(Adjacency,
                      norm_lap=None,
-                     sparse=None):
+                     sparse=None,
+                     dtype=None):
     """Finds the Graph Laplacian from a Weighted Adjacency Matrix
 
     Parameters
     ----------
     * Adjacency       - a sparse NxN array
+    * norm_lap        - None/False (D - W), True or 'symmetric'
+                        (I - D^-1/2 W D^-1/2) or 'random_walk' (I - D^-1 W)
+    * dtype           - dtype of the Laplacian and degree matrices
+                        (default: dtype of Adjacency)
 
     Returns
     -------
     * Laplacian       - an NxN laplacian array
-    * Diagonal        - an NxN diagonal array
+    * Diagonal        - an NxN diagonal degree array (dia_matrix)
     """
-    L, D = graph_laplacian(Adjacency, normed=norm_lap,
-                           return_diag=True)
-    D = spdiags(data=D,
-                diags=[0],
-                m=Adjacency.shape[0],
-                n=Adjacency.shape[0])
-    return L, D
+    return laplacian(Adjacency, kind=norm_lap, return_diag=True,
+                     diag_format='dia', dtype=dtype)
 
 
 
@@ -210,6 +688,76 @@ def laplacian_test():
 
 
 
+def adjacency_benchmark(n_samples=100000, n_neighbors=20, dtype=np.float64):
+    """Compares the time and peak memory of the direct CSR adjacency
+    assembly against the csr_matrix + maximum(A, A.T) path."""
+    import time as time
+    import tracemalloc
+
+    rng = np.random.RandomState(0)
+    indices = np.hstack((np.arange(n_samples)[:, None],
+                         rng.randint(0, n_samples,
+                                     size=(n_samples, n_neighbors))))
+    distance_vals = rng.rand(n_samples, n_neighbors+1).astype(dtype)
+
+    def maximum_path(distance_vals, indices):
+        row = np.tile( indices[:, 0].T, indices.shape[1]-1).T
+        col = np.ravel( indices[:, 1:], order='F')
+        data = np.ravel( distance_vals[:, 1:], order='F')
+        W_sparse = csr_matrix( ( data, (row, col) ),
+                              shape=(indices.shape[0],
+                              indices.shape[0] ) )
+        return maximum(W_sparse, W_sparse.T)
+
+    for name, method in [('maximum', maximum_path),
+                         ('direct', create_adjacency)]:
+        tracemalloc.start()
+        t0 = time.time()
+        W = method(distance_vals, indices)
+        t1 = time.time()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('{m}: {t:.2f} secs, peak memory {p:.1f} MB, '
+              'nnz {n}'.format(m=name, t=t1-t0, p=peak / 2.**20, n=W.nnz))
+
+
+def sparsification_benchmark(n_samples=20000, n_neighbors=15, n_components=10):
+    """Edge count and eigen-solve time of the embedding problem for the
+    'or' and mutual ('and') kNN graphs, a degree cap and the spectral
+    sparsifier."""
+    import time as time
+    from scipy.sparse.csgraph import laplacian
+    from scipy.sparse.linalg import eigsh
+    from sklearn.datasets import make_swiss_roll
+
+    X, _ = make_swiss_roll(n_samples, random_state=0)
+    distance_vals, indices = KnnSolver(n_neighbors=n_neighbors,
+                                       cache=False).find_knn(X)
+
+    graphs = [('or', create_adjacency(distance_vals, indices)),
+              ('and', create_adjacency(distance_vals, indices,
+                                       symmetrize='and'))]
+    graphs.append(('degree cap', cap_degree(graphs[0][1], n_neighbors)))
+    graphs = [(name, weight_adjacency(W, 'heat', gamma=1.0))
+              for name, W in graphs]
+    graphs.append(('spectral', spectral_sparsify(graphs[0][1], 0.5,
+                                                 random_state=0)))
+
+    for name, W in graphs:
+        # smallest eigenpairs of the normalized Laplacian
+        M = laplacian(W, normed=True)
+        M.data *= -1
+        M.setdiag(M.diagonal() + 1.)
+        t0 = time.time()
+        vals, _ = eigsh(M, k=n_components, which='LA', tol=1E-6,
+                        v0=np.ones(n_samples))
+        t1 = time.time()
+        print('{m}: {e} edges, max degree {d}, eigsh {t:.2f} secs'.format(
+              m=name, e=W.nnz // 2, d=np.diff(W.indptr).max(), t=t1-t0))
+
+
 if __name__ == "__main__":
     # sanity test
     laplacian_test()
+    adjacency_benchmark()
+    sparsification_benchmark()
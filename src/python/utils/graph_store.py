@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk store of the k-nearest neighbor graphs.
+
+The arrays are written as raw .npy files and loaded back with
+np.load(mmap_mode='r'), so several worker processes reading the same
+graph share one page-cached copy.
+"""
+import os
+import glob
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+class GraphStore(object):
+    """A versioned directory of k-nearest neighbor results and symmetric
+    adjacency matrices.
+
+    Layout::
+
+        path/v<version>/knn/<key>_k<n_neighbors>/{distances,indices}.npy
+        path/v<version>/adjacency/<key>/{data,indices,indptr,shape}.npy
+
+    Every entry is written to a temporary directory first and renamed in
+    place, so readers never see a partially written graph.
+
+    Parameters
+    ----------
+    path : str
+        root directory of the store
+
+    mmap_mode : str or None, default='r'
+        memory-map mode used by np.load
+    """
+    version = 1
+
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        self.mmap_mode = mmap_mode
+
+    @staticmethod
+    def key(*parts):
+        """Hash of the repr of the key parts (e.g. KnnSolver.search_key)"""
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def load_knn(self, key, n_neighbors):
+        """The stored (distances, indices) of at least n_neighbors, sliced
+        to n_neighbors (plus the point itself), or None"""
+        stored = []
+        for directory in glob.glob(self._path('knn', key + '_k*')):
+            k = int(directory.rsplit('_k', 1)[1])
+            if k >= n_neighbors:
+                stored.append((k, directory))
+        if not stored:
+            return None
+
+        distVals, idx = self._load(min(stored)[1], ['distances', 'indices'])
+        return distVals[:, :n_neighbors+1], idx[:, :n_neighbors+1]
+
+    def save_knn(self, key, distVals, idx):
+        n_neighbors = idx.shape[1] - 1
+        self._save(self._path('knn', '{k}_k{n}'.format(k=key, n=n_neighbors)),
+                   distances=distVals, indices=idx)
+
+    def load_adjacency(self, key):
+        """The stored sparse adjacency matrix, or None"""
+        directory = self._path('adjacency', key)
+        if not os.path.isdir(directory):
+            return None
+
+        data, indices, indptr, shape = self._load(
+            directory, ['data', 'indices', 'indptr', 'shape'])
+        return csr_matrix((data, indices, indptr), shape=tuple(shape),
+                          copy=False)
+
+    def save_adjacency(self, key, W):
+        W = csr_matrix(W)
+        self._save(self._path('adjacency', key),
+                   data=W.data, indices=W.indices, indptr=W.indptr,
+                   shape=np.array(W.shape))
+
+    def _path(self, kind, name):
+        return os.path.join(self.path, 'v{v}'.format(v=self.version),
+                            kind, name)
+
+    def _load(self, directory, names):
+        return [np.load(os.path.join(directory, name + '.npy'),
+                        mmap_mode=self.mmap_mode) for name in names]
+
+    def _save(self, directory, **arrays):
+        if os.path.isdir(directory):
+            return
+        parent = os.path.dirname(directory)
+        if not os.path.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                # created by another process in the meantime
+                pass
+
+        tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp')
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + '.npy'),
+                    np.ascontiguousarray(array))
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # another process stored the same graph first
+            shutil.rmtree(tmp, ignore_errors=True)
@@ -4,10 +4,16 @@ Created on Tue May 10 18:39:17 2016
 
 @author: eman
 """
-from sklearn.neighbors import NearestNeighbors, LSHForest
+from sklearn.neighbors import NearestNeighbors
 from annoy import AnnoyIndex
-# import hdidx
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+import hashlib
+import os
+import threading
 import numpy as np
+from sklearn.utils.validation import check_random_state
 
 class KnnSolver(object):
 
@@ -21,16 +27,36 @@ class KnnSolver(object):
                  weight = 'heat',
                  gamma = 1.0,
                  p_norm = 2,
+                 batch_size = 1024,
+                 max_memory_mb = 512,
 
                  # ball tree and kdtree parameters
                  trees = 10,
                  leaf_size = 30,
 
-                 # scikit LSHForest parameters
+                 # locality sensitive hashing parameters
                  n_estimators = 10,
                  min_hash_match = 4,
                  n_candidates = 10,
-                 random_state = 0):
+                 n_probes = 2,
+                 n_bits = 32,
+                 random_state = 0,
+
+                 # nn-descent parameters
+                 max_iter = 10,
+                 delta = 0.001,
+                 rho = 0.5,
+
+                 # ivf-pq parameters
+                 n_lists = None,
+                 n_list_probes = 8,
+                 n_subquantizers = 8,
+                 pq_bits = 8,
+                 n_rerank = None,
+                 codebooks = None,
+
+                 # knn result cache
+                 cache = False):
       self.n_neighbors = n_neighbors
       self.nn_algorithm = nn_algorithm
       self.metric = metric
@@ -41,52 +67,230 @@ class KnnSolver(object):
       self.trees = trees
       self.leaf_size = leaf_size
       self.p_norm = p_norm
+      self.batch_size = batch_size
+      self.max_memory_mb = max_memory_mb
 
-      # scikit LSHForest parameters
-      self.n_estimators = trees
+      # locality sensitive hashing parameters
+      self.n_estimators = n_estimators
       self.min_hash_match = min_hash_match
       self.n_candidates = n_candidates
+      self.n_probes = n_probes
+      self.n_bits = n_bits
+
+      # nn-descent parameters
+      self.max_iter = max_iter
+      self.delta = delta
+      self.rho = rho
+
+      # ivf-pq parameters
+      self.n_lists = n_lists
+      self.n_list_probes = n_list_probes
+      self.n_subquantizers = n_subquantizers
+      self.pq_bits = pq_bits
+      self.n_rerank = n_rerank
+      self.codebooks = codebooks
       self.random_state = random_state
 
+      # knn result cache
+      self.cache = cache
+
     def find_knn(self, data):
+       """Returns the (distances, indices) arrays of the n_neighbors
+       nearest neighbors of every point (plus the point itself in the
+       first column).
+
+       With the cache enabled (opt-in: True uses the shared knn_cache, a
+       KnnCache instance a private one) a search with at most as many
+       neighbors as an earlier search on the same data is sliced from
+       the cached result. Note that every call then hashes all of data
+       (sha1) to look the result up, and that the returned arrays are
+       read-only views of the cached ones (copy them before modifying).
+       """
+       if self.cache is True:
+           cache = knn_cache
+       else:
+           cache = self.cache or None
 
+       if cache is None:
+           return self._search(data)
+
+       key = self.search_key(data)
+       result = cache.get(key, self.n_neighbors)
+       if result is None:
+           result = cache.put(key, *self._search(data))
+           result = result[0][:, :self.n_neighbors+1], \
+               result[1][:, :self.n_neighbors+1]
+       return result
+
+    def search_key(self, data):
+       """Key of a search on data with these parameters, independent of
+       n_neighbors"""
+       # the exact methods share their results
        if self.nn_algorithm in ['brute', 'kd_tree', 'ball_tree']:
+           method = ('exact',)
+       else:
+           method = (self.nn_algorithm, self.trees, self.n_estimators,
+                     self.min_hash_match, self.n_candidates,
+                     self.n_probes, self.n_bits, self.random_state,
+                     self.leaf_size, self.max_iter, self.delta, self.rho,
+                     self.n_lists, self.n_list_probes, self.n_subquantizers,
+                     self.pq_bits, self.n_rerank, self.codebooks)
+       return (KnnCache.fingerprint(data), self.metric, self.p_norm) + method
+
+    def _search(self, data):
+
+       if self.nn_algorithm in ['brute'] and \
+               self.metric in ['euclidean', 'sqeuclidean', 'cosine']:
+
+           return knn_brute(data,
+                            n_neighbors=self.n_neighbors,
+                            metric=self.metric,
+                            max_memory_mb=self.max_memory_mb,
+                            n_jobs=self.n_jobs)
+
+       elif self.nn_algorithm in ['brute', 'kd_tree', 'ball_tree']:
 
            return knn_scikit(data,
                              n_neighbors=self.n_neighbors,
+                             algorithm=self.nn_algorithm,
                              leaf_size = self.leaf_size,
                              metric = self.metric,
-                             p = self.p_norm)
-       elif self.nn_algorithm in ['lshf']:
-
-           return lshf_scikit(data,
-                              n_neighbors=self.n_neighbors,
-                              n_estimators=self.n_estimators,
-                              min_hash_match=self.min_hash_match,
-                              n_candidates=self.n_candidates,
-                              random_state=self.random_state)
+                             p = self.p_norm,
+                             n_jobs=self.n_jobs,
+                             batch_size=self.batch_size)
+       elif self.nn_algorithm in ['lsh', 'lshf']:
+
+           return ann_lsh(data,
+                          n_neighbors=self.n_neighbors,
+                          metric=self.metric,
+                          n_estimators=self.n_estimators,
+                          n_bits=self.n_bits,
+                          min_hash_match=self.min_hash_match,
+                          n_candidates=self.n_candidates,
+                          n_probes=self.n_probes,
+                          random_state=self.random_state,
+                          max_memory_mb=self.max_memory_mb,
+                          n_jobs=self.n_jobs)
+       elif self.nn_algorithm in ['nndescent']:
+
+           return ann_nndescent(data,
+                                n_neighbors=self.n_neighbors,
+                                metric=self.metric,
+                                n_trees=self.trees,
+                                leaf_size=self.leaf_size,
+                                max_iter=self.max_iter,
+                                delta=self.delta,
+                                rho=self.rho,
+                                random_state=self.random_state,
+                                max_memory_mb=self.max_memory_mb,
+                                n_jobs=self.n_jobs)
+
        elif self.nn_algorithm in ['annoy']:
 
+           # annoy counts the point itself as a neighbor
            return ann_annoy(data,
                             metric=self.metric,
+                            n_neighbors=self.n_neighbors+1,
+                            trees=self.trees,
+                            n_jobs=self.n_jobs,
+                            batch_size=self.batch_size)
+
+       elif self.nn_algorithm in ['hdidx', 'ivfpq']:
+
+           return ann_ivfpq(data,
                             n_neighbors=self.n_neighbors,
-                            trees=self.trees)
-
-       elif self.nn_algorithm in ['hdidx']:
-           raise NotImplementedError('Unrecognized K-Nearest Neighbor Method.')
-       #
-       #     return ann_hdidx(data,
-       #                      n_neighbors = self.n_neighbors,
-       #                      indexer=self.trees)
+                            metric=self.metric,
+                            n_lists=self.n_lists,
+                            n_probe=self.n_list_probes,
+                            n_subquantizers=self.n_subquantizers,
+                            n_bits=self.pq_bits,
+                            n_rerank=self.n_rerank,
+                            codebooks=self.codebooks,
+                            random_state=self.random_state,
+                            max_memory_mb=self.max_memory_mb,
+                            n_jobs=self.n_jobs)
+
        else:
            raise ValueError('Unrecognized NN Method.')
 
+class KnnCache(object):
+    """A least recently used cache of k-nearest neighbor results.
+
+    Every entry keeps the (distances, indices) arrays of the largest
+    number of neighbors searched so far for its key; smaller searches are
+    sliced from it. Entries are evicted once the cache holds more than
+    max_memory_mb.
+
+    Parameters
+    ----------
+    max_memory_mb : float, default=1024
+        memory bound of the cached arrays
+    """
+    def __init__(self, max_memory_mb=1024):
+        self.max_memory_mb = max_memory_mb
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(data):
+        """Hash of the shape, dtype and values of a data array"""
+        data = np.ascontiguousarray(data)
+        digest = hashlib.sha1(data.view(np.uint8).ravel())
+        digest.update(str((data.shape, data.dtype.str)).encode())
+        return digest.hexdigest()
+
+    def get(self, key, n_neighbors):
+        """Cached (distances, indices) for n_neighbors, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1].shape[1] < n_neighbors + 1:
+                return None
+            self._entries.move_to_end(key)
+        return entry[0][:, :n_neighbors+1], entry[1][:, :n_neighbors+1]
+
+    def put(self, key, distVals, idx):
+        """Stores a result unless a larger one is already cached and
+        returns the entry kept for key"""
+        distVals.flags.writeable = False
+        idx.flags.writeable = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1].shape[1] >= idx.shape[1]:
+                self._entries.move_to_end(key)
+                return entry
+
+            self._remove(key)
+            self._entries[key] = (distVals, idx)
+            self._nbytes += distVals.nbytes + idx.nbytes
+
+            # evict the least recently used entries
+            while self._nbytes > self.max_memory_mb * 2.**20 and \
+                    len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+        return distVals, idx
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry[0].nbytes + entry[1].nbytes
+
+# shared knn result cache of the KnnSolver instances
+knn_cache = KnnCache()
+
 # sklearns nearest neighbors formula
 def knn_scikit(data, n_neighbors=4,
                algorithm='brute',
                leaf_size=30,
                metric='euclidean',
-               p=None):
+               p=2,
+               n_jobs=1,
+               batch_size=1024):
    n_neighbors += 1
 
    # initialize nearest neighbor model
@@ -99,96 +303,1119 @@ def knn_scikit(data, n_neighbors=4,
    # fit nearest neighbor model to the data
    nbrs.fit(data)
 
-   # return the distances and indices
-   return nbrs.kneighbors(data)
+   # return the distances and indices, querying blocks of the data
+   # across the workers
+   return knn_blocks(lambda start, stop: nbrs.kneighbors(data[start:stop]),
+                     n_samples=data.shape[0],
+                     n_neighbors=n_neighbors,
+                     n_jobs=n_jobs,
+                     batch_size=batch_size)
 
-# scikit learns locality sensitive hashing function
-def lshf_scikit(data, n_neighbors=4,
-               n_estimators=10,
-               min_hash_match=4,
-               n_candidates=10,
-               random_state=None):
-   n_neighbors += 1
+# blocked brute force nearest neighbors with a bounded memory footprint
+def knn_brute(data, n_neighbors=4,
+              metric='euclidean',
+              max_memory_mb=512,
+              n_jobs=1):
+    """Exact k-nearest neighbors computed tile by tile.
 
-   # initialize nearest neighbor model
-   nbrs = LSHForest(n_neighbors=n_neighbors,
-                    n_estimators = 10,
-                    min_hash_match = 4,
-                    n_candidates = 10,
-                    random_state = 0)
+    The squared euclidean distances of a tile of query rows against a
+    tile of reference rows come from one GEMM,
+    ||x||^2 - 2 x.y + ||y||^2, and a running top-k per query row is kept
+    with argpartition, so the full N x N distance matrix never exists.
+    The tile sizes are chosen so that all the workers together stay
+    within max_memory_mb.
 
-   # fit nearest neighbor model to the data
-   nbrs.fit(data)
+    The data is centered first and the distances of the selected
+    neighbors are recomputed exactly in float64, so float32 data far from
+    the origin keeps its accuracy. The cosine neighbors are searched on a
+    normalized copy of the data.
+
+    Parameters
+    ----------
+    data : array, [N x D]
+        the data points
+
+    n_neighbors : int, default=4
+        number of neighbors (the point itself is returned as well)
+
+    metric : str, ['euclidean'|'sqeuclidean'|'cosine']
+        distance returned for the neighbors ('cosine' is 1 - cos(x, y))
+
+    max_memory_mb : float, default=512
+        memory budget for the distance tiles of all the workers
 
-   # return the distances and indices
-   return nbrs.kneighbors(data)
+    n_jobs : int, default=1
+        number of worker threads (-1 uses all cores)
+
+    Returns
+    -------
+    distVals : array, [N x n_neighbors+1]
+
+    idx : array, [N x n_neighbors+1]
+    """
+    if metric not in ['euclidean', 'sqeuclidean', 'cosine']:
+        raise ValueError('Unrecognized metric for the blocked brute force '
+                         'kNN: {m}'.format(m=metric))
+
+    data = np.asarray(data)
+    if data.dtype != np.float32:
+        data = data.astype(np.float64)
+    if metric == 'cosine':
+        # unit vectors: ||x - y||^2 = 2 (1 - cos(x, y))
+        norms = np.sqrt(np.einsum('ij,ij->i', data, data))
+        norms[norms == 0] = 1
+        data = data / norms[:, None]
+    # center the data: the distances don't change but the expansion no
+    # longer cancels catastrophically on offset data (float32 especially)
+    data = (data - data.mean(axis=0, dtype=np.float64)).astype(data.dtype)
+    n_samples = data.shape[0]
+    n_neighbors = min(n_neighbors + 1, n_samples)
+    sq_norms = np.einsum('ij,ij->i', data, data, dtype=np.float64)
+
+    # tile sizes: a (rows x cols) tile costs roughly 16 bytes an entry
+    # (the distances plus the argpartition indices)
+    n_workers = _n_workers(n_jobs)
+    entries = max_memory_mb * 2.**20 / (16. * n_workers)
+    n_rows = int(min(max(entries // n_samples, 64), n_samples))
+    n_cols = int(min(max(entries // n_rows, 2 * n_neighbors), n_samples))
+
+    def top_k(dist, ind):
+        # the n_neighbors smallest entries of every row
+        if dist.shape[1] <= n_neighbors:
+            return dist, ind
+        keep = np.argpartition(dist, n_neighbors-1, axis=1)[:, :n_neighbors]
+        return np.take_along_axis(dist, keep, axis=1), \
+            np.take_along_axis(ind, keep, axis=1)
+
+    def query_block(start, stop):
+        X = data[start:stop]
+        best_dist, best_idx = None, None
+
+        for col_start in range(0, n_samples, n_cols):
+            col_stop = min(col_start + n_cols, n_samples)
+
+            # squared euclidean distances of the tile (the ||x||^2 term
+            # doesn't change the ranking so it is added at the end)
+            dist = np.dot(X, data[col_start:col_stop].T)
+            dist *= -2
+            dist += sq_norms[None, col_start:col_stop]
+            ind = np.broadcast_to(np.arange(col_start, col_stop),
+                                  dist.shape)
+            dist, ind = top_k(dist, ind)
+
+            # merge the tile with the running top-k
+            if best_dist is not None:
+                dist, ind = top_k(np.hstack((best_dist, dist)),
+                                  np.hstack((best_idx, ind)))
+            best_dist, best_idx = dist, ind
+
+        # exact squared distances of the top-k (in float64), sorted
+        diff = X[:, None, :] - data[best_idx]
+        best_dist = np.einsum('ijk,ijk->ij', diff, diff, dtype=np.float64)
+        order = np.argsort(best_dist, axis=1)
+        best_dist = np.take_along_axis(best_dist, order, axis=1)
+        best_idx = np.take_along_axis(best_idx, order, axis=1)
+        if metric == 'euclidean':
+            np.sqrt(best_dist, out=best_dist)
+        elif metric == 'cosine':
+            best_dist *= 0.5
+        return best_dist, best_idx
+
+    return knn_blocks(query_block,
+                      n_samples=n_samples,
+                      n_neighbors=n_neighbors,
+                      n_jobs=n_jobs,
+                      batch_size=n_rows)
+
+# chunked multi-core executor for the nearest neighbor queries
+def knn_blocks(query, n_samples, n_neighbors, n_jobs=1, batch_size=1024):
+    """Runs a k-nearest neighbor query over blocks of the query set
+    and reassembles the results in place.
+
+    Parameters
+    ----------
+    query : callable
+        query(start, stop) returns the (distances, indices) arrays,
+        each [(stop-start) x n_neighbors], for the query points
+        start:stop. It is called from several threads at once so the
+        index it searches must release the GIL (BLAS, the scikit-learn
+        trees and annoy all do).
+
+    n_samples : int
+        number of query points
+
+    n_neighbors : int
+        number of neighbors returned by each query
+
+    n_jobs : int, default=1
+        number of worker threads (-1 uses all cores)
+
+    batch_size : int, default=1024
+        number of query points in each block
+
+    Returns
+    -------
+    distVals : array, [n_samples x n_neighbors]
+
+    idx : array, [n_samples x n_neighbors]
+    """
+    distVals = np.empty((n_samples, n_neighbors), dtype=np.float64)
+    idx = np.empty((n_samples, n_neighbors), dtype=np.intp)
+
+    def run_block(start):
+        stop = min(start + batch_size, n_samples)
+        distVals[start:stop], idx[start:stop] = query(start, stop)
+
+    blocks = range(0, n_samples, batch_size)
+    n_workers = min(_n_workers(n_jobs), len(blocks))
+    if n_workers <= 1:
+        for start in blocks:
+            run_block(start)
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(run_block, blocks))
+
+    return distVals, idx
+
+# random projection locality sensitive hashing (LSH Forest style)
+def ann_lsh(data, n_neighbors=4,
+            metric='euclidean',
+            n_estimators=10,
+            n_bits=32,
+            min_hash_match=4,
+            n_candidates=10,
+            n_probes=2,
+            random_state=None,
+            max_memory_mb=512,
+            n_jobs=1):
+    """Approximate k-nearest neighbors with random projection LSH.
+
+    Every one of the n_estimators hash tables signs n_bits random
+    projections of the centered data into an integer code and keeps the
+    points sorted by code, so points sharing a long code prefix sit next
+    to each other (the sorted array version of an LSH Forest tree). A
+    query takes the n_candidates points around its code in every table,
+    plus around n_probes multiprobe codes with the least certain bit
+    flipped, drops those sharing fewer than min_hash_match leading bits
+    and re-ranks the candidates by their exact euclidean distances.
+
+    Parameters
+    ----------
+    data : array, [N x D]
+        the data points
+
+    n_neighbors : int, default=4
+        number of neighbors (the point itself is returned as well)
+
+    metric : str, default='euclidean'
+        only the euclidean distance is supported
+
+    n_estimators : int, default=10
+        number of hash tables
+
+    n_bits : int, default=32
+        length of the hash codes (at most 62)
+
+    min_hash_match : int, default=4
+        minimum number of leading code bits a candidate shares with the
+        probed code
+
+    n_candidates : int, default=10
+        candidates taken around every probed code. This is the
+        recall/latency knob: each query re-ranks up to
+        n_estimators * (n_probes+1) * n_candidates points.
+
+    n_probes : int, default=2
+        extra probes per table, flipping the bits whose projections are
+        closest to their hyperplane
+
+    random_state : int or RandomState, optional
+
+    max_memory_mb : float, default=512
+        memory budget of the candidate re-ranking of all the workers
+
+    n_jobs : int, default=1
+        number of worker threads (-1 uses all cores)
+
+    Returns
+    -------
+    distVals : array, [N x n_neighbors+1]
+        Rows with fewer candidates than neighbors are padded with np.inf.
+
+    idx : array, [N x n_neighbors+1]
+        Rows with fewer candidates than neighbors are padded with -1.
+    """
+    if metric != 'euclidean':
+        raise ValueError('Unrecognized metric for the LSH kNN: '
+                         '{m}'.format(m=metric))
+    if not 0 < n_bits <= 62:
+        raise ValueError('n_bits has to be between 1 and 62.')
+    random_state = check_random_state(random_state)
+
+    data = np.asarray(data)
+    if data.dtype != np.float32:
+        data = data.astype(np.float64)
+    n_samples, n_dims = data.shape
+    n_neighbors = min(n_neighbors + 1, n_samples)
+    n_candidates = min(n_candidates, n_samples)
+    n_probes = min(n_probes, n_bits)
+    min_hash_match = min(min_hash_match, n_bits)
+    sq_norms = np.einsum('ij,ij->i', data, data)
+
+    # hash tables: the codes of every table sorted in increasing order
+    planes = random_state.normal(size=(n_dims, n_estimators * n_bits))
+    planes = planes.astype(data.dtype)
+    mean = data.mean(axis=0)
+    bit_values = np.left_shift(np.int64(1), np.arange(n_bits-1, -1, -1,
+                                                      dtype=np.int64))
+
+    def project(start, stop):
+        proj = np.dot(data[start:stop] - mean, planes)
+        return proj.reshape(stop - start, n_estimators, n_bits)
+
+    codes = np.empty((n_estimators, n_samples), dtype=np.int64)
+    for start in range(0, n_samples, 4096):
+        stop = min(start + 4096, n_samples)
+        codes[:, start:stop] = np.dot(project(start, stop) > 0,
+                                      bit_values).T
+    order = np.argsort(codes, axis=1, kind='mergesort')
+    sorted_codes = np.take_along_axis(codes, order, axis=1)
+    del codes
+
+    n_cand = n_estimators * (n_probes + 1) * n_candidates + 1
+    offsets = np.arange(n_candidates) - n_candidates // 2
+    shift = n_bits - min_hash_match
+
+    def query_block(start, stop):
+        proj = project(start, stop)
+        n_query = stop - start
+        cand = np.empty((n_query, n_cand), dtype=np.int64)
+        cand[:, 0] = np.arange(start, stop)
+
+        # least certain bits of every table for the multiprobe codes
+        if n_probes > 0:
+            flips = np.argpartition(np.abs(proj), n_probes-1,
+                                    axis=2)[:, :, :n_probes]
+        col = 1
+        for t in range(n_estimators):
+            code = np.dot(proj[:, t] > 0, bit_values)
+            probes = [code] + [code ^ bit_values[flips[:, t, j]]
+                               for j in range(n_probes)]
+            for probe in probes:
+                pos = np.searchsorted(sorted_codes[t], probe)
+                pos = np.clip(pos[:, None] + offsets, 0, n_samples - 1)
+                found = order[t][pos]
+                # keep the candidates sharing the leading bits
+                match = (sorted_codes[t][pos] ^ probe[:, None]) >> shift == 0
+                cand[:, col:col+n_candidates] = np.where(match, found, -1)
+                col += n_candidates
+
+        # remove the duplicate candidates
+        cand.sort(axis=1)
+        cand[:, 1:][cand[:, 1:] == cand[:, :-1]] = -1
+
+        # re-rank the candidates with their exact distances
+        valid = cand >= 0
+        safe = np.where(valid, cand, 0)
+        dist = sq_norms[safe] - 2 * np.einsum('ijk,ik->ij', data[safe],
+                                              data[start:stop])
+        dist += sq_norms[start:stop, None]
+        dist[~valid] = np.inf
+
+        keep = np.argpartition(dist, n_neighbors-1, axis=1)[:, :n_neighbors] \
+            if n_cand > n_neighbors else np.argsort(dist, axis=1)
+        dist = np.take_along_axis(dist, keep, axis=1)
+        ind = np.take_along_axis(cand, keep, axis=1)
+        sort = np.argsort(dist, axis=1)
+        dist = np.take_along_axis(dist, sort, axis=1)
+        ind = np.take_along_axis(ind, sort, axis=1)
+        ind[np.isinf(dist)] = -1
+        return np.sqrt(np.maximum(dist, 0)), ind
+
+    # the gathered candidate vectors dominate the memory of a block
+    n_workers = _n_workers(n_jobs)
+    batch_size = int(max(max_memory_mb * 2.**20 /
+                         (n_workers * n_cand * (n_dims + 4) *
+                          data.dtype.itemsize), 1))
+
+    return knn_blocks(query_block,
+                      n_samples=n_samples,
+                      n_neighbors=n_neighbors,
+                      n_jobs=n_jobs,
+                      batch_size=batch_size)
 
 # annoy approximate nearest neighbor function
 def ann_annoy(data, metric='euclidean',
               n_neighbors=10,
-              trees=10):
+              trees=10,
+              search_k=-1,
+              n_jobs=1,
+              batch_size=1024):
     """My Approximate Nearest Neighbors function (ANN)
     using the annoy package.
 
+    The items are added from a contiguous float32 copy of the data and
+    every point is queried once with ``include_distances=True``. The
+    queries are split into batches which run across a thread pool (annoy
+    releases the GIL while searching) through knn_blocks.
+
     Parameters
     ----------
+    data : array, [N x D]
+        the data points to index and query
 
+    metric : str, ['euclidean'|'angular'|'manhattan'|'dot']
+        the annoy distance metric
+
+    n_neighbors : int, default=10
+        number of neighbors returned for each point (including the
+        point itself)
+
+    trees : int, default=10
+        number of random projection trees in the annoy forest
+
+    search_k : int, default=-1
+        number of nodes inspected during a query (-1 uses the annoy
+        default of n_neighbors * trees)
+
+    n_jobs : int, default=1
+        number of threads used for the queries (-1 uses all cores)
+
+    batch_size : int, default=1024
+        number of points each thread queries at a time
 
     Returns
     -------
+    distVals : array, [N x n_neighbors]
+        the distances to the nearest neighbors. Rows where annoy found
+        fewer than n_neighbors points are padded with np.inf.
 
-
+    idx : array, [N x n_neighbors]
+        the indices of the nearest neighbors. Rows where annoy found
+        fewer than n_neighbors points are padded with -1.
     """
-    datapoints = data.shape[0]
-    dimension = data.shape[1]
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    datapoints, dimension = data.shape
 
     # initialize the annoy database
-    ann = AnnoyIndex(dimension)
+    ann = AnnoyIndex(dimension, metric)
 
-    # store the datapoints
-    for (i, row) in enumerate(data):
-        ann.add_item(i, row.tolist())
+    # store the datapoints: one short list per row of the float32 copy
+    # (annoy only takes python sequences; converting the whole array at
+    # once is slower, as it allocates every float before the first add)
+    add_item = ann.add_item
+    for i, row in enumerate(data):
+        add_item(i, row.tolist())
 
     # build the index
     ann.build(trees)
 
-    # find the k-nearest neighbors for all points
-    idx = np.zeros((datapoints, n_neighbors), dtype='int')
-    distVals = idx.copy().astype(np.float)
+    def query_block(start, stop):
+        get_nns = ann.get_nns_by_item
+        distVals = np.full((stop - start, n_neighbors), np.inf)
+        idx = np.full((stop - start, n_neighbors), -1, dtype=np.intp)
+        for i in range(start, stop):
+            nns, dists = get_nns(i, n_neighbors, search_k=search_k,
+                                 include_distances=True)
+            idx[i - start, :len(nns)] = nns
+            distVals[i - start, :len(dists)] = dists
+        return distVals, idx
 
-    # extract the distance values
-    for i in range(0, datapoints):
-        idx[i,:] = ann.get_nns_by_item(i, n_neighbors)
+    # extract the neighbors and distance values
+    return knn_blocks(query_block,
+                      n_samples=datapoints,
+                      n_neighbors=n_neighbors,
+                      n_jobs=n_jobs,
+                      batch_size=batch_size)
+
+# nearest neighbor descent for the all-points knn graph
+def ann_nndescent(data, n_neighbors=4,
+                  metric='euclidean',
+                  n_trees=10,
+                  leaf_size=30,
+                  max_iter=10,
+                  delta=0.001,
+                  rho=0.5,
+                  random_state=None,
+                  max_memory_mb=512,
+                  n_jobs=1):
+    """Approximate k-nearest neighbor graph with NN-Descent.
+
+    The graph starts from the points sharing a leaf in a forest of random
+    projection trees and is then refined by local joins: the neighbors
+    (and reverse neighbors) of every point are compared with each other
+    and every pair closer than a current neighbor replaces it. All the
+    joins of an iteration are done at once on flat arrays of candidate
+    pairs, whose distances are computed in blocks across the workers.
+
+    Parameters
+    ----------
+    data : array, [N x D]
+        the data points
+
+    n_neighbors : int, default=4
+        number of neighbors (the point itself is returned as well)
+
+    metric : str, default='euclidean'
+        only the euclidean distance is supported
 
+    n_trees : int, default=10
+        number of random projection trees for the initial graph
+
+    leaf_size : int, default=30
+        maximum number of points in a random projection tree leaf
+
+    max_iter : int, default=10
+        maximum number of local join iterations
+
+    delta : float, default=0.001
+        early termination: stop once an iteration changes fewer than
+        delta * N * n_neighbors graph entries
+
+    rho : float, default=0.5
+        fraction of the new neighbors sampled for each local join
+
+    random_state : int or RandomState, optional
+
+    max_memory_mb : float, default=512
+        memory budget of the gathered pair vectors of all the workers
+
+    n_jobs : int, default=1
+        number of worker threads (-1 uses all cores)
+
+    Returns
+    -------
+    distVals : array, [N x n_neighbors+1]
+
+    idx : array, [N x n_neighbors+1]
+
+    References
+    ----------
+    W. Dong, M. Charikar and K. Li, "Efficient K-Nearest Neighbor Graph
+    Construction for Generic Similarity Measures", WWW 2011.
+    """
+    if metric != 'euclidean':
+        raise ValueError('Unrecognized metric for the NN-Descent kNN: '
+                         '{m}'.format(m=metric))
+    random_state = check_random_state(random_state)
+
+    data = np.asarray(data)
+    if data.dtype != np.float32:
+        data = data.astype(np.float64)
+    n_samples = data.shape[0]
+    k = min(n_neighbors, n_samples - 1)
+    sq_norms = np.einsum('ij,ij->i', data, data)
+
+    n_workers = _n_workers(n_jobs)
+    pair_block = int(max(max_memory_mb * 2.**20 /
+                         (2 * n_workers * data.shape[1] *
+                          data.dtype.itemsize), 1024))
+
+    def pair_distances(p, q):
+        # squared euclidean distances of the pairs (p[i], q[i])
+        d = np.empty(p.shape[0], dtype=data.dtype)
+
+        def run_block(start):
+            stop = min(start + pair_block, p.shape[0])
+            pb, qb = p[start:stop], q[start:stop]
+            d[start:stop] = sq_norms[pb] + sq_norms[qb] - \
+                2 * np.einsum('ij,ij->i', data[pb], data[qb])
+
+        blocks = range(0, p.shape[0], pair_block)
+        if n_workers == 1 or len(blocks) <= 1:
+            for start in blocks:
+                run_block(start)
+        else:
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                list(executor.map(run_block, blocks))
+        return np.maximum(d, 0, out=d)
+
+    # graph state: neighbors, squared distances and the 'new' flags
+    idx = np.full((n_samples, k), -1, dtype=np.int64)
+    dist = np.full((n_samples, k), np.inf, dtype=data.dtype)
+    new = np.zeros((n_samples, k), dtype=bool)
+
+    def update(idx, dist, new, p, q):
+        # try the candidate pairs in both directions
+        d = pair_distances(p, q)
+        p, q, d = np.concatenate((p, q)), np.concatenate((q, p)), \
+            np.concatenate((d, d))
+        closer = d < dist[p, -1]
+        return _nndescent_merge(idx, dist, new, p[closer], q[closer],
+                                d[closer])
+
+    # initial graph from the random projection tree leaves
+    for _ in range(n_trees):
+        leaves = _rp_tree_leaves(data, leaf_size, random_state)
+        order = np.argsort(leaves, kind='mergesort')
+        leaves = leaves[order]
+        p, q = [], []
+        for offset in range(1, min(leaf_size, n_samples)):
+            same = leaves[offset:] == leaves[:-offset]
+            p.append(order[:-offset][same])
+            q.append(order[offset:][same])
+        idx, dist, new, _ = update(idx, dist, new,
+                                   np.concatenate(p), np.concatenate(q))
+
+    # local joins
+    n_sample = max(int(rho * k), 1)
+    rows = np.arange(n_samples)[:, None]
+    for _ in range(max_iter):
+        valid = idx >= 0
+
+        # sample the new neighbors and mark them as old
+        priority = random_state.rand(n_samples, k)
+        priority[~(new & valid)] = np.inf
+        pick = np.argsort(priority, axis=1)[:, :n_sample]
+        picked = np.isfinite(np.take_along_axis(priority, pick, axis=1))
+        new_fwd = np.where(picked, np.take_along_axis(idx, pick, axis=1), -1)
+        new[rows, pick] &= ~picked
+        old_fwd = np.where(valid & ~new, idx, -1)
+        old_fwd[rows, pick] = np.where(picked, -1, old_fwd[rows, pick])
+
+        # add a sample of the reverse neighbors
+        new_list = np.hstack((new_fwd, _reverse_neighbors(
+            new_fwd, n_sample, random_state)))
+        old_list = np.hstack((old_fwd, _reverse_neighbors(
+            old_fwd, n_sample, random_state)))
+
+        # candidate pairs: new x new and new x old
+        n_new = new_list.shape[1]
+        a, b = np.triu_indices(n_new, 1)
+        p = np.concatenate((new_list[:, a].ravel(),
+                            np.repeat(new_list, old_list.shape[1], axis=1).ravel()))
+        q = np.concatenate((new_list[:, b].ravel(),
+                            np.tile(old_list, (1, n_new)).ravel()))
+        keep = (p >= 0) & (q >= 0) & (p != q)
+        p, q = p[keep], q[keep]
+
+        # remove the duplicate pairs
+        pairs = np.unique(np.minimum(p, q) * n_samples + np.maximum(p, q))
+        p, q = np.divmod(pairs, n_samples)
+
+        idx, dist, new, n_updates = update(idx, dist, new, p, q)
+        if n_updates <= delta * n_samples * k:
+            break
+
+    # the point itself comes first
+    order = np.argsort(dist, axis=1)
+    dist = np.sqrt(np.take_along_axis(dist, order, axis=1))
+    idx = np.take_along_axis(idx, order, axis=1)
+    idx = np.hstack((np.arange(n_samples)[:, None], idx))
+    dist = np.hstack((np.zeros((n_samples, 1), dtype=dist.dtype), dist))
+    return dist.astype(np.float64, copy=False), idx
+
+# random projection tree leaf of every point
+def _rp_tree_leaves(data, leaf_size, random_state):
+    n_samples = data.shape[0]
+    node = np.zeros(n_samples, dtype=np.int64)
+    active = np.arange(n_samples)
+
+    # split all the nodes of a level at once
+    while active.shape[0] > 0:
+        order = np.argsort(node[active], kind='mergesort')
+        active = active[order]
+        nodes, start, size = np.unique(node[active], return_index=True,
+                                       return_counts=True)
+        large = size > leaf_size
+        if not large.any():
+            break
+
+        # hyperplane between two random points of every node
+        a = start + (random_state.rand(nodes.shape[0]) * size).astype(int)
+        b = start + (a - start + 1 +
+                     (random_state.rand(nodes.shape[0]) *
+                      (size - 1)).astype(int)) % size
+        normal = data[active[a]] - data[active[b]]
+        offset = np.einsum('ij,ij->i', normal,
+                           (data[active[a]] + data[active[b]]) / 2)
+
+        member = np.repeat(np.arange(nodes.shape[0]), size)
+        side = np.einsum('ij,ij->i', data[active], normal[member]) > \
+            offset[member]
+        # ties (e.g. duplicate points) are split at random
+        degenerate = np.bincount(member, weights=side,
+                                 minlength=nodes.shape[0])
+        degenerate = (degenerate == 0) | (degenerate == size)
+        random_side = random_state.rand(active.shape[0]) < 0.5
+        side = np.where(degenerate[member], random_side, side)
+
+        node[active] = 2 * node[active] + 1 + side
+        active = active[large[member]]
+
+    return node
+
+# a random sample of the reverse neighbors of every point
+def _reverse_neighbors(neighbors, n_sample, random_state):
+    n_samples = neighbors.shape[0]
+    source = np.repeat(np.arange(n_samples), neighbors.shape[1])
+    target = neighbors.ravel()
+    valid = target >= 0
+    source, target = source[valid], target[valid]
+
+    # random order within every target, keep the first n_sample
+    order = np.lexsort((random_state.rand(target.shape[0]), target))
+    source, target = source[order], target[order]
+    rank = np.arange(target.shape[0]) - \
+        np.searchsorted(target, target, side='left')
+    keep = rank < n_sample
+
+    reverse = np.full((n_samples, n_sample), -1, dtype=np.int64)
+    reverse[target[keep], rank[keep]] = source[keep]
+    return reverse
+
+# merge candidate edges into the nn-descent graph
+def _nndescent_merge(idx, dist, new, target, source, cand_dist):
+    n_samples, k = idx.shape
+    row = np.repeat(np.arange(n_samples), k)
+    valid = idx.ravel() >= 0
+
+    t = np.concatenate((row[valid], target))
+    s = np.concatenate((idx.ravel()[valid], source))
+    d = np.concatenate((dist.ravel()[valid], cand_dist))
+    is_new = np.concatenate((new.ravel()[valid],
+                             np.ones(target.shape[0], dtype=bool)))
+    is_cand = np.concatenate((np.zeros(valid.sum(), dtype=bool),
+                              np.ones(target.shape[0], dtype=bool)))
+
+    # one entry per edge, the current graph entry first
+    key = t * n_samples + s
+    order = np.lexsort((is_cand, key))
+    first = np.concatenate(([True], key[order][1:] != key[order][:-1]))
+    order = order[first]
+
+    # the k closest entries of every point
+    order = order[np.lexsort((d[order], t[order]))]
+    t_sorted = t[order]
+    rank = np.arange(order.shape[0]) - \
+        np.searchsorted(t_sorted, t_sorted, side='left')
+    order, rank = order[rank < k], rank[rank < k]
+    t_sorted = t[order]
+
+    idx = np.full((n_samples, k), -1, dtype=np.int64)
+    dist = np.full((n_samples, k), np.inf, dtype=dist.dtype)
+    new = np.zeros((n_samples, k), dtype=bool)
+    idx[t_sorted, rank] = s[order]
+    dist[t_sorted, rank] = d[order]
+    new[t_sorted, rank] = is_new[order]
+
+    return idx, dist, new, int(is_cand[order].sum())
+
+# inverted file index with product quantization
+class IVFPQIndex(object):
+    """Inverted file index with product quantization (IVF-PQ).
+
+    A coarse k-means quantizer splits the data into n_lists inverted
+    lists and the residual of every point to its list centroid is
+    compressed into n_subquantizers codes of n_bits each (one codebook
+    per block of dimensions). A query probes its n_probe closest lists
+    and ranks their points with asymmetric distance tables, the squared
+    distances of its residual sub-vectors to every codeword, optionally
+    re-ranking the best candidates with their exact distances.
+
+    Parameters
+    ----------
+    n_lists : int, default=256
+        number of inverted lists (coarse centroids)
+
+    n_subquantizers : int, default=8
+        number of sub-quantizers (blocks of dimensions); at most one per
+        dimension is used, so low-dimensional data (D < n_subquantizers)
+        gets D sub-quantizers
+
+    n_bits : int, default=8
+        bits per sub-quantizer code (2**n_bits codewords)
+
+    n_train : int, default=50000
+        number of points sampled to train the quantizers
+
+    random_state : int or RandomState, optional
+
+    Attributes
+    ----------
+    coarse_centroids_ : array, [n_lists x D]
+
+    codebooks_ : list of n_subquantizers arrays, [2**n_bits x d_j]
+
+    subspaces_ : array, [min(n_subquantizers, D) + 1]
+        dimension boundaries of the sub-quantizers
+
+    References
+    ----------
+    H. Jegou, M. Douze and C. Schmid, "Product Quantization for Nearest
+    Neighbor Search", IEEE TPAMI 2011.
+    """
+    def __init__(self, n_lists=256, n_subquantizers=8, n_bits=8,
+                 n_train=50000, random_state=None):
+        self.n_lists = n_lists
+        self.n_subquantizers = n_subquantizers
+        self.n_bits = n_bits
+        self.n_train = n_train
+        self.random_state = random_state
+
+    def fit(self, data):
+        """Trains the coarse quantizer and the sub-quantizer codebooks"""
+        from sklearn.cluster import KMeans
+
+        random_state = check_random_state(self.random_state)
+        data = np.asarray(data, dtype=np.float64)
+        n_samples, n_dims = data.shape
+        # (uneven blocks are fine, but a block needs a dimension)
+        n_subquantizers = min(self.n_subquantizers, n_dims)
+
+        sample = data
+        if n_samples > self.n_train:
+            sample = data[random_state.choice(n_samples, self.n_train,
+                                              replace=False)]
+
+        coarse = KMeans(n_clusters=min(self.n_lists, sample.shape[0]),
+                        n_init=1, max_iter=20,
+                        random_state=random_state).fit(sample)
+        self.coarse_centroids_ = coarse.cluster_centers_
+        residuals = sample - self.coarse_centroids_[coarse.labels_]
+
+        self.subspaces_ = np.linspace(0, n_dims, n_subquantizers + 1
+                                      ).astype(int)
+        self.codebooks_ = []
+        for a, b in zip(self.subspaces_[:-1], self.subspaces_[1:]):
+            codebook = KMeans(n_clusters=min(2**self.n_bits,
+                                             sample.shape[0]),
+                              n_init=1, max_iter=20,
+                              random_state=random_state
+                              ).fit(residuals[:, a:b])
+            self.codebooks_.append(codebook.cluster_centers_)
+        return self
+
+    def add(self, data):
+        """Encodes the data into the inverted lists"""
+        data = np.asarray(data, dtype=np.float64)
+        if data.shape[1] != self.coarse_centroids_.shape[1]:
+            raise ValueError('The codebooks were trained on {d} '
+                             'dimensions.'.format(
+                                 d=self.coarse_centroids_.shape[1]))
+
+        lists = np.empty(data.shape[0], dtype=np.intp)
+        codes = np.empty((data.shape[0], len(self.codebooks_)),
+                         dtype=np.uint8 if self.n_bits <= 8 else np.uint16)
+        for start in range(0, data.shape[0], 4096):
+            stop = min(start + 4096, data.shape[0])
+            lists[start:stop] = _nearest_centroid(data[start:stop],
+                                                  self.coarse_centroids_)
+            residuals = data[start:stop] - \
+                self.coarse_centroids_[lists[start:stop]]
+            for j, (a, b) in enumerate(zip(self.subspaces_[:-1],
+                                           self.subspaces_[1:])):
+                codes[start:stop, j] = _nearest_centroid(
+                    residuals[:, a:b], self.codebooks_[j])
+
+        # inverted lists: the points sorted by list
+        order = np.argsort(lists, kind='mergesort')
+        self.list_ids_ = order
+        self.list_codes_ = codes[order]
+        self.list_ptr_ = np.zeros(self.coarse_centroids_.shape[0] + 1,
+                                  dtype=np.intp)
+        np.cumsum(np.bincount(lists, minlength=self.coarse_centroids_.shape[0]),
+                  out=self.list_ptr_[1:])
+        return self
+
+    def search(self, queries, n_neighbors=4, n_probe=8, data=None,
+               n_rerank=0, max_memory_mb=512, n_jobs=1):
+        """Approximate k-nearest neighbors of the queries.
+
+        Parameters
+        ----------
+        queries : array, [M x D]
+
+        n_neighbors : int, default=4
+            number of neighbors returned for each query
+
+        n_probe : int, default=8
+            number of inverted lists probed by each query
+
+        data : array, [N x D], optional
+            the indexed data, needed for the exact re-ranking
+
+        n_rerank : int, default=0
+            number of the best asymmetric distance candidates re-ranked
+            with their exact distances (0 keeps the asymmetric distances)
+
+        max_memory_mb : float, default=512
+            memory budget of the query blocks of all the workers
+
+        n_jobs : int, default=1
+            number of worker threads (-1 uses all cores)
+
+        Returns
+        -------
+        distVals : array, [M x n_neighbors]
+
+        idx : array, [M x n_neighbors]
+            missing neighbors are marked with -1 (and np.inf distances)
+        """
+        queries = np.asarray(queries, dtype=np.float64)
+        n_queries = queries.shape[0]
+        n_probe = min(n_probe, self.coarse_centroids_.shape[0])
+        if data is None:
+            n_rerank = 0
+        n_best = max(n_rerank, n_neighbors)
+        subspaces = list(zip(self.subspaces_[:-1], self.subspaces_[1:]))
+        sq_codebooks = [np.einsum('ij,ij->i', c, c) for c in self.codebooks_]
+        sq_centroids = np.einsum('ij,ij->i', self.coarse_centroids_,
+                                 self.coarse_centroids_)
+
+        def query_block(start, stop):
+            Q = queries[start:stop]
+            n_block = stop - start
+
+            # closest lists of every query
+            coarse = sq_centroids - 2 * np.dot(Q, self.coarse_centroids_.T)
+            probes = np.argpartition(coarse, n_probe-1, axis=1)[:, :n_probe] \
+                if n_probe < coarse.shape[1] else \
+                np.tile(np.arange(coarse.shape[1]), (n_block, 1))
+
+            # visit the lists one at a time with all the queries probing it
+            rows = np.repeat(np.arange(n_block), probes.shape[1])
+            probes = probes.ravel()
+            order = np.argsort(probes, kind='mergesort')
+            rows, probes = rows[order], probes[order]
+            bounds = np.flatnonzero(np.diff(probes)) + 1
+
+            best_d = np.full((n_block, n_best), np.inf)
+            best_i = np.full((n_block, n_best), -1, dtype=np.intp)
+            for q_rows in np.split(np.arange(rows.shape[0]), bounds):
+                if q_rows.shape[0] == 0:
+                    continue
+                l = probes[q_rows[0]]
+                q_rows = rows[q_rows]
+                codes = self.list_codes_[self.list_ptr_[l]:self.list_ptr_[l+1]]
+                if codes.shape[0] == 0:
+                    continue
+
+                # asymmetric distances from the residual distance tables
+                residuals = Q[q_rows] - self.coarse_centroids_[l]
+                dist = np.zeros((q_rows.shape[0], codes.shape[0]))
+                for j, (a, b) in enumerate(subspaces):
+                    r = residuals[:, a:b]
+                    table = np.einsum('ij,ij->i', r, r)[:, None] - \
+                        2 * np.dot(r, self.codebooks_[j].T) + sq_codebooks[j]
+                    dist += table[:, codes[:, j]]
+
+                ids = self.list_ids_[self.list_ptr_[l]:self.list_ptr_[l+1]]
+                dist = np.hstack((best_d[q_rows], dist))
+                ind = np.hstack((best_i[q_rows],
+                                 np.broadcast_to(ids, (q_rows.shape[0],
+                                                       ids.shape[0]))))
+                if dist.shape[1] > n_best:
+                    keep = np.argpartition(dist, n_best-1, axis=1)[:, :n_best]
+                    dist = np.take_along_axis(dist, keep, axis=1)
+                    ind = np.take_along_axis(ind, keep, axis=1)
+                best_d[q_rows], best_i[q_rows] = dist, ind
+
+            # exact re-ranking of the best candidates
+            if n_rerank:
+                valid = best_i >= 0
+                safe = np.where(valid, best_i, 0)
+                diff = data[safe] - Q[:, None, :]
+                best_d = np.where(valid, np.einsum('ijk,ijk->ij', diff, diff),
+                                  np.inf)
+
+            keep = np.argsort(best_d, axis=1)[:, :n_neighbors]
+            dist = np.take_along_axis(best_d, keep, axis=1)
+            ind = np.take_along_axis(best_i, keep, axis=1)
+            return np.sqrt(np.maximum(dist, 0)), ind
+
+        # the asymmetric distances (and re-ranking vectors) of a block
+        n_workers = _n_workers(n_jobs)
+        n_list = max(n_probe * self.list_ids_.shape[0] //
+                     max(self.coarse_centroids_.shape[0], 1), 1)
+        per_query = 8. * (n_list + 2 * n_best +
+                          n_rerank * queries.shape[1])
+        batch_size = int(max(max_memory_mb * 2.**20 / (n_workers * per_query),
+                             1))
+
+        return knn_blocks(query_block,
+                          n_samples=n_queries,
+                          n_neighbors=n_neighbors,
+                          n_jobs=n_jobs,
+                          batch_size=batch_size)
+
+    def save(self, path):
+        """Saves the trained quantizers (.npz)"""
+        codebooks = dict(('codebook_{j}'.format(j=j), c)
+                         for j, c in enumerate(self.codebooks_))
+        np.savez(path, coarse_centroids=self.coarse_centroids_,
+                 subspaces=self.subspaces_,
+                 params=np.array([self.n_lists, self.n_subquantizers,
+                                  self.n_bits, self.n_train]),
+                 **codebooks)
+
+    @classmethod
+    def load(cls, path):
+        """Loads quantizers saved with save()"""
+        with np.load(path) as saved:
+            n_lists, n_subquantizers, n_bits, n_train = saved['params']
+            index = cls(n_lists=int(n_lists),
+                        n_subquantizers=int(n_subquantizers),
+                        n_bits=int(n_bits), n_train=int(n_train))
+            index.coarse_centroids_ = saved['coarse_centroids']
+            index.subspaces_ = saved['subspaces']
+            index.codebooks_ = [saved['codebook_{j}'.format(j=j)]
+                                for j in range(len(index.subspaces_) - 1)]
+        return index
+
+# closest centroid of every point
+def _nearest_centroid(data, centroids):
+    return np.argmin(np.einsum('ij,ij->i', centroids, centroids) -
+                     2 * np.dot(data, centroids.T), axis=1)
+
+# product quantization approximate nearest neighbor function
+def ann_ivfpq(data, n_neighbors=4,
+              metric='euclidean',
+              n_lists=None,
+              n_probe=8,
+              n_subquantizers=8,
+              n_bits=8,
+              n_rerank=None,
+              codebooks=None,
+              random_state=None,
+              max_memory_mb=512,
+              n_jobs=1):
+    """Approximate k-nearest neighbors with an IVF-PQ index.
+
+    Parameters
+    ----------
+    data : array, [N x D]
+        the data points
+
+    n_neighbors : int, default=4
+        number of neighbors (the point itself is returned as well)
+
+    metric : str, default='euclidean'
+        only the euclidean distance is supported
+
+    n_lists : int, optional
+        number of inverted lists (default: sqrt(N))
+
+    n_probe : int, default=8
+        number of inverted lists probed by each point
+
+    n_subquantizers : int, default=8
+        number of product quantization sub-quantizers
+
+    n_bits : int, default=8
+        bits of every sub-quantizer code
+
+    n_rerank : int, optional
+        number of candidates re-ranked with their exact distances
+        (default: 10 * (n_neighbors+1), 0 disables the re-ranking)
+
+    codebooks : str, optional
+        .npz file of trained quantizers. It is loaded when it exists and
+        written after training otherwise.
+
+    random_state : int or RandomState, optional
+
+    max_memory_mb : float, default=512
+        memory budget of the query blocks of all the workers
+
+    n_jobs : int, default=1
+        number of worker threads (-1 uses all cores)
+
+    Returns
+    -------
+    distVals : array, [N x n_neighbors+1]
+
+    idx : array, [N x n_neighbors+1]
+    """
+    if metric != 'euclidean':
+        raise ValueError('Unrecognized metric for the IVF-PQ kNN: '
+                         '{m}'.format(m=metric))
+    data = np.asarray(data, dtype=np.float64)
+    n_samples = data.shape[0]
+    n_neighbors = min(n_neighbors, n_samples - 1)
+    if n_lists is None:
+        n_lists = max(int(np.sqrt(n_samples)), 1)
+    if n_rerank is None:
+        n_rerank = 10 * (n_neighbors + 1)
+
+    if codebooks is not None and os.path.exists(codebooks):
+        index = IVFPQIndex.load(codebooks)
+    else:
+        index = IVFPQIndex(n_lists=n_lists,
+                           n_subquantizers=n_subquantizers,
+                           n_bits=n_bits,
+                           random_state=random_state).fit(data)
+        if codebooks is not None:
+            index.save(codebooks)
+
+    distVals, idx = index.add(data).search(data,
+                                           n_neighbors=n_neighbors+1,
+                                           n_probe=n_probe,
+                                           data=data,
+                                           n_rerank=n_rerank,
+                                           max_memory_mb=max_memory_mb,
+                                           n_jobs=n_jobs)
+
+    # the point itself comes first (dropping the last neighbor when the
+    # search missed it)
+    points = np.arange(n_samples)
+    is_self = idx == points[:, None]
+    is_self[~is_self.any(axis=1), -1] = True
+    distVals = distVals[~is_self].reshape(n_samples, n_neighbors)
+    idx = idx[~is_self].reshape(n_samples, n_neighbors)
+    return np.hstack((np.zeros((n_samples, 1)), distVals)), \
+        np.hstack((points[:, None], idx))
+
+# number of workers for a joblib style n_jobs parameter
+def _n_workers(n_jobs):
+    if n_jobs is None:
+        return 1
+    elif n_jobs < 0:
+        return max(cpu_count() + 1 + n_jobs, 1)
+    else:
+        return max(int(n_jobs), 1)
+
+def annoy_benchmark(n_samples=20000, n_dims=200, n_neighbors=20,
+                    trees=10, n_jobs=-1):
+    """Times the batched annoy engine against the original per-item
+    get_nns_by_item/get_distance loop on random data, in total and for
+    adding the items alone."""
+    import time as time
+
+    X_data = np.random.random((n_samples, n_dims))
+
+    # original path: add_item(row.tolist()) and a get_distance loop
+    t0 = time.time()
+    ann = AnnoyIndex(n_dims, 'euclidean')
+    for (i, row) in enumerate(X_data):
+        ann.add_item(i, row.tolist())
+    t_add = time.time() - t0
+    ann.build(trees)
+    idx = np.zeros((n_samples, n_neighbors), dtype='int')
+    distVals = np.zeros((n_samples, n_neighbors))
+    for i in range(0, n_samples):
+        idx[i,:] = ann.get_nns_by_item(i, n_neighbors)
         for j in range(0, n_neighbors):
             distVals[i,j] = ann.get_distance(i, idx[i,j])
+    t1 = time.time()
 
-    return distVals, idx
+    # batched path
+    ann_annoy(X_data, n_neighbors=n_neighbors, trees=trees, n_jobs=n_jobs)
+    t2 = time.time()
+
+    # adding the items from the float32 copy, as ann_annoy does
+    data = np.ascontiguousarray(X_data, dtype=np.float32)
+    t3 = time.time()
+    add_item = AnnoyIndex(n_dims, 'euclidean').add_item
+    for i, row in enumerate(data):
+        add_item(i, row.tolist())
+    t4 = time.time()
 
-# Hdidx package for approximate nearest neighbor function
-# def ann_hdidx(data,
-#               n_neighbors = 10,
-#               indexer=8):
-#
-#    datapoints = data.shape[0]
-#    dimensions = data.shape[1]
-#
-#    data_query = np.random.random((n_neighbors, dimensions))
-#    print np.shape(data_query)
-#
-#    # create Product Quantization Indexer
-#    idx = hdidx.indexer.IVFPQIndexer()
-#
-#    # build indexer
-#    idx.build({'vals': data, 'nsubq': indexer})
-#
-#    # add database items to the indexer
-#    idx.add(data)
-#
-#    # searching in the database and return top-10 items for
-#    # each query
-#    idn, distVals = idx.search(data, n_neighbors)
-#    return distVals, idn
+    print('adding the items: {a:.2f} secs -> {b:.2f} secs'.format(
+        a=t_add, b=t4-t3))
+    print('annoy loop: {a:.2f} secs, batched annoy: {b:.2f} secs, '
+          'speedup: {s:.1f}x'.format(a=t1-t0, b=t2-t1,
+                                     s=(t1-t0)/(t2-t1)))
 
 if __name__ == "__main__":
 
@@ -203,7 +1430,8 @@ if __name__ == "__main__":
     print('Size of X is {s}'.format(s=np.shape(X_data)))
 
 
-    for nn_model in ['brute','kd_tree', 'ball_tree', 'annoy']:
+    for nn_model in ['brute','kd_tree', 'ball_tree', 'annoy', 'lsh',
+                     'nndescent', 'ivfpq']:
 
         t0 = time.time()
         # initialize knn model
@@ -215,3 +1443,5 @@ if __name__ == "__main__":
         t1 = time.time()
 
         print('{m}, time taken: {s:.2f}'.format(m=nn_model, s=t1-t0))
+
+    annoy_benchmark()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse graph Laplacians built directly from the CSR arrays of the
+adjacency matrix.
+
+The degrees are computed once, with np.add.reduceat over the CSR
+indptr, and the Laplacian arrays are filled in a single pass, so no
+intermediate D - W or D^-1/2 W D^-1/2 sparse products are formed.
+"""
+import numpy as np
+from scipy.sparse import csr_matrix, dia_matrix
+
+
+def degrees(W, dtype=None):
+    """Weighted degree of every node of the adjacency matrix W.
+
+    Parameters
+    ----------
+    W : sparse matrix, [N x N]
+        the adjacency matrix
+
+    dtype : numpy dtype, optional
+        dtype of the degrees (default: dtype of W, float64 for integer
+        matrices). The sums are always accumulated in float64.
+
+    Returns
+    -------
+    degree : array, [N]
+    """
+    W = csr_matrix(W)
+    if dtype is None:
+        dtype = _float_dtype(W.dtype)
+
+    degree = np.zeros(W.shape[0], dtype=np.float64)
+    rows = np.flatnonzero(np.diff(W.indptr))
+    if rows.shape[0]:
+        degree[rows] = np.add.reduceat(W.data[:W.indptr[-1]],
+                                       W.indptr[rows], dtype=np.float64)
+    return degree.astype(dtype, copy=False)
+
+
+def laplacian(W, kind='unnormalized', return_diag=False, diag_format='dia',
+              dtype=None):
+    """Graph Laplacian of the symmetric adjacency matrix W.
+
+    Parameters
+    ----------
+    W : sparse matrix, [N x N]
+        symmetric weighted adjacency matrix. Self-loops are allowed;
+        they cancel out of the Laplacian.
+
+    kind : str ['unnormalized'|'symmetric'|'random_walk'], default='unnormalized'
+        * 'unnormalized' : L = D - W
+        * 'symmetric'    : L = I - D^-1/2 W D^-1/2
+        * 'random_walk'  : L = I - D^-1 W
+
+        None and False mean 'unnormalized', True 'symmetric'. The short
+        names 'sym' and 'rw' are accepted as well.
+
+    return_diag : bool, default=False
+        return the degrees as well
+
+    diag_format : str ['dia'|'array'], default='dia'
+        the degrees as a sparse diagonal matrix or as the 1-D vector
+        (both share the same memory)
+
+    dtype : numpy dtype, optional
+        dtype of the Laplacian (default: dtype of W, float64 for integer
+        matrices)
+
+    Returns
+    -------
+    L : csr_matrix, [N x N]
+
+    D : dia_matrix [N x N] or array [N], if return_diag
+        the degrees of the nodes
+
+    Notes
+    -----
+    The diagonal of L is stored as the first entry of every row, so the
+    column indices of L are not sorted.
+    """
+    kind = _laplacian_kind(kind)
+    W = csr_matrix(W)
+    if W.shape[0] != W.shape[1]:
+        raise ValueError('The adjacency matrix must be square.')
+    if dtype is None:
+        dtype = _float_dtype(W.dtype)
+
+    n_samples = W.shape[0]
+    nnz = W.indptr[-1]
+    counts = np.diff(W.indptr)
+    degree = degrees(W, dtype=dtype)
+
+    # off-diagonal values
+    data = np.negative(W.data[:nnz], dtype=dtype)
+    if kind == 'unnormalized':
+        diag = degree
+    else:
+        with np.errstate(divide='ignore'):
+            if kind == 'symmetric':
+                scale = 1. / np.sqrt(degree)
+            else:
+                scale = 1. / degree
+        scale[degree == 0] = 0
+        data *= np.repeat(scale, counts)
+        if kind == 'symmetric':
+            data *= scale[W.indices[:nnz]]
+        diag = (degree != 0).astype(dtype)
+
+    # one diagonal entry in front of every row
+    index_dtype = W.indptr.dtype
+    if nnz + n_samples >= np.iinfo(np.int32).max:
+        index_dtype = np.int64
+    indptr = W.indptr.astype(index_dtype) + \
+        np.arange(n_samples + 1, dtype=index_dtype)
+    is_diag = np.zeros(nnz + n_samples, dtype=bool)
+    is_diag[indptr[:-1]] = True
+
+    L_data = np.empty(nnz + n_samples, dtype=dtype)
+    L_data[is_diag] = diag
+    L_data[~is_diag] = data
+    L_indices = np.empty(nnz + n_samples, dtype=index_dtype)
+    L_indices[is_diag] = np.arange(n_samples)
+    L_indices[~is_diag] = W.indices[:nnz]
+    del data, is_diag
+
+    L = csr_matrix((L_data, L_indices, indptr),
+                   shape=(n_samples, n_samples))
+
+    if not return_diag:
+        return L
+
+    if diag_format == 'array':
+        return L, degree
+    elif diag_format == 'dia':
+        return L, dia_matrix((degree[None, :], [0]),
+                             shape=(n_samples, n_samples))
+    else:
+        raise ValueError('Unrecognized degree format: {f}'.format(
+            f=diag_format))
+
+
+def _laplacian_kind(kind):
+    if kind in [None, False, 'unnormalized']:
+        return 'unnormalized'
+    elif kind in [True, 'symmetric', 'sym']:
+        return 'symmetric'
+    elif kind in ['random_walk', 'rw']:
+        return 'random_walk'
+    raise ValueError('Unrecognized Laplacian: {k}'.format(k=kind))
+
+
+def _float_dtype(dtype):
+    if np.issubdtype(dtype, np.floating):
+        return dtype
+    return np.float64
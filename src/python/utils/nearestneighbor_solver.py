@@ -6,7 +6,7 @@ Created on Sat Apr 23 11:22:07 2016
 """
 import numpy as np
 from sklearn.neighbors import NearestNeighbors
-from annoy import AnnoyIndex
+from utils.knn_solvers import ann_annoy
 
 # Find the k-nearest neighbours
 def knn_scikit(data, n_neighbors=4, method='brute'):
@@ -42,44 +42,18 @@ def knn_scikit(data, n_neighbors=4, method='brute'):
 # Find approximate nearest neighbors
 def knn_annoy(data, metric='euclidean',
               n_neighbors=10,
-              trees=10):
+              trees=10,
+              n_jobs=1):
     """My Approximate Nearest Neighbors function (ANN)
     using the annoy package.
-    
-    Parameters
-    ----------
-    
-    
-    Returns
-    -------
-    
-    
+
+    This is a thin wrapper around the batched annoy engine,
+    utils.knn_solvers.ann_annoy.
     """
-    datapoints = data.shape[0]
-    dimension = data.shape[1]
-    
-    # initialize the annoy database
-    ann = AnnoyIndex(dimension)
-    
-    # store the datapoints
-    for (i, row) in enumerate(data):
-        ann.add_item(i, row.tolist())
-        
-    # build the index
-    ann.build(trees)
-    
-    # find the k-nearest neighbors for all points
-    idx = np.zeros((datapoints, n_neighbors), dtype='int')
-    distVals = idx.copy().astype(np.float)
-    
-    # extract the distance values
-    for i in range(0, datapoints):
-        idx[i,:] = ann.get_nns_by_item(i, n_neighbors)
-        
-        for j in range(0, n_neighbors):
-            distVals[i,j] = ann.get_distance(i, idx[i,j])
-            
-    return distVals, idx
+    return ann_annoy(data, metric=metric,
+                     n_neighbors=n_neighbors,
+                     trees=trees,
+                     n_jobs=n_jobs)
 
 # Compute the weights for the distance matrix
 def dist_weights(distVal, method='heat',
@@ -90,12 +64,8 @@ def dist_weights(distVal, method='heat',
 
     if method in ['angle']:       # The angle weight
 
-        distValWeight = np.exp(-np.arcose(1 - distVal))
-        
-        # check for nan's (this tends to happen sometimes)
-        if np.isnan(distValWeight):
-            raise ValueError('Sorry...there are nans.'
-            'Please use the heat kernel for now.')
+        # clip the round-off that puts 1 - distVal outside of [-1, 1]
+        distValWeight = np.exp(-np.arccos(np.clip(1 - distVal, -1, 1)))
 
         
     elif method in ['heat']:      # The heat weight kernel
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Matrix-free operators for the eigenvalue problems.
+
+L + alpha * V is represented by its CSR pieces and applied term by term,
+so the summed matrix (with the union of both sparsity patterns) is never
+stored.
+"""
+import numpy as np
+from scipy.sparse import csr_matrix, dia_matrix, diags, issparse
+from scipy.sparse.linalg import LinearOperator
+
+
+class SumOperator(LinearOperator):
+    """Symmetric linear operator sum_i coef_i * M_i.
+
+    Parameters
+    ----------
+    terms : list of (float, matrix)
+        the coefficients and the (sparse or dense) symmetric matrices,
+        all of the same shape
+
+    dtype : numpy dtype, optional
+        dtype of the operator (default: the result type of the terms)
+    """
+    def __init__(self, terms, dtype=None):
+        terms = [(float(coef), M) for coef, M in terms]
+        if dtype is None:
+            dtype = np.result_type(*[M.dtype for _, M in terms])
+        shape = terms[0][1].shape
+        for _, M in terms:
+            if M.shape != shape:
+                raise ValueError('The operator terms must have the same '
+                                 'shape.')
+        self.terms = terms
+        super(SumOperator, self).__init__(dtype=np.dtype(dtype), shape=shape)
+
+    def _matvec(self, x):
+        return self._matmat(x)
+
+    def _matmat(self, X):
+        Y = None
+        for coef, M in self.terms:
+            MX = M.dot(X)
+            if coef != 1.:
+                MX *= coef
+            if Y is None:
+                Y = MX
+            else:
+                Y += MX
+        return Y.astype(np.result_type(self.dtype, X.dtype), copy=False)
+
+    def _adjoint(self):
+        return self
+
+    def astype(self, dtype):
+        """The operator with every term cast to dtype"""
+        return SumOperator([(coef, M.astype(dtype))
+                            for coef, M in self.terms], dtype=dtype)
+
+    def diagonal(self):
+        """Diagonal of the summed matrix"""
+        diagonal = np.zeros(self.shape[0], dtype=np.float64)
+        for coef, M in self.terms:
+            diagonal += coef * M.diagonal()
+        return diagonal.astype(self.dtype, copy=False)
+
+    def sparse_approximation(self):
+        """The first term plus the diagonals of the other terms, as a CSR
+        matrix with the sparsity pattern of the first term. It is meant
+        for building preconditioners (e.g. algebraic multigrid) without
+        summing the terms."""
+        coef, M = self.terms[0]
+        shift = np.zeros(self.shape[0], dtype=np.float64)
+        for c, other in self.terms[1:]:
+            shift += c * other.diagonal()
+        return csr_matrix(coef * M + diags(shift.astype(self.dtype)),
+                          dtype=self.dtype)
+
+    def tocsr(self):
+        """The summed matrix"""
+        A = None
+        for coef, M in self.terms:
+            A = coef * M if A is None else A + coef * M
+        return csr_matrix(A, dtype=self.dtype)
+
+    def toarray(self):
+        """The summed matrix as a dense array"""
+        return self.tocsr().toarray()
+
+
+def diagonal_operator(d):
+    """Linear operator of the diagonal matrix diag(d)"""
+    d = np.asarray(d)
+
+    def matmat(X):
+        if X.ndim == 1:
+            return d * X
+        return d[:, None] * X
+
+    return LinearOperator(shape=(d.shape[0], d.shape[0]), dtype=d.dtype,
+                          matvec=matmat, matmat=matmat, rmatvec=matmat)
+
+
+def diagonal_of(B):
+    """The diagonal of B when B is a diagonal matrix (a dia_matrix with
+    only the main diagonal, or a 1-D vector), None otherwise"""
+    if isinstance(B, np.ndarray) and B.ndim == 1:
+        return B
+    if isinstance(B, dia_matrix) and np.all(B.offsets == 0):
+        return B.diagonal()
+    return None
+
+
+def laplacian_operator(L, V=None, alpha=1.0):
+    """Matrix-free L + alpha * V (just L when there is no potential)"""
+    if V is None:
+        return L
+    return SumOperator([(1., L), (alpha, V)])
+
+
+def to_matrix(A):
+    """An explicit (sparse or dense) matrix for A"""
+    if issparse(A) or isinstance(A, np.ndarray):
+        return A
+    if isinstance(A, SumOperator):
+        return A.tocsr()
+    return A.dot(np.eye(A.shape[1], dtype=A.dtype))
@@ -0,0 +1,241 @@
+import warnings
+import numpy as np
+from numpy.testing import assert_allclose, assert_equal
+from scipy.linalg import eigh
+from utils.graph import compute_adjacency, create_laplacian
+from utils.eigenvalue_decomposition import EigSolver, eig_scipy, eig_dense, \
+    eig_randomized, eig_multi, select_solver, solver_costs, \
+    available_memory, SOLVER_COSTS, CALIBRATION_PAIRS, N_ITER
+from utils.operators import laplacian_operator
+
+
+def laplacian(n_samples=300, seed=0):
+    X = np.random.RandomState(seed).rand(n_samples, 3)
+    return create_laplacian(compute_adjacency(X, n_neighbors=8,
+                                              cache=False))
+
+
+def test_eig_scipy_shift_invert():
+    """Shift-invert ARPACK finds the smallest generalized eigenpairs"""
+    L, D = laplacian()
+    ref = eigh(L.toarray(), D.toarray(), eigvals_only=True)[:5]
+
+    vals, vecs, info = eig_scipy(L, D, n_components=5, random_state=0,
+                                 return_info=True)
+    assert_allclose(vals, ref, atol=1e-8)
+    assert_equal(info['converged'], 5)
+    assert info['sigma'] < 0
+    assert info['n_solves'] > 0
+    assert np.all(info['residuals'] < 1e-6)
+
+    # 'SM' mode agrees
+    vals_sm, _ = eig_scipy(L, D, n_components=5, shift_invert=False,
+                           random_state=0)
+    assert_allclose(vals_sm, ref, atol=1e-6)
+
+
+def test_eig_scipy_factorization_cache():
+    """The factorization of the same problem is reused"""
+    L, D = laplacian(seed=1)
+    _, _, info = eig_scipy(L, D, n_components=3, return_info=True)
+    assert not info['cached']
+    _, _, info = eig_scipy(L.copy(), D, n_components=3, return_info=True)
+    assert info['cached']
+
+
+def test_eigsolver_arpack_drops_trivial_pair():
+    """The 'arpack' solver skips the zero eigenvalue, like 'dense'"""
+    L, D = laplacian(seed=2)
+    model = EigSolver(n_components=3, eig_solver='arpack', sparse=True,
+                      random_state=0)
+    vals, vecs = model.find_eig(L, D)
+
+    assert_equal(vecs.shape, (300, 3))
+    assert_allclose(vals, eigh(L.toarray(), D.toarray(),
+                               eigvals_only=True)[1:4], atol=1e-8)
+    assert_equal(model.info_['converged'], 4)
+
+
+def test_eig_multi_cache_and_warm_start():
+    """The AMG hierarchy is reused and a warm start from the solution
+    converges at once"""
+    L, D = laplacian(n_samples=500, seed=3)
+    ref = eigh(L.toarray(), D.toarray(), eigvals_only=True)[1:4]
+
+    model = EigSolver(n_components=3, eig_solver='multi', sparse=True,
+                      tol=1e-6, max_iter=200, random_state=0,
+                      warm_start=True)
+    vals, _ = model.find_eig(L, D)
+    first = model.info_
+    assert_allclose(vals, ref, atol=1e-6)
+
+    vals, _ = model.find_eig(L, D)
+    assert model.info_['cached']
+    assert model.info_['n_iter'] < first['n_iter']
+    assert_allclose(vals, ref, atol=1e-6)
+
+
+def test_eig_multi_alpha_sweep_cache():
+    """The AMG hierarchy of L is reused along a sweep over alpha"""
+    L, D = laplacian(n_samples=400, seed=5)
+    V = D.copy()
+    V.data[:] = np.random.RandomState(5).rand(V.nnz)
+
+    for i, alpha in enumerate([1., 2., 4.]):
+        A = laplacian_operator(L, V, alpha)
+        vals, _, info = eig_multi(A, D, n_components=3, tol=1e-8,
+                                  maxiter=500, random_state=0,
+                                  return_info=True)
+        assert_equal(info['cached'], i > 0)
+        ref = eigh((L + alpha * V).toarray(), D.toarray(),
+                   eigvals_only=True)[:3]
+        assert_allclose(vals, ref, rtol=1e-6)
+
+
+def test_eigsolvers_agree():
+    """Every solver returns the same eigenvalues, without the trivial
+    pair"""
+    L, D = laplacian(n_samples=400, seed=6)
+    ref = eigh(L.toarray(), D.toarray(), eigvals_only=True)[1:4]
+
+    for solver in ['dense', 'arpack', 'multi', 'randomized']:
+        model = EigSolver(n_components=3, eig_solver=solver,
+                          sparse=solver != 'dense',
+                          tol=1e-8, max_iter=500, n_iter=40,
+                          random_state=0)
+        vals, vecs = model.find_eig(L, D)
+        assert_equal(model.eig_solver_, solver)
+        assert_equal(vecs.shape, (400, 3))
+        assert_allclose(vals, ref, rtol=1e-4, atol=1e-8)
+
+
+def test_eigsolver_keeps_explicit_choice(capsys):
+    """The sparse flag doesn't override the solver, and nothing is
+    printed"""
+    L, D = laplacian(n_samples=200, seed=7)
+    for solver, sparse in [('dense', True), ('arpack', False),
+                           ('multi', False)]:
+        model = EigSolver(n_components=2, eig_solver=solver, sparse=sparse,
+                          tol=1e-8, max_iter=500, random_state=0)
+        model.find_eig(L, D)
+        assert_equal(model.eig_solver_, solver)
+    assert_equal(capsys.readouterr().out, '')
+
+
+def test_eig_dense_subset():
+    """Only eigenpairs 1 to k of the generalized problem are computed"""
+    rng = np.random.RandomState(4)
+    X = rng.randn(50, 8)
+    A = np.dot(X.T, X)
+    B = np.dot(X.T * rng.rand(50), X)
+    ref_vals, ref_vecs = eigh(A, B)
+
+    vals, vecs = eig_dense(A, B, k_dims=3)
+    assert_allclose(vals, ref_vals[1:4])
+    assert_allclose(np.dot(A, vecs), np.dot(B, vecs) * vals, atol=1e-8)
+    assert_allclose(np.dot(vecs.T, np.dot(B, vecs)), np.eye(3), atol=1e-8)
+
+    vals, _ = eig_dense(A, k_dims=3)
+    assert_allclose(vals, eigh(A, eigvals_only=True)[1:4])
+
+    # a singular B
+    B[:, 0] = B[0, :] = 0
+    vals, _ = eig_dense(A, B, k_dims=2)
+    assert np.all(np.isfinite(vals))
+
+
+def test_eigsolver_routes_large_graphs():
+    """Sparse graph problems above max_dense_size skip the dense solver"""
+    L, D = laplacian(n_samples=300, seed=5)
+    model = EigSolver(n_components=2, eig_solver='dense', max_dense_size=100,
+                      random_state=0)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        vals, _ = model.find_eig(L, D)
+    assert_equal(model.eig_solver_, 'arpack')
+    assert any(w.category is RuntimeWarning for w in caught)
+
+    model = EigSolver(n_components=2, eig_solver='dense')
+    vals_dense, _ = model.find_eig(L, D)
+    assert_equal(model.eig_solver_, 'dense')
+    assert_allclose(vals, vals_dense, atol=1e-8)
+
+
+def test_eig_randomized():
+    """The randomized block Krylov solver converges to the smallest
+    generalized eigenpairs"""
+    L, D = laplacian(n_samples=400, seed=6)
+    ref = eigh(L.toarray(), D.toarray(), eigvals_only=True)[:3]
+
+    vals, vecs, info = eig_randomized(L, D, n_components=3, n_iter=40,
+                                      random_state=0, return_info=True)
+    assert_allclose(vals, ref, atol=1e-6)
+    assert np.all(info['residuals'] < 1e-4)
+    assert_allclose(np.dot(vecs.T, D.dot(vecs)), np.eye(3), atol=1e-8)
+
+    model = EigSolver(n_components=2, eig_solver='rsvd', sparse=True,
+                      n_iter=40, random_state=0)
+    vals, vecs = model.find_eig(L, D)
+    assert_equal(model.eig_solver_, 'randomized')
+    assert_allclose(vals, ref[1:], atol=1e-6)
+
+
+def test_eig_randomized_tol():
+    """tol stops the Krylov iterations once the residuals are small, and
+    warns when n_iter is reached first"""
+    L, D = laplacian(n_samples=1000, seed=9)
+    ref = eigh(L.toarray(), D.toarray(), eigvals_only=True)[1:4]
+
+    model = EigSolver(n_components=3, eig_solver='randomized', tol=1e-8,
+                      max_iter=200, random_state=0)
+    vals, _ = model.find_eig(L, D)
+    assert_allclose(vals, ref, rtol=1e-8)
+    assert_equal(model.info_['converged'], 4)
+    assert model.info_['n_iter'] < 200
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        _, _, info = eig_randomized(L, D, n_components=4, n_iter=2, tol=1e-8,
+                                    random_state=0, return_info=True)
+    assert_equal(info['n_iter'], 2)
+    assert info['converged'] < 4
+    assert any(w.category is RuntimeWarning for w in caught)
+
+
+def test_eigsolver_auto():
+    """The 'auto' mode picks a solver from the cost model and records it
+    with its time"""
+    L, D = laplacian(n_samples=300, seed=7)
+    ref = eigh(L.toarray(), D.toarray(), eigvals_only=True)[1:3]
+
+    model = EigSolver(n_components=2, eig_solver='auto', random_state=0)
+    vals, _ = model.find_eig(L, D)
+    assert model.eig_solver_ in ['dense', 'arpack', 'multi']
+    assert model.eig_time_ >= 0
+    assert set(model.solver_costs_) == set(['dense', 'arpack', 'multi',
+                                            'randomized'])
+    assert_allclose(vals, ref, atol=1e-6)
+
+    # dense arrays stay dense
+    model.find_eig(L.toarray(), D.toarray())
+    assert_equal(model.eig_solver_, 'dense')
+
+    # nothing fits: the smallest footprint
+    solver, costs = select_solver(L, D, n_components=2, max_memory=0)
+    assert_equal(costs[solver][1], min(cost[1] for cost in costs.values()))
+
+
+def test_solver_costs_randomized_scaling():
+    """The randomized cost follows the size of its Krylov space, relative
+    to the calibration defaults"""
+    L, D = laplacian(n_samples=600, seed=8)
+    coef, exponent = SOLVER_COSTS['randomized']
+    costs = solver_costs(L, D, n_components=CALIBRATION_PAIRS - 1)
+    assert_allclose(costs['randomized'][0], coef * L.nnz ** exponent)
+
+    deeper = solver_costs(L, D, n_components=CALIBRATION_PAIRS - 1,
+                          n_iter=2 * N_ITER + 1)
+    assert_allclose(deeper['randomized'][0], 2 * costs['randomized'][0])
+
+    memory = available_memory()
+    assert memory is None or memory > 0
@@ -0,0 +1,157 @@
+import numpy as np
+from numpy.testing import assert_equal, assert_allclose
+from scipy.sparse import csr_matrix
+
+from utils.graph import create_adjacency, maximum
+from utils.knn_solvers import KnnSolver, knn_brute
+
+
+def test_create_adjacency_matches_maximum():
+    """Direct CSR assembly equals the csr_matrix + maximum(A, A.T) graph"""
+    rng = np.random.RandomState(0)
+    distance_vals, indices = knn_brute(rng.rand(400, 5), n_neighbors=6)
+
+    row = np.repeat(indices[:, 0], 6)
+    W_sparse = csr_matrix((np.ravel(distance_vals[:, 1:]),
+                           (row, np.ravel(indices[:, 1:]))),
+                          shape=(400, 400))
+    W_max = maximum(W_sparse, W_sparse.T)
+
+    W = create_adjacency(distance_vals, indices)
+    assert_equal(W.nnz, W_max.nnz)
+    assert_allclose(W.toarray(), W_max.toarray())
+
+    W = create_adjacency(distance_vals.astype(np.float32), indices,
+                         reduce='mean')
+    assert_equal(W.dtype, np.float32)
+    assert_allclose(W.toarray(), W.T.toarray())
+
+
+def test_graph_store_memory_maps(tmpdir):
+    """A stored graph is loaded back memory-mapped and unchanged"""
+    from utils.graph import compute_adjacency
+    from utils.graph_store import GraphStore
+    X = np.random.RandomState(0).rand(300, 4)
+    store = GraphStore(str(tmpdir))
+
+    W = compute_adjacency(X, n_neighbors=5, cache=False, store=store)
+    W_stored = store.load_adjacency(store.key(store.key(
+        KnnSolver(n_neighbors=5).search_key(X)), 5))
+    assert not W_stored.data.flags.writeable
+    assert not W_stored.data.flags.owndata
+
+    W_loaded = compute_adjacency(X, n_neighbors=5, cache=False, store=store)
+    assert_allclose(W_loaded.toarray(), W.toarray())
+
+    # a smaller graph is built from the stored neighbors
+    distVals, idx = store.load_knn(store.key(
+        KnnSolver().search_key(X)), 3)
+    assert_equal(idx.shape, (300, 4))
+
+
+def test_radius_adjacency():
+    """The epsilon-neighborhood graph matches the dense distance threshold"""
+    from scipy.spatial.distance import cdist
+    from utils.graph import create_radius_adjacency, compute_adjacency
+    X = np.random.RandomState(0).rand(500, 3)
+    D = cdist(X, X)
+    D[(D > 0.2) | np.eye(500, dtype=bool)] = 0
+
+    for algorithm in ['kd_tree', 'ball_tree', 'brute']:
+        W = create_radius_adjacency(X, 0.2, neighbors_algorithm=algorithm,
+                                    batch_size=128)
+        assert_allclose(W.toarray(), D)
+
+    # the degree cap keeps the closest neighbors of every point
+    W = create_radius_adjacency(X, 0.2, max_degree=3)
+    assert_allclose(W.toarray(), W.T.toarray())
+    assert np.all(D[W.nonzero()] > 0)
+    assert W.nnz < np.count_nonzero(D)
+
+    W = compute_adjacency(X, affinity='radius', radius=0.2, weight='heat')
+    assert_allclose(W.toarray()[D > 0], np.exp(-D[D > 0]**2))
+
+
+def test_graph_sparsification():
+    """Mutual kNN graph, hard degree cap and spectral sparsifier"""
+    from utils.graph import cap_degree, spectral_sparsify
+    rng = np.random.RandomState(0)
+    distance_vals, indices = knn_brute(rng.rand(1000, 3), n_neighbors=8)
+
+    W_or = create_adjacency(distance_vals, indices)
+    W_and = create_adjacency(distance_vals, indices, symmetrize='and')
+    assert W_and.nnz < W_or.nnz
+    assert_allclose(W_and.toarray(), W_or.toarray() * (W_and.toarray() > 0))
+
+    # an edge is mutual when both rows picked it
+    picked = np.zeros((1000, 1000), dtype=bool)
+    picked[np.repeat(indices[:, 0], 8), np.ravel(indices[:, 1:])] = True
+    assert_equal(W_and.toarray() > 0, picked & picked.T)
+
+    W_cap = cap_degree(W_or, 5)
+    assert np.diff(W_cap.indptr).max() <= 5
+    assert_allclose(W_cap.toarray(), W_cap.T.toarray())
+
+    W = W_or.copy()
+    W.data = np.exp(-W.data**2)
+    W_sp = spectral_sparsify(W, 0.5, random_state=0)
+    assert_allclose(W_sp.toarray(), W_sp.T.toarray())
+    assert abs(W_sp.nnz - 0.5 * W.nnz) < 0.1 * W.nnz
+    # the total degree is preserved in expectation
+    assert abs(W_sp.sum() / W.sum() - 1) < 0.05
+
+
+def test_local_scaling():
+    """The self-tuning kernel uses the k-th neighbor distance scales"""
+    from scipy.spatial.distance import cdist
+    from utils.graph import compute_adjacency
+    rng = np.random.RandomState(0)
+    X = np.vstack((rng.rand(200, 2), 10 * rng.rand(200, 2)))
+
+    W = compute_adjacency(X, n_neighbors=6, weight='local', cache=False)
+    D = cdist(X, X)
+    sigma = np.sort(D, axis=1)[:, 6]
+    i, j = W.nonzero()
+    assert_allclose(W.data, np.exp(-D[i, j]**2 / (sigma[i] * sigma[j])))
+
+    # the weights do not depend on the scale of the data
+    W_scaled = compute_adjacency(100 * X, n_neighbors=6, weight='local',
+                                 cache=False)
+    assert_allclose(W_scaled.toarray(), W.toarray(), rtol=1e-6)
+
+
+def test_angle_weight():
+    """The spectral angle kernel is applied to the kNN graph of the unit
+    vectors"""
+    from utils.graph import compute_adjacency
+    X = np.random.RandomState(0).rand(300, 10)
+    W = compute_adjacency(X, n_neighbors=5, weight='angle', cache=False)
+
+    Xn = X / np.linalg.norm(X, axis=1)[:, None]
+    i, j = W.nonzero()
+    theta = np.arccos(np.clip(np.sum(Xn[i] * Xn[j], axis=1), -1, 1))
+    assert_allclose(W.data, np.exp(-theta), atol=1e-7)
+    assert not np.isnan(W.data).any()
+
+    # every backend searches the same unit vectors
+    for algorithm in ['kd_tree', 'ball_tree', 'annoy']:
+        W_alg = compute_adjacency(X, n_neighbors=5, weight='angle',
+                                  neighbors_algorithm=algorithm, cache=False)
+        i, j = W_alg.nonzero()
+        theta = np.arccos(np.clip(np.sum(Xn[i] * Xn[j], axis=1), -1, 1))
+        assert_allclose(W_alg.data, np.exp(-theta), atol=1e-6)
+
+
+def test_float32_graph():
+    """The adjacency and Laplacian stay in float32"""
+    from utils.graph import compute_adjacency, create_laplacian
+    X = np.random.RandomState(0).rand(300, 4)
+    W64 = compute_adjacency(X, n_neighbors=5, cache=False)
+    W = compute_adjacency(X.astype(np.float32), n_neighbors=5,
+                          dtype=np.float32, cache=False)
+    assert_equal(W.dtype, np.float32)
+    assert_allclose(W.toarray(), W64.toarray(), atol=1e-6)
+
+    L, D = create_laplacian(W)
+    assert_equal(L.dtype, np.float32)
+    assert_equal(D.dtype, np.float32)
@@ -0,0 +1,205 @@
+import numpy as np
+from numpy.testing import assert_equal, assert_allclose, assert_raises
+
+from utils.knn_solvers import KnnSolver, ann_annoy
+
+
+def test_ann_annoy_batched_distances():
+    """Batched annoy queries match the per-item annoy distances"""
+    rng = np.random.RandomState(0)
+    X = rng.rand(300, 8)
+    distVals, idx = ann_annoy(X, n_neighbors=5, n_jobs=2, batch_size=32)
+
+    assert_equal(idx.shape, (300, 5))
+    assert_equal(idx[:, 0], np.arange(300))
+    assert_allclose(distVals,
+                    np.linalg.norm(X[idx] - X[:, None, :], axis=2),
+                    rtol=1E-5)
+
+
+def test_knn_solver_n_jobs_blocks():
+    """Blocked multi-threaded queries reassemble the serial result"""
+    rng = np.random.RandomState(0)
+    X = rng.rand(500, 10)
+    for nn_algorithm in ['brute', 'kd_tree', 'ball_tree']:
+        serial = KnnSolver(n_neighbors=4, nn_algorithm=nn_algorithm,
+                           n_jobs=1, cache=False).find_knn(X)
+        blocked = KnnSolver(n_neighbors=4, nn_algorithm=nn_algorithm,
+                            n_jobs=3, batch_size=64,
+                            cache=False).find_knn(X)
+        assert_equal(blocked[1], serial[1])
+        assert_allclose(blocked[0], serial[0])
+
+
+def test_knn_brute_memory_budget():
+    """The tiled GEMM kNN matches scikit-learn under a tiny budget"""
+    from utils.knn_solvers import knn_brute, knn_scikit
+    rng = np.random.RandomState(0)
+    X = rng.rand(700, 20)
+    distVals, idx = knn_brute(X, n_neighbors=6, max_memory_mb=0.5,
+                              n_jobs=2)
+    sk_dist, sk_idx = knn_scikit(X, n_neighbors=6)
+
+    assert_equal(idx, sk_idx)
+    assert_allclose(distVals, sk_dist, atol=1E-6)
+
+
+def test_knn_cache_slices_smaller_k():
+    """A smaller k is sliced from the cached search and the LRU bound
+    evicts old entries"""
+    from utils.knn_solvers import KnnCache
+    rng = np.random.RandomState(0)
+    X = rng.rand(200, 5)
+    cache = KnnCache(max_memory_mb=1)
+
+    large = KnnSolver(n_neighbors=8, cache=cache).find_knn(X)
+    small = KnnSolver(n_neighbors=3, nn_algorithm='kd_tree',
+                      cache=cache).find_knn(X)
+    assert_equal(small[1], large[1][:, :4])
+    assert small[1].base is not None
+
+    uncached = KnnSolver(n_neighbors=3, cache=False).find_knn(X)
+    assert_equal(small[1], uncached[1])
+
+    # ~1.3 MB for the second data set: the first one is evicted
+    X_other = rng.rand(8000, 5)
+    KnnSolver(n_neighbors=9, cache=cache).find_knn(X_other)
+    assert cache.get(KnnSolver(cache=cache).search_key(X), 3) is None
+
+
+def test_lsh_recall_knob():
+    """More LSH candidates give a higher recall of the exact neighbors"""
+    rng = np.random.RandomState(0)
+    centers = rng.rand(20, 30)
+    X = centers[rng.randint(0, 20, 2000)] + 0.05 * rng.randn(2000, 30)
+    _, exact = KnnSolver(n_neighbors=5, cache=False).find_knn(X)
+
+    recall = []
+    for n_candidates in [4, 32]:
+        _, idx = KnnSolver(n_neighbors=5, nn_algorithm='lsh',
+                           n_candidates=n_candidates,
+                           cache=False).find_knn(X)
+        assert_equal(idx[:, 0], np.arange(2000))
+        recall.append(np.mean([len(set(a) & set(b)) / 6.
+                               for a, b in zip(idx, exact)]))
+    assert recall[0] < recall[1]
+    assert recall[1] > 0.9
+
+
+def test_nndescent_graph():
+    """NN-Descent recovers most of the exact kNN graph"""
+    rng = np.random.RandomState(0)
+    centers = rng.rand(20, 10)
+    X = centers[rng.randint(0, 20, 1500)] + 0.05 * rng.randn(1500, 10)
+    _, exact = KnnSolver(n_neighbors=5, cache=False).find_knn(X)
+
+    distVals, idx = KnnSolver(n_neighbors=5, nn_algorithm='nndescent',
+                              n_jobs=2, cache=False).find_knn(X)
+    assert_equal(idx[:, 0], np.arange(1500))
+    assert_allclose(distVals,
+                    np.linalg.norm(X[idx] - X[:, None, :], axis=2),
+                    atol=1E-6)
+    assert np.mean([len(set(a) & set(b)) / 6.
+                    for a, b in zip(idx, exact)]) > 0.9
+
+
+def test_ivfpq_codebooks_roundtrip(tmpdir):
+    """IVF-PQ finds the exact neighbors with re-ranking and reuses saved
+    codebooks"""
+    from utils.knn_solvers import IVFPQIndex
+    rng = np.random.RandomState(0)
+    centers = rng.rand(10, 16)
+    X = centers[rng.randint(0, 10, 1000)] + 0.05 * rng.randn(1000, 16)
+    _, exact = KnnSolver(n_neighbors=5, cache=False).find_knn(X)
+
+    codebooks = str(tmpdir.join('codebooks.npz'))
+    distVals, idx = KnnSolver(n_neighbors=5, nn_algorithm='ivfpq',
+                              n_subquantizers=4, pq_bits=4,
+                              codebooks=codebooks,
+                              cache=False).find_knn(X)
+    assert_equal(idx[:, 0], np.arange(1000))
+    assert np.mean([len(set(a) & set(b)) / 6.
+                    for a, b in zip(idx, exact)]) > 0.9
+
+    index = IVFPQIndex.load(codebooks)
+    assert_equal(len(index.codebooks_), 4)
+    assert_equal(index.codebooks_[0].shape, (16, 4))
+    _, idx_loaded = KnnSolver(n_neighbors=5, nn_algorithm='hdidx',
+                              codebooks=codebooks,
+                              cache=False).find_knn(X)
+    assert_equal(idx_loaded, idx)
+
+
+def test_knn_brute_cosine():
+    """Cosine neighbors from the normalized GEMM path match scikit-learn"""
+    from sklearn.neighbors import NearestNeighbors
+    from utils.knn_solvers import knn_brute
+    X = np.random.RandomState(0).rand(500, 20)
+    distVals, idx = knn_brute(X, n_neighbors=5, metric='cosine',
+                              max_memory_mb=0.1)
+    ref_dist, ref_idx = NearestNeighbors(n_neighbors=6, metric='cosine',
+                                         algorithm='brute').fit(X).kneighbors(X)
+    assert_allclose(distVals, ref_dist, atol=1e-10)
+    assert_equal(np.sort(idx[:, 1:], axis=1), np.sort(ref_idx[:, 1:], axis=1))
+
+
+def test_ann_lsh_rejects_other_metrics():
+    """The LSH search only ranks by euclidean distances"""
+    from utils.knn_solvers import ann_lsh
+    X = np.random.RandomState(0).rand(50, 4)
+    for metric in ['cosine', 'manhattan']:
+        assert_raises(ValueError, KnnSolver(n_neighbors=3, nn_algorithm='lsh',
+                                            metric=metric).find_knn, X)
+    assert_equal(ann_lsh(X, n_neighbors=3)[1].shape, (50, 4))
+
+
+def test_ann_nndescent_rejects_other_metrics():
+    """NN-Descent only ranks by euclidean distances"""
+    X = np.random.RandomState(0).rand(50, 4)
+    for metric in ['cosine', 'manhattan']:
+        assert_raises(ValueError, KnnSolver(n_neighbors=3,
+                                            nn_algorithm='nndescent',
+                                            metric=metric).find_knn, X)
+
+
+def test_ann_ivfpq_rejects_other_metrics():
+    """IVF-PQ only ranks by euclidean distances"""
+    X = np.random.RandomState(0).rand(50, 4)
+    for metric in ['cosine', 'manhattan']:
+        assert_raises(ValueError, KnnSolver(n_neighbors=3,
+                                            nn_algorithm='ivfpq',
+                                            metric=metric).find_knn, X)
+
+
+def test_knn_brute_float32_offset_data():
+    """float32 data far from the origin keeps exact neighbors"""
+    from utils.knn_solvers import knn_brute, knn_scikit
+    rng = np.random.RandomState(0)
+    X = (4000 + 80 * rng.rand(1000, 10)).astype(np.float32)
+    distVals, idx = knn_brute(X, n_neighbors=5)
+    sk_dist, sk_idx = knn_scikit(X.astype(np.float64), n_neighbors=5)
+
+    assert_equal(np.sort(idx, axis=1), np.sort(sk_idx, axis=1))
+    assert_allclose(distVals, sk_dist, atol=1e-4)
+
+
+def test_ivfpq_low_dimensional_data():
+    """Data with fewer dimensions than sub-quantizers gets one per
+    dimension"""
+    from utils.knn_solvers import IVFPQIndex
+    from utils.graph import compute_adjacency
+    X = np.random.RandomState(0).rand(600, 3)
+    index = IVFPQIndex(n_lists=16, random_state=0).fit(X)
+    assert_equal(len(index.codebooks_), 3)
+    assert_equal(index.subspaces_, [0, 1, 2, 3])
+
+    _, exact = KnnSolver(n_neighbors=5, cache=False).find_knn(X)
+    _, idx = KnnSolver(n_neighbors=5, nn_algorithm='ivfpq',
+                       cache=False).find_knn(X)
+    assert_equal(idx.shape, (600, 6))
+    assert np.mean([len(set(a) & set(b)) / 6.
+                    for a, b in zip(idx, exact)]) > 0.9
+
+    W = compute_adjacency(X, n_neighbors=5, neighbors_algorithm='ivfpq',
+                          cache=False)
+    assert_equal(W.shape, (600, 600))
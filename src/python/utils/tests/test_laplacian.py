@@ -0,0 +1,52 @@
+import numpy as np
+from numpy.testing import assert_equal, assert_allclose
+from scipy.sparse import csr_matrix, diags
+from scipy.sparse.csgraph import laplacian as csgraph_laplacian
+
+from utils.laplacian import degrees, laplacian
+
+
+def random_adjacency(n_samples=200, density=0.05, seed=0):
+    rng = np.random.RandomState(seed)
+    W = rng.rand(n_samples, n_samples)
+    W[rng.rand(n_samples, n_samples) > density] = 0
+    W = np.maximum(W, W.T)
+    np.fill_diagonal(W, 0)
+    # an isolated node
+    W[5, :] = W[:, 5] = 0
+    return csr_matrix(W)
+
+
+def test_degrees():
+    """reduceat degrees equal the row sums, including empty rows"""
+    W = random_adjacency()
+    assert_allclose(degrees(W), W.toarray().sum(axis=1))
+    assert_equal(degrees(W.astype(np.float32)).dtype, np.float32)
+
+
+def test_laplacian_variants():
+    """The three Laplacians match their dense definitions"""
+    W = random_adjacency()
+    A = W.toarray()
+    d = A.sum(axis=1)
+
+    L, D = laplacian(W, return_diag=True)
+    assert_allclose(L.toarray(), csgraph_laplacian(A))
+    assert_allclose(D.toarray(), np.diag(d))
+
+    s = np.zeros_like(d)
+    s[d > 0] = 1. / d[d > 0]
+    L = laplacian(W, kind='symmetric')
+    assert_allclose(L.toarray(), csgraph_laplacian(A, normed=True))
+
+    L, d_vec = laplacian(W, kind='rw', return_diag=True, diag_format='array')
+    assert_allclose(d_vec, d)
+    assert_allclose(L.toarray(), np.diag(d > 0) - s[:, None] * A)
+
+    # self-loops cancel out
+    W_loops = W + diags(np.arange(200.))
+    assert_allclose(laplacian(W_loops).toarray(), csgraph_laplacian(A))
+
+    L, D = laplacian(W.astype(np.float32), return_diag=True)
+    assert_equal(L.dtype, np.float32)
+    assert_equal(D.dtype, np.float32)
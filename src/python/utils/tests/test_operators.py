@@ -0,0 +1,52 @@
+import numpy as np
+from numpy.testing import assert_equal, assert_allclose
+
+from utils.graph import compute_adjacency, create_laplacian
+from utils.operators import SumOperator, laplacian_operator
+from utils.eigenvalue_decomposition import eig_scipy
+
+
+def laplacian_and_potential(n_samples=400, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.rand(n_samples, 3)
+    L, D = create_laplacian(compute_adjacency(X, n_neighbors=6,
+                                              cache=False))
+    V, _ = create_laplacian(compute_adjacency(X[:, :2], n_neighbors=4,
+                                              cache=False))
+    return L, D, V
+
+
+def test_sum_operator():
+    """The operator applies L + alpha V without summing the matrices"""
+    L, D, V = laplacian_and_potential()
+    A = laplacian_operator(L, V, 2.5)
+    x = np.random.RandomState(1).rand(400, 3)
+
+    assert isinstance(A, SumOperator)
+    assert_allclose(A.dot(x), (L + 2.5 * V).dot(x))
+    assert_allclose(A.dot(x[:, 0]), (L + 2.5 * V).dot(x[:, 0]))
+    assert_allclose(A.diagonal(), (L + 2.5 * V).diagonal())
+    assert_allclose(A.toarray(), (L + 2.5 * V).toarray())
+    assert_equal(A.astype(np.float32).dtype, np.float32)
+    assert laplacian_operator(L) is L
+
+
+def test_eigensolvers_accept_operators():
+    """ARPACK gives the same eigenpairs for the operator and for the
+    explicit matrix"""
+    L, D, V = laplacian_and_potential()
+    A = laplacian_operator(L, V, 0.5)
+
+    vals, _ = eig_scipy(L + 0.5 * V, D, n_components=4)
+    vals_op, _ = eig_scipy(A, D, n_components=4)
+    assert_allclose(vals_op[:4], vals[:4], atol=1e-8)
+
+
+def test_shifted_matrix():
+    """A - sigma B is assembled from the operator terms"""
+    from utils.eigenvalue_decomposition import shifted_matrix
+    L, D, V = laplacian_and_potential()
+    C = shifted_matrix(laplacian_operator(L, V, 0.5), D, -0.1)
+    assert_allclose(C.toarray(), (L + 0.5 * V + 0.1 * D).toarray())
+    assert_allclose(shifted_matrix(L, None, 2.).toarray(),
+                    L.toarray() - 2. * np.eye(400))